@@ -47,5 +47,6 @@ setup(
     zip_safe=False,
     include_package_data=True,
     install_requires=install_requires,
+    extras_require={'columnar': ['numpy', 'pandas']},
     test_suite='tests'
 )
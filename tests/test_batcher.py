@@ -0,0 +1,175 @@
+from mock import MagicMock
+from twisted.internet.defer import Deferred, inlineCallbacks, succeed
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+
+from twistes.batcher import GetBatcher, SearchBatcher
+from twistes.client import Elasticsearch
+from twistes.consts import EsConst, EsDocProperties
+from twistes.exceptions import NotFoundError, ElasticsearchException, ConnectionTimeout, RequestError
+
+SOME_HOSTS_CONFIG = [{'host': "http://SOME_HOST", 'port': 9200}]
+SOME_INDEX = "SOME_INDEX"
+SOME_DOC_TYPE = "SOME_DOC_TYPE"
+SOME_ID_1 = "SOME_ID_1"
+SOME_ID_2 = "SOME_ID_2"
+
+
+def found_doc(id):
+    return {EsDocProperties.INDEX: SOME_INDEX, EsDocProperties.ID: id, EsConst.FOUND: True}
+
+
+def missing_doc(id):
+    return {EsDocProperties.INDEX: SOME_INDEX, EsDocProperties.ID: id, EsConst.FOUND: False}
+
+
+class TestGetBatcher(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.es = MagicMock()
+        self.batcher = GetBatcher(self.es, window=0.01, max_batch_size=3, clock=self.clock)
+
+    @inlineCallbacks
+    def test_gets_are_sent_as_one_mget(self):
+        self.es.mget = MagicMock(return_value=succeed({'docs': [found_doc(SOME_ID_1), found_doc(SOME_ID_2)]}))
+        d1 = self.batcher.get(SOME_INDEX, SOME_ID_1)
+        d2 = self.batcher.get(SOME_INDEX, SOME_ID_2, SOME_DOC_TYPE)
+        self.assertFalse(self.es.mget.called)
+
+        self.clock.advance(0.01)
+
+        self.es.mget.assert_called_once_with({'docs': [
+            {EsDocProperties.INDEX: SOME_INDEX, EsDocProperties.ID: SOME_ID_1},
+            {EsDocProperties.INDEX: SOME_INDEX, EsDocProperties.ID: SOME_ID_2, EsDocProperties.TYPE: SOME_DOC_TYPE}
+        ]})
+        self.assertEqual(found_doc(SOME_ID_1), (yield d1))
+        self.assertEqual(found_doc(SOME_ID_2), (yield d2))
+
+    def test_full_batch_is_sent_right_away(self):
+        self.es.mget = MagicMock(return_value=Deferred())
+        for _ in range(3):
+            self.batcher.get(SOME_INDEX, SOME_ID_1)
+        self.assertEqual(1, self.es.mget.call_count)
+        self.assertEqual(0, len(self.batcher))
+        self.assertFalse(self.clock.getDelayedCalls())
+
+    @inlineCallbacks
+    def test_missing_doc_raises_not_found(self):
+        index_error = {EsDocProperties.INDEX: SOME_INDEX, EsDocProperties.ID: SOME_ID_2,
+                       'error': {'type': GetBatcher.INDEX_NOT_FOUND}}
+        self.es.mget = MagicMock(return_value=succeed({'docs': [missing_doc(SOME_ID_1), index_error]}))
+        d1 = self.batcher.get(SOME_INDEX, SOME_ID_1)
+        d2 = self.batcher.get(SOME_INDEX, SOME_ID_2)
+        self.batcher.flush()
+        yield self.assertFailure(d1, NotFoundError)
+        yield self.assertFailure(d2, NotFoundError)
+
+    @inlineCallbacks
+    def test_doc_error(self):
+        error_doc = {EsDocProperties.INDEX: SOME_INDEX, EsDocProperties.ID: SOME_ID_1, 'error': 'boom'}
+        self.es.mget = MagicMock(return_value=succeed({'docs': [error_doc]}))
+        d = self.batcher.get(SOME_INDEX, SOME_ID_1)
+        self.batcher.flush()
+        yield self.assertFailure(d, ElasticsearchException)
+
+    @inlineCallbacks
+    def test_mget_failure_fails_all_gets(self):
+        mget_result = Deferred()
+        self.es.mget = MagicMock(return_value=mget_result)
+        d1 = self.batcher.get(SOME_INDEX, SOME_ID_1)
+        d2 = self.batcher.get(SOME_INDEX, SOME_ID_2)
+        self.batcher.flush()
+        mget_result.errback(ConnectionTimeout("test"))
+        yield self.assertFailure(d1, ConnectionTimeout)
+        yield self.assertFailure(d2, ConnectionTimeout)
+
+
+class TestSearchBatcher(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.es = MagicMock()
+        self.batcher = SearchBatcher(self.es, clock=self.clock)
+
+    @inlineCallbacks
+    def test_searches_are_sent_as_one_msearch(self):
+        query = {'query': {'match_all': {}}}
+        response1 = {'hits': {'total': 1}}
+        response2 = {'hits': {'total': 2}}
+        self.es.msearch = MagicMock(return_value=succeed({'responses': [response1, response2]}))
+        d1 = self.batcher.search(SOME_INDEX, SOME_DOC_TYPE, query, routing='some_routing')
+        d2 = self.batcher.search(SOME_INDEX)
+        self.clock.advance(0)
+
+        self.es.msearch.assert_called_once_with([
+            {'index': SOME_INDEX, 'type': SOME_DOC_TYPE, 'routing': 'some_routing'}, query,
+            {'index': SOME_INDEX}, {}
+        ])
+        self.assertEqual(response1, (yield d1))
+        self.assertEqual(response2, (yield d2))
+
+    @inlineCallbacks
+    def test_failed_responses_are_mapped_to_exceptions(self):
+        self.es.msearch = MagicMock(return_value=succeed({'responses': [
+            {'error': 'no such index', 'status': 404},
+            {'error': 'parse error', 'status': 400},
+            {'error': 'boom', 'status': 500},
+            {'hits': {}}
+        ]}))
+        ds = [self.batcher.search(SOME_INDEX) for _ in range(4)]
+        self.batcher.flush()
+        yield self.assertFailure(ds[0], NotFoundError)
+        yield self.assertFailure(ds[1], RequestError)
+        yield self.assertFailure(ds[2], ElasticsearchException)
+        self.assertEqual({'hits': {}}, (yield ds[3]))
+
+    @inlineCallbacks
+    def test_responses_count_mismatch_fails_all(self):
+        self.es.msearch = MagicMock(return_value=succeed({'responses': [{'hits': {}}]}))
+        d1 = self.batcher.search(SOME_INDEX)
+        d2 = self.batcher.search(SOME_INDEX)
+        self.batcher.flush()
+        yield self.assertFailure(d1, ElasticsearchException)
+        yield self.assertFailure(d2, ElasticsearchException)
+
+
+class TestElasticsearchSearchBatching(TestCase):
+
+    def setUp(self):
+        self.es = Elasticsearch(SOME_HOSTS_CONFIG, 10, MagicMock(), batch_searches=True)
+        self.es._search_batcher = MagicMock()
+        self.es._search_batcher.search = MagicMock(return_value=succeed({}))
+        self.es._perform_read_request = MagicMock(return_value=succeed({}))
+        self.es._perform_request = MagicMock(return_value=succeed({}))
+
+    @inlineCallbacks
+    def test_search_goes_through_the_batcher(self):
+        yield self.es.search(SOME_INDEX, body={}, preference='_local')
+        self.es._search_batcher.search.assert_called_once_with(SOME_INDEX, None, {}, preference='_local')
+
+    @inlineCallbacks
+    def test_search_with_other_params_is_not_batched(self):
+        yield self.es.search(SOME_INDEX, body={}, size=10)
+        yield self.es.search(SOME_INDEX, body={}, scroll='1m')
+        self.assertFalse(self.es._search_batcher.search.called)
+
+
+class TestElasticsearchGetBatching(TestCase):
+
+    def setUp(self):
+        self.es = Elasticsearch(SOME_HOSTS_CONFIG, 10, MagicMock(), batch_gets=True)
+        self.es._get_batcher = MagicMock()
+        self.es._get_batcher.get = MagicMock(return_value=succeed(found_doc(SOME_ID_1)))
+
+    @inlineCallbacks
+    def test_get_goes_through_the_batcher(self):
+        result = yield self.es.get(SOME_INDEX, SOME_ID_1)
+        self.assertEqual(found_doc(SOME_ID_1), result)
+        self.es._get_batcher.get.assert_called_once_with(SOME_INDEX, SOME_ID_1, EsConst.ALL_VALUES, None)
+
+    @inlineCallbacks
+    def test_get_with_query_params_is_not_batched(self):
+        self.es._perform_read_request = MagicMock(return_value=succeed(found_doc(SOME_ID_1)))
+        yield self.es.get(SOME_INDEX, SOME_ID_1, routing='some_routing')
+        self.assertFalse(self.es._get_batcher.get.called)
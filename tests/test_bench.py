@@ -0,0 +1,206 @@
+from mock import MagicMock
+from twisted.internet.defer import inlineCallbacks, succeed
+from twisted.internet.task import Clock, deferLater
+from twisted.trial.unittest import TestCase
+
+from twistes.bench.fake_server import start_fake_server, hosts_of, Fault
+from twistes.bench.histogram import LatencyHistogram
+from twistes.bench.load import LoadGenerator, format_report
+from twistes.bench.suite import BenchmarkSuite, percentile
+from twistes.client import Elasticsearch
+from twistes.exceptions import ConnectionTimeout, ScanError
+
+
+class TestBenchmarkSuite(TestCase):
+
+    def setUp(self):
+        self.listening_port, self.server = start_fake_server(total_hits=25, rejection_rate=0.5, seed=1)
+        self.es = Elasticsearch(hosts_of(self.listening_port))
+        self.addCleanup(self.listening_port.stopListening)
+        self.addCleanup(self.es.close)
+
+    @inlineCallbacks
+    def test_workloads_against_fake_server(self):
+        suite = BenchmarkSuite(self.es, self.server, requests=4, concurrency=2, docs_per_request=10)
+        search, get, bulk, scan = yield suite.run()
+
+        self.assertEqual(4, search.requests)
+        self.assertEqual(40, search.docs)
+        self.assertEqual(4, get.docs)
+        self.assertEqual(40, bulk.docs)
+        # 3 pages of 10, 10 and 5 hits per scan
+        self.assertEqual(100, scan.docs)
+        self.assertEqual(12, scan.requests)
+        self.assertTrue(bulk.bytes > 0)
+        self.assertEqual(4, len(get.latencies))
+
+    @inlineCallbacks
+    def test_bulk_rejections(self):
+        success, failed = yield self.es.bulk_utils.bulk(
+            ({'_index': 'bench', '_type': 'doc', '_id': str(i), 'value': i} for i in range(100)),
+            stats_only=True, raise_on_error=False)
+
+        self.assertEqual(100, success + failed)
+        self.assertTrue(0 < failed < 100)
+
+    def test_percentile(self):
+        self.assertEqual(50, percentile(list(range(101)), 50))
+        self.assertEqual(99, percentile(list(range(101)), 99))
+        self.assertEqual(0, percentile([], 50))
+
+
+class TestFaultInjection(TestCase):
+
+    def setUp(self):
+        self.listening_port, self.server = start_fake_server(total_hits=25)
+        self.addCleanup(self.listening_port.stopListening)
+
+    def create_client(self, **kwargs):
+        es = Elasticsearch(hosts_of(self.listening_port), **kwargs)
+        self.addCleanup(es.close)
+        return es
+
+    @inlineCallbacks
+    def test_dropped_connection(self):
+        es = self.create_client()
+        self.server.inject(Fault.DROP, endpoint='get')
+        yield self.assertFailure(es.get('bench', '1', doc_type='doc'), ConnectionTimeout)
+
+        doc = yield es.get('bench', '1', doc_type='doc')
+        self.assertEqual('1', doc['_id'])
+        self.assertEqual({Fault.DROP: 1}, self.server.stats.faults)
+
+    @inlineCallbacks
+    def test_dropped_connection_is_retried(self):
+        es = self.create_client(retry_on_timeout=True)
+        self.server.inject(Fault.DROP, times=2)
+        doc = yield es.get('bench', '1', doc_type='doc')
+        self.assertEqual('1', doc['_id'])
+        self.assertEqual(3, self.server.stats.requests)
+
+    @inlineCallbacks
+    def test_shard_failure_fails_the_scan(self):
+        es = self.create_client()
+        self.server.inject(Fault.SHARD_FAILURE, endpoint='scroll')
+        scroller = yield es.scan('bench', 'doc', size=10)
+        hits = yield next(scroller)
+        self.assertEqual(10, len(hits))
+        yield self.assertFailure(next(scroller), ScanError)
+
+    @inlineCallbacks
+    def test_rejected_bulk(self):
+        es = self.create_client()
+        self.server.inject(Fault.REJECT)
+        success, failed = yield es.bulk_utils.bulk(
+            ({'_index': 'bench', '_type': 'doc', '_id': str(i), 'value': i} for i in range(10)),
+            stats_only=True, raise_on_error=False)
+        self.assertEqual((0, 10), (success, failed))
+
+    @inlineCallbacks
+    def test_msearch(self):
+        es = self.create_client()
+        result = yield es.msearch([{}, {'size': 3}, {}, {'size': 5}])
+        self.assertEqual([3, 5], [len(response['hits']['hits']) for response in result['responses']])
+
+    @inlineCallbacks
+    def test_minimal_bulk_responses(self):
+        es = self.create_client(minimal_bulk_responses=True)
+        self.server.rejection_rate = 0.5
+        success, errors = yield es.bulk_utils.bulk(
+            ({'_index': 'bench', '_type': 'doc', '_id': str(i), 'value': i} for i in range(20)),
+            raise_on_error=False)
+
+        self.assertEqual(20, success + len(errors))
+        self.assertTrue(errors)
+        for error in errors:
+            self.assertEqual(['index'], list(error))
+            self.assertEqual(429, error['index']['status'])
+            self.assertEqual('bench', error['index']['_index'])
+            self.assertIn('_id', error['index'])
+
+    @inlineCallbacks
+    def test_scan_with_filter_path(self):
+        es = self.create_client()
+        scroller = yield es.scan('bench', 'doc', size=10, filter_path='hits.hits._id')
+        pages = []
+        for page in scroller:
+            hits = yield page
+            pages.append(hits)
+
+        self.assertEqual([10, 10, 5], [len(hits) for hits in pages])
+        self.assertEqual({'_id'}, set(key for hits in pages for hit in hits for key in hit))
+
+    def test_faults_only_apply_to_their_endpoints(self):
+        self.server.inject(Fault.REJECT)
+        self.assertIsNone(self.server._choose_fault('search'))
+        self.assertEqual(Fault.REJECT, self.server._choose_fault('bulk'))
+        self.assertIsNone(self.server._choose_fault('bulk'))
+
+
+class TestLatencyHistogram(TestCase):
+
+    def test_percentiles_keep_the_precision(self):
+        histogram = LatencyHistogram(significant_figures=3)
+        for i in range(1, 10001):
+            histogram.record(i / 1000.0)
+
+        self.assertEqual(10000, histogram.count)
+        for percentile, expected in ((50, 5.0), (90, 9.0), (99, 9.9), (100, 10.0)):
+            self.assertTrue(abs(expected - histogram.percentile(percentile)) <= expected * 0.001)
+        self.assertAlmostEqual(5.0005, histogram.mean, places=6)
+
+    def test_merge(self):
+        histogram, other = LatencyHistogram(), LatencyHistogram()
+        histogram.record(0.001)
+        other.record(0.002, count=3)
+        histogram.merge(other)
+
+        self.assertEqual(4, histogram.count)
+        self.assertAlmostEqual(0.002, histogram.percentile(50))
+        self.assertAlmostEqual(0.001, histogram.min)
+
+
+class TestLoadGenerator(TestCase):
+
+    def test_open_loop_arrival_rate(self):
+        clock = Clock()
+        es = MagicMock()
+        es.search = MagicMock(side_effect=lambda *args, **kwargs: deferLater(clock, 0.5, lambda: {}))
+        es.get = MagicMock(side_effect=lambda *args, **kwargs: succeed({}))
+        load = LoadGenerator(es, {'search': 1, 'get': 1}, users=100, duration=1, rate=100, seed=1, clock=clock)
+
+        d = load.run()
+        clock.pump([0.01] * 200)
+        stats = self.successResultOf(d)
+
+        self.assertEqual(100, stats['search'].count + stats['get'].count)
+        self.assertAlmostEqual(0.5, stats['search'].histogram.percentile(50), places=2)
+        self.assertEqual(0, stats['get'].histogram.percentile(99))
+
+    def test_open_loop_counts_the_wait_for_a_free_user(self):
+        clock = Clock()
+        es = MagicMock()
+        es.search = MagicMock(side_effect=lambda *args, **kwargs: deferLater(clock, 0.1, lambda: {}))
+        load = LoadGenerator(es, {'search': 1}, users=1, duration=1, rate=20, clock=clock)
+
+        d = load.run()
+        clock.pump([0.01] * 300)
+        stats = self.successResultOf(d)
+
+        # each search takes 0.1s but one arrives every 0.05s, so the queue grows
+        self.assertEqual(20, stats['search'].count)
+        self.assertTrue(stats['search'].histogram.max > 0.9)
+
+    @inlineCallbacks
+    def test_closed_loop_against_fake_server(self):
+        listening_port, _ = start_fake_server()
+        self.addCleanup(listening_port.stopListening)
+        es = Elasticsearch(hosts_of(listening_port))
+        self.addCleanup(es.close)
+        load = LoadGenerator(es, {'search': 1, 'get': 1, 'index': 1, 'bulk': 1}, users=2, duration=0.2,
+                             bulk_size=10)
+
+        stats = yield load.run()
+        self.assertTrue(all(op_stats.count > 0 for op_stats in stats.values()))
+        self.assertTrue(all(op_stats.error_count == 0 for op_stats in stats.values()))
+        self.assertIn('search', format_report(stats, load.elapsed, distribution=True))
@@ -0,0 +1,104 @@
+import json
+import shutil
+import tempfile
+
+from mock import MagicMock
+from twisted.internet.defer import succeed, fail
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+
+from twistes.bulk_indexer import BulkIndexer
+from twistes.bulk_utils import BulkUtility
+from twistes.exceptions import BulkIndexError, ConnectionTimeout, ElasticsearchException
+from twistes.spill_queue import SpillQueue
+
+SOME_INDEX = 'some_index'
+SOME_DOC_TYPE = 'some_doc_type'
+
+
+def create_action(id):
+    return {'_index': SOME_INDEX, '_type': SOME_DOC_TYPE, '_id': id, '_source': {'value': id}}
+
+
+def create_item(id, status=201):
+    return {'index': {'_id': id, 'status': status}}
+
+
+class TestBulkIndexer(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.es = MagicMock()
+        self.es.bulk = MagicMock(side_effect=self.bulk_response)
+        self.statuses = {}
+        self.indexer = BulkIndexer(self.es, chunk_size=3, flush_interval=1, bulk_utils=BulkUtility(self.es),
+                                   clock=self.clock, refresh='true')
+
+    def bulk_response(self, body, **kwargs):
+        lines = body.strip().split('\n')
+        ids = [json.loads(line)['index']['_id'] for line in lines[::2]]
+        return succeed({'items': [create_item(id, self.statuses.get(id, 201)) for id in ids]})
+
+    def test_flush_after_interval(self):
+        d1 = self.indexer.add(create_action('1'))
+        d2 = self.indexer.add(create_action('2'))
+        self.assertNoResult(d1)
+        self.assertFalse(self.es.bulk.called)
+
+        self.clock.advance(1)
+        self.assertEqual(create_item('1'), self.successResultOf(d1))
+        self.assertEqual(create_item('2'), self.successResultOf(d2))
+        self.es.bulk.assert_called_once_with(self.es.bulk.call_args[0][0], refresh='true')
+
+    def test_full_chunk_is_sent_right_away(self):
+        deferreds = [self.indexer.add(create_action(str(i))) for i in range(4)]
+
+        self.assertEqual(1, self.es.bulk.call_count)
+        self.successResultOf(deferreds[2])
+        self.assertNoResult(deferreds[3])
+        self.assertEqual(1, len(self.indexer))
+
+    def test_failed_item_fails_its_deferred_only(self):
+        self.statuses['2'] = 400
+        d1 = self.indexer.add(create_action('1'))
+        d2 = self.indexer.add(create_action('2'))
+        self.indexer.flush()
+
+        self.successResultOf(d1)
+        failure = self.failureResultOf(d2, BulkIndexError)
+        self.assertEqual([create_item('2', 400)], failure.value.errors)
+
+    def test_transport_error_fails_the_chunk(self):
+        self.es.bulk = MagicMock(return_value=fail(ConnectionTimeout('timeout')))
+        d = self.indexer.add(create_action('1'))
+        self.indexer.flush()
+        self.failureResultOf(d, ConnectionTimeout)
+
+    def test_close_flushes(self):
+        d = self.indexer.add(create_action('1'))
+        self.successResultOf(self.indexer.close())
+        self.successResultOf(d)
+
+    def test_spilled_chunk_fails_its_deferreds(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        queue = SpillQueue(directory, segment_size=1024)
+        self.addCleanup(queue.close)
+        self.es.bulk = MagicMock(return_value=fail(ConnectionTimeout('timeout')))
+        bulk_utils = BulkUtility(self.es, spill_queue=queue, clock=self.clock)
+        indexer = BulkIndexer(self.es, bulk_utils=bulk_utils, clock=self.clock)
+
+        d = indexer.add(create_action('1'))
+        indexer.flush()
+        failure = self.failureResultOf(d, BulkIndexError)
+        self.assertTrue(failure.value.errors[0]['index']['spilled'])
+        self.assertEqual(1, len(queue))
+
+    def test_missing_results_fail_their_deferreds(self):
+        self.es.bulk = MagicMock(return_value=succeed({'items': [create_item('1')]}))
+        d1 = self.indexer.add(create_action('1'))
+        d2 = self.indexer.add(create_action('2'))
+        self.indexer.flush()
+
+        self.successResultOf(d1)
+        self.failureResultOf(d2, ElasticsearchException)
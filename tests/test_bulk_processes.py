@@ -0,0 +1,117 @@
+from mock import MagicMock
+from twisted.internet.defer import inlineCallbacks
+from twisted.trial.unittest import TestCase
+
+from twistes.bench.fake_server import start_fake_server, hosts_of
+from twistes.bulk_processes import BulkProcessPool, BulkWorkerError, _FrameReader, _frame
+from twistes.bulk_utils import BulkUtility
+from twistes.consts import EsDocProperties
+from twistes.exceptions import BulkIndexError, ImproperlyConfigured
+
+
+def actions(count):
+    return ({EsDocProperties.INDEX: 'bench', EsDocProperties.TYPE: 'doc', EsDocProperties.ID: str(i),
+             EsDocProperties.SOURCE: {'value': i}} for i in range(count))
+
+
+class TestBulkProcessPool(TestCase):
+
+    def setUp(self):
+        self.listening_port, self.server = start_fake_server()
+        self.addCleanup(self.listening_port.stopListening)
+        self.pool = BulkProcessPool(hosts_of(self.listening_port), processes=2)
+        self.pool.start()
+        self.addCleanup(self.pool.close)
+
+    @inlineCallbacks
+    def test_bulk(self):
+        success, errors = yield self.pool.bulk(actions(100), batch_size=10, chunk_size=5)
+
+        self.assertEqual((100, []), (success, errors))
+        # each worker sent its batches in chunks of 5, one of them partial
+        self.assertTrue(20 <= self.server.stats.requests <= 22)
+
+    @inlineCallbacks
+    def test_stats_only(self):
+        self.server.rejection_rate = 1
+        stats = yield self.pool.bulk(actions(30), stats_only=True, raise_on_error=False, batch_size=7)
+
+        self.assertEqual((0, 30), stats)
+
+    @inlineCallbacks
+    def test_failed_items_raise(self):
+        self.server.rejection_rate = 1
+        error = yield self.assertFailure(self.pool.bulk(actions(10)), BulkIndexError)
+
+        self.assertEqual(10, len(error.errors))
+
+    @inlineCallbacks
+    def test_failed_items_stop_the_bulk(self):
+        pool = BulkProcessPool(hosts_of(self.listening_port), processes=1, max_batches_in_flight=1)
+        pool.start()
+        self.addCleanup(pool.close)
+        self.server.rejection_rate = 1
+        yield self.assertFailure(pool.bulk(actions(40), batch_size=5), BulkIndexError)
+
+        self.assertTrue(self.server.stats.requests < 8)
+
+    @inlineCallbacks
+    def test_workers_send_back_only_the_counts_and_failed_items(self):
+        batches = []
+        for worker in self.pool._workers:
+            worker.run_batch = MagicMock(side_effect=worker.run_batch)
+            batches.append(worker.run_batch)
+        stats = yield self.pool.bulk(actions(20), stats_only=True, batch_size=5)
+
+        self.assertEqual((20, 0), stats)
+        params = [call[0][2] for run_batch in batches for call in run_batch.call_args_list]
+        self.assertTrue(params)
+        self.assertTrue(all('verbose' not in batch_params for batch_params in params))
+
+    @inlineCallbacks
+    def test_verbose(self):
+        results = yield self.pool.bulk(actions(10), verbose=True, batch_size=3)
+
+        self.assertEqual(10, len(results))
+        self.assertEqual(sorted(str(i) for i in range(10)),
+                         sorted(item['index'][EsDocProperties.ID] for ok, item in results))
+
+    @inlineCallbacks
+    def test_bulk_utility_process_mode(self):
+        bulk_utility = BulkUtility(MagicMock(), process_pool=self.pool)
+        stats = yield bulk_utility.bulk(actions(10), stats_only=True)
+
+        self.assertEqual((10, 0), stats)
+
+    @inlineCallbacks
+    def test_bulk_utility_settings_are_forwarded(self):
+        bulk_utility = BulkUtility(MagicMock(), process_pool=self.pool, minimal_responses=True)
+        results = yield bulk_utility.bulk(actions(4), verbose=True)
+
+        # the workers requested only the status of each item
+        self.assertEqual([(True, {'index': {'status': 201}})] * 4, results)
+
+    def test_spill_queue_is_not_supported(self):
+        self.assertRaises(ImproperlyConfigured, BulkUtility, MagicMock(), spill_queue=[], process_pool=self.pool)
+
+    @inlineCallbacks
+    def test_not_started(self):
+        yield self.assertFailure(BulkProcessPool([]).bulk(actions(1)), BulkWorkerError)
+
+    def test_actions_of_a_document_go_to_the_same_worker(self):
+        shards = set(self.pool._shard({EsDocProperties.ID: '42'}) for _ in range(10))
+        self.assertEqual(1, len(shards))
+        self.assertEqual({0, 1}, set(self.pool._shard({EsDocProperties.SOURCE: {}}) for _ in range(2)))
+
+
+class TestFrameReader(TestCase):
+
+    def test_messages_split_across_reads(self):
+        messages = []
+        reader = _FrameReader(messages.append)
+        data = _frame(('done', 1, [1, 2])) + _frame(('done', 2, 'x' * 1000))
+
+        for offset in range(0, len(data), 7):
+            reader.feed(data[offset:offset + 7])
+
+        self.assertEqual([('done', 1, [1, 2]), ('done', 2, 'x' * 1000)], messages)
@@ -2,11 +2,12 @@ from __future__ import division
 import json
 
 import math
-from mock import MagicMock
-from twisted.internet.defer import succeed, inlineCallbacks
+from mock import MagicMock, patch
+from twisted.internet.defer import DeferredList, succeed, fail, inlineCallbacks
+from twisted.internet.threads import deferToThread
 from twisted.trial.unittest import TestCase
 
-from twistes.bulk_utils import BulkUtility, ActionParser
+from twistes.bulk_utils import BulkUtility, ActionParser, SuccessfulBulkResults
 from twistes.consts import EsBulk, EsDocProperties
 from twistes.exceptions import BulkIndexError, ConnectionTimeout
 
@@ -169,6 +170,16 @@ class TestBulkUtility(TestCase):
 
         self.assertEqual([expected], chunks)
 
+    def test__chunk_actions_indices(self):
+        actions = [(self._create_action_row(EsBulk.INDEX, index, SOME_DOC_TYPE, SOME_ID), SOME_DOC)
+                   for index in (SOME_INDEX, 'other_index')]
+
+        chunk, = self.bulk_utility._chunk_actions(actions, chunk_size=20, max_chunk_bytes=100000,
+                                                  collect_indices=True)
+        self.assertEqual({SOME_INDEX, 'other_index'}, chunk.indices)
+        chunk, = self.bulk_utility._chunk_actions(actions, chunk_size=20, max_chunk_bytes=100000)
+        self.assertFalse(hasattr(chunk, 'indices'))
+
     @inlineCallbacks
     def test__process_bulk_chunk_good_results(self):
         op_type1 = EsBulk.INDEX
@@ -252,3 +263,235 @@ class TestBulkUtility(TestCase):
                           dump_actions,
                           Exception(),
                           raise_on_error=True)
+
+
+class TestBulkResultCallback(TestCase):
+
+    def setUp(self):
+        self.es = MagicMock()
+        self.es.bulk = MagicMock(side_effect=self.bulk_response)
+        self.bulk_utility = BulkUtility(self.es)
+
+    @staticmethod
+    def bulk_response(body, **kwargs):
+        ids = [json.loads(line)[EsBulk.INDEX][EsDocProperties.ID] for line in body.strip().split('\n')[::2]]
+        return succeed({'items': [{EsBulk.INDEX: {EsDocProperties.ID: id, 'status': 400 if id == '3' else 201}}
+                                  for id in ids]})
+
+    @inlineCallbacks
+    def test_results_are_correlated_with_their_actions(self):
+        actions = ({EsDocProperties.INDEX: SOME_INDEX, EsDocProperties.TYPE: SOME_DOC_TYPE,
+                    EsDocProperties.ID: str(i), EsDocProperties.SOURCE: SOME_DOC} for i in range(5))
+        results = []
+
+        def collect(action, ok, item):
+            results.append((action[EsDocProperties.ID], ok, item[EsBulk.INDEX][EsDocProperties.ID]))
+
+        stats = yield self.bulk_utility.bulk(actions, chunk_size=2, result_callback=collect)
+
+        self.assertEqual((4, 1), stats)
+        self.assertEqual(3, self.es.bulk.call_count)
+        self.assertEqual([(str(i), i != 3, str(i)) for i in range(5)], results)
+
+    @inlineCallbacks
+    def test_actions_missing_from_the_response_fail(self):
+        self.es.bulk = MagicMock(return_value=succeed({'items': [{EsBulk.INDEX: {EsDocProperties.ID: '0',
+                                                                                 'status': 201}}]}))
+        actions = [{EsDocProperties.INDEX: SOME_INDEX, EsDocProperties.TYPE: SOME_DOC_TYPE,
+                    EsDocProperties.ID: str(i), EsDocProperties.SOURCE: SOME_DOC} for i in range(3)]
+        results = []
+
+        stats = yield self.bulk_utility.bulk(actions, result_callback=lambda action, ok, item: results.append(
+            (action[EsDocProperties.ID], ok, item[EsBulk.INDEX][EsDocProperties.ID])))
+
+        self.assertEqual((1, 2), stats)
+        self.assertEqual([('0', True, '0'), ('1', False, '1'), ('2', False, '2')], results)
+
+    @inlineCallbacks
+    def test_actions_missing_from_the_response_raise(self):
+        self.es.bulk = MagicMock(return_value=succeed({'items': []}))
+        actions = [{EsDocProperties.INDEX: SOME_INDEX, EsDocProperties.TYPE: SOME_DOC_TYPE,
+                    EsDocProperties.ID: '0', EsDocProperties.SOURCE: SOME_DOC}]
+
+        d = self.bulk_utility.bulk(actions, raise_on_error=True, result_callback=MagicMock())
+        error = yield self.assertFailure(d, BulkIndexError)
+        self.assertEqual(1, len(error.errors))
+
+    @inlineCallbacks
+    def test_transport_error_reports_every_action(self):
+        self.es.bulk = MagicMock(side_effect=lambda *args, **kwargs: fail(ConnectionTimeout('timeout')))
+        actions = [{EsDocProperties.INDEX: SOME_INDEX, EsDocProperties.TYPE: SOME_DOC_TYPE,
+                    EsDocProperties.ID: str(i), EsDocProperties.SOURCE: SOME_DOC} for i in range(3)]
+        results = []
+
+        stats = yield self.bulk_utility.bulk(actions, chunk_size=2, raise_on_exception=False,
+                                             result_callback=lambda action, ok, item: results.append((ok, item)))
+
+        self.assertEqual((0, 3), stats)
+        self.assertEqual([str(i) for i in range(3)], [item[EsBulk.INDEX][EsDocProperties.ID] for _, item in results])
+        self.assertTrue(all(not ok and 'timeout' in item[EsBulk.INDEX]['error'] for ok, item in results))
+
+    @inlineCallbacks
+    def test_spilled_chunk_reports_every_action(self):
+        self.bulk_utility.spill_queue = MagicMock()
+        self.bulk_utility._schedule_replay = MagicMock()
+        actions = [{EsDocProperties.INDEX: SOME_INDEX, EsDocProperties.TYPE: SOME_DOC_TYPE,
+                    EsDocProperties.ID: str(i), EsDocProperties.SOURCE: SOME_DOC} for i in range(2)]
+        results = []
+
+        stats = yield self.bulk_utility.bulk(actions, result_callback=lambda action, ok, item: results.append(item))
+
+        self.assertEqual((0, 2), stats)
+        self.assertFalse(self.es.bulk.called)
+        self.assertTrue(all(item[EsBulk.INDEX][EsBulk.SPILLED] for item in results))
+
+
+class TestOffloadedBulk(TestCase):
+
+    def setUp(self):
+        self.es = MagicMock()
+        self.es.bulk = MagicMock(side_effect=TestBulkResultCallback.bulk_response)
+
+    def actions(self, count):
+        return ({EsDocProperties.INDEX: SOME_INDEX, EsDocProperties.TYPE: SOME_DOC_TYPE,
+                 EsDocProperties.ID: str(i), EsDocProperties.SOURCE: SOME_DOC} for i in range(count))
+
+    @inlineCallbacks
+    def test_chunks_are_serialized_in_thread_pool(self):
+        bulk_utility = BulkUtility(self.es, offload_threshold=3)
+        with patch('twistes.bulk_utils.deferToThread', side_effect=deferToThread) as defer_to_thread:
+            success, errors = yield bulk_utility.bulk(self.actions(5), chunk_size=2, raise_on_error=False)
+
+        self.assertEqual(4, success)
+        self.assertEqual(1, len(errors))
+        self.assertEqual(3, self.es.bulk.call_count)
+        self.assertEqual(3, defer_to_thread.call_count)
+
+    @inlineCallbacks
+    def test_small_bulk_is_serialized_in_reactor_thread(self):
+        bulk_utility = BulkUtility(self.es, offload_threshold=10)
+        with patch('twistes.bulk_utils.deferToThread') as defer_to_thread:
+            success, failed = yield bulk_utility.bulk(self.actions(5), chunk_size=2, stats_only=True,
+                                                      raise_on_error=False)
+
+        self.assertEqual((4, 1), (success, failed))
+        self.assertFalse(defer_to_thread.called)
+
+    @inlineCallbacks
+    def test_streaming_bulk_is_offloaded(self):
+        bulk_utility = BulkUtility(self.es, offload_threshold=3)
+        results = []
+        with patch('twistes.bulk_utils.deferToThread', side_effect=deferToThread) as defer_to_thread:
+            for deferred_bulk in bulk_utility.streaming_bulk(self.actions(5), chunk_size=2, raise_on_error=False):
+                results.extend((yield deferred_bulk))
+
+        self.assertEqual([True, True, True, False, True], [ok for ok, _ in results])
+        self.assertEqual(3, defer_to_thread.call_count)
+
+    @inlineCallbacks
+    def test_offloaded_streaming_bulk_consumed_eagerly(self):
+        bulk_utility = BulkUtility(self.es, offload_threshold=5)
+        results = yield DeferredList(list(bulk_utility.streaming_bulk(self.actions(10), chunk_size=3,
+                                                                      raise_on_error=False)))
+
+        self.assertEqual(4, len(results))
+        self.assertEqual([3, 3, 3, 1], [len(chunk_results) for _, chunk_results in results])
+        self.assertEqual(4, self.es.bulk.call_count)
+
+    @inlineCallbacks
+    def test_offloaded_chunk_is_split_by_bytes(self):
+        bulk_utility = BulkUtility(self.es, offload_threshold=3)
+        max_chunk_bytes = len(json.dumps(SOME_DOC)) * 3
+        success, failed = yield bulk_utility.bulk(self.actions(5), chunk_size=4, max_chunk_bytes=max_chunk_bytes,
+                                                  stats_only=True, raise_on_error=False)
+
+        self.assertEqual((4, 1), (success, failed))
+        self.assertTrue(self.es.bulk.call_count > 2)
+
+
+class TestMinimalResponses(TestCase):
+
+    def setUp(self):
+        self.es = MagicMock()
+        self.es.bulk = MagicMock(return_value=succeed({
+            'errors': True,
+            'items': [{EsBulk.INDEX: {'status': 201}},
+                      {EsBulk.DELETE: {'status': 404}},
+                      {EsBulk.INDEX: {'status': 429, 'error': {'type': 'es_rejected_execution_exception'}}}]}))
+        self.bulk_actions = [
+            json.dumps({EsBulk.INDEX: {EsDocProperties.INDEX: SOME_INDEX, EsDocProperties.ID: '1'}}),
+            json.dumps(SOME_DOC),
+            json.dumps({EsBulk.DELETE: {EsDocProperties.INDEX: SOME_INDEX, EsDocProperties.ID: '2'}}),
+            json.dumps({EsBulk.INDEX: {EsDocProperties.INDEX: SOME_INDEX, EsDocProperties.ID: '3'}}),
+            json.dumps(SOME_DOC)]
+
+    @inlineCallbacks
+    def test_failed_items_get_their_action_metadata(self):
+        bulk_utility = BulkUtility(self.es, minimal_responses=True)
+        results = yield bulk_utility._process_bulk_chunk(self.bulk_actions, raise_on_error=False)
+
+        self.assertEqual('errors,items.*.status,items.*.error', self.es.bulk.call_args[1]['filter_path'])
+        self.assertEqual([(True, {EsBulk.INDEX: {'status': 201}}),
+                          (False, {EsBulk.DELETE: {'status': 404, EsDocProperties.INDEX: SOME_INDEX,
+                                                   EsDocProperties.ID: '2'}}),
+                          (False, {EsBulk.INDEX: {'status': 429, 'error': {'type': 'es_rejected_execution_exception'},
+                                                  EsDocProperties.INDEX: SOME_INDEX, EsDocProperties.ID: '3'}})],
+                         results)
+
+    @inlineCallbacks
+    def test_given_filter_path_keeps_the_results_parts(self):
+        bulk_utility = BulkUtility(self.es)
+        yield bulk_utility._process_bulk_chunk(self.bulk_actions, raise_on_error=False, filter_path='took')
+
+        self.assertEqual('took,errors,items.*.status,items.*.error', self.es.bulk.call_args[1]['filter_path'])
+
+    @inlineCallbacks
+    def test_full_responses_by_default(self):
+        bulk_utility = BulkUtility(self.es)
+        yield bulk_utility._process_bulk_chunk(self.bulk_actions, raise_on_error=False)
+
+        self.assertNotIn('filter_path', self.es.bulk.call_args[1])
+
+
+class TestSuccessfulBulkResults(TestCase):
+
+    def setUp(self):
+        self.items = [{EsBulk.INDEX: {EsDocProperties.ID: str(i), 'status': 201}} for i in range(3)]
+        self.es = MagicMock()
+        self.es.bulk = MagicMock(return_value=succeed({'errors': False, 'items': self.items}))
+        self.bulk_utility = BulkUtility(self.es)
+
+    @inlineCallbacks
+    def test_error_free_chunk(self):
+        results = yield self.bulk_utility._process_bulk_chunk([json.dumps({EsBulk.INDEX: {}}), json.dumps(SOME_DOC)])
+
+        self.assertIsInstance(results, SuccessfulBulkResults)
+        self.assertEqual(3, len(results))
+        self.assertEqual([(True, item) for item in self.items], results)
+        self.assertEqual((True, self.items[1]), results[1])
+        self.assertEqual([(True, self.items[2])], results[2:])
+
+    def test_compares_to_non_sequences(self):
+        results = SuccessfulBulkResults(self.items)
+
+        self.assertNotEqual(None, results)
+        self.assertFalse(results == 3)
+        self.assertTrue(results != 3)
+        self.assertRaises(TypeError, hash, results)
+
+    @inlineCallbacks
+    def test_stats_only_counts_without_reading_the_items(self):
+        self.bulk_utility._process_bulk_chunk = MagicMock(return_value=succeed(SuccessfulBulkResults(self.items)))
+        with patch.object(SuccessfulBulkResults, '__iter__') as iterate:
+            stats = yield self.bulk_utility.bulk([SOME_DOC], stats_only=True)
+
+        self.assertEqual((3, 0), stats)
+        self.assertFalse(iterate.called)
+
+    @inlineCallbacks
+    def test_errors_are_processed_per_item(self):
+        self.items.append({EsBulk.INDEX: {EsDocProperties.ID: '3', 'status': 400}})
+        self.es.bulk = MagicMock(return_value=succeed({'errors': True, 'items': self.items}))
+        success, failed = yield self.bulk_utility.bulk([SOME_DOC], stats_only=True, raise_on_error=False)
+
+        self.assertEqual((3, 1), (success, failed))
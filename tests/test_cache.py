@@ -0,0 +1,185 @@
+import json
+
+from mock import MagicMock
+from twisted.internet.defer import inlineCallbacks
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+
+from twistes.cache import ResponseCache
+from twistes.client import Elasticsearch
+from twistes.consts import ResponseCodes
+from twistes.responses import SearchResponse
+
+SOME_HOSTS_CONFIG = [{'host': "http://SOME_HOST", 'port': 9200}]
+SOME_KEY = "SOME_KEY"
+SOME_OTHER_KEY = "SOME_OTHER_KEY"
+SOME_VALUE = {"some": "value"}
+SOME_INDEX = "SOME_INDEX"
+SOME_OTHER_INDEX = "SOME_OTHER_INDEX"
+SOME_DOC_TYPE = "SOME_DOC_TYPE"
+SOME_ID = "SOME_ID"
+
+
+class TestResponseCache(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.cache = ResponseCache(max_entries=2, default_ttl=10, clock=self.clock)
+
+    def test_get_missing_key(self):
+        self.assertIsNone(self.cache.get(SOME_KEY))
+
+    def test_put_and_get(self):
+        self.cache.put(SOME_KEY, SOME_VALUE, SOME_INDEX)
+        self.assertEqual(SOME_VALUE, self.cache.get(SOME_KEY))
+
+    def test_entry_expires(self):
+        self.cache.put(SOME_KEY, SOME_VALUE, SOME_INDEX, ttl=5)
+        self.clock.advance(5)
+        self.assertIsNone(self.cache.get(SOME_KEY))
+        self.assertEqual(0, len(self.cache))
+
+    def test_least_recently_used_is_evicted(self):
+        self.cache.put(1, SOME_VALUE, SOME_INDEX)
+        self.cache.put(2, SOME_VALUE, SOME_INDEX)
+        self.cache.get(1)
+        self.cache.put(3, SOME_VALUE, SOME_INDEX)
+        self.assertEqual(SOME_VALUE, self.cache.get(1))
+        self.assertIsNone(self.cache.get(2))
+        self.assertEqual(SOME_VALUE, self.cache.get(3))
+
+    def test_evicted_by_bytes(self):
+        cache = ResponseCache(max_bytes=30, clock=self.clock)
+        cache.put(1, SOME_VALUE, SOME_INDEX)
+        cache.put(2, SOME_VALUE, SOME_INDEX)
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(SOME_VALUE, cache.get(2))
+        self.assertTrue(cache.size <= 30)
+
+    def test_invalidate_index(self):
+        self.cache.put(SOME_KEY, SOME_VALUE, SOME_INDEX)
+        self.cache.put(SOME_OTHER_KEY, SOME_VALUE, SOME_OTHER_INDEX)
+        self.cache.invalidate(SOME_INDEX)
+        self.assertIsNone(self.cache.get(SOME_KEY))
+        self.assertEqual(SOME_VALUE, self.cache.get(SOME_OTHER_KEY))
+
+    def test_invalidate_drops_entries_of_all_indices(self):
+        self.cache.put(SOME_KEY, SOME_VALUE, 'some_*')
+        self.cache.put(SOME_OTHER_KEY, SOME_VALUE, SOME_OTHER_INDEX)
+        self.cache.invalidate(SOME_INDEX)
+        self.assertIsNone(self.cache.get(SOME_KEY))
+        self.assertEqual(SOME_VALUE, self.cache.get(SOME_OTHER_KEY))
+
+    def test_invalidate_unknown_index_clears_everything(self):
+        self.cache.put(SOME_KEY, SOME_VALUE, SOME_INDEX)
+        self.cache.invalidate(None)
+        self.assertEqual(0, len(self.cache))
+
+    def test_stale_response_is_not_cached(self):
+        generation = self.cache.generation(SOME_INDEX)
+        self.cache.invalidate(SOME_INDEX)
+        self.cache.put(SOME_KEY, SOME_VALUE, SOME_INDEX, generation=generation)
+        self.assertIsNone(self.cache.get(SOME_KEY))
+
+    def test_write_to_other_index_keeps_response_in_flight(self):
+        generation = self.cache.generation(SOME_INDEX)
+        self.cache.invalidate(SOME_OTHER_INDEX)
+        self.cache.put(SOME_KEY, SOME_VALUE, SOME_INDEX, generation=generation)
+        self.assertEqual(SOME_VALUE, self.cache.get(SOME_KEY))
+
+    def test_any_write_makes_all_indices_response_stale(self):
+        generation = self.cache.generation(None)
+        self.cache.invalidate(SOME_OTHER_INDEX)
+        self.cache.put(SOME_KEY, SOME_VALUE, None, generation=generation)
+        self.assertIsNone(self.cache.get(SOME_KEY))
+
+    def test_write_to_all_indices_makes_response_stale(self):
+        generation = self.cache.generation(SOME_INDEX)
+        self.cache.invalidate()
+        self.cache.put(SOME_KEY, SOME_VALUE, SOME_INDEX, generation=generation)
+        self.assertIsNone(self.cache.get(SOME_KEY))
+
+    def test_typed_response_is_sized_by_its_raw_body(self):
+        raw = json.dumps(SOME_VALUE).encode('utf-8')
+        response = SearchResponse(raw)
+        self.assertEqual(SOME_VALUE, response.body)
+        self.cache.put(SOME_KEY, response, SOME_INDEX)
+        self.assertEqual(len(raw), self.cache.size)
+
+        self.cache.put(SOME_OTHER_KEY, SearchResponse.from_body(SOME_VALUE), SOME_INDEX)
+        self.assertEqual(len(raw) * 2, self.cache.size)
+
+
+class TestElasticsearchCache(TestCase):
+
+    def setUp(self):
+        response = MagicMock()
+        response.code = ResponseCodes.OK
+        self.async_client = MagicMock()
+        self.async_client.request = MagicMock(return_value=response)
+        self.cache = ResponseCache(clock=Clock())
+        self.es = Elasticsearch(SOME_HOSTS_CONFIG, 10, self.async_client, cache=self.cache)
+        self.es._get_content = MagicMock(return_value=SOME_VALUE)
+
+    @inlineCallbacks
+    def test_get_is_served_from_cache(self):
+        yield self.es.get(SOME_INDEX, SOME_ID)
+        result = yield self.es.get(SOME_INDEX, SOME_ID)
+        self.assertEqual(SOME_VALUE, result)
+        self.assertEqual(1, self.async_client.request.call_count)
+
+    @inlineCallbacks
+    def test_zero_cache_ttl_bypasses_cache(self):
+        yield self.es.search(SOME_INDEX, body={}, cache_ttl=0)
+        yield self.es.search(SOME_INDEX, body={}, cache_ttl=0)
+        self.assertEqual(2, self.async_client.request.call_count)
+        url = self.async_client.request.call_args[0][1]
+        self.assertFalse(b'cache_ttl' in url)
+
+    @inlineCallbacks
+    def test_index_invalidates_cache(self):
+        yield self.es.get(SOME_INDEX, SOME_ID)
+        yield self.es.index(SOME_INDEX, SOME_DOC_TYPE, SOME_VALUE, id=SOME_ID)
+        yield self.es.get(SOME_INDEX, SOME_ID)
+        self.assertEqual(3, self.async_client.request.call_count)
+
+    @inlineCallbacks
+    def test_write_to_other_index_keeps_cache(self):
+        yield self.es.count(SOME_INDEX)
+        yield self.es.delete(SOME_OTHER_INDEX, SOME_DOC_TYPE, SOME_ID)
+        yield self.es.count(SOME_INDEX)
+        self.assertEqual(2, self.async_client.request.call_count)
+
+    def test_bulk_indices(self):
+        body = [{'index': {'_index': SOME_INDEX}}, SOME_VALUE, {'delete': {'_index': SOME_OTHER_INDEX}}]
+        self.assertEqual({SOME_INDEX, SOME_OTHER_INDEX},
+                         set(Elasticsearch._bulk_indices(body, None).split(',')))
+        self.assertIsNone(Elasticsearch._bulk_indices('{"index": {}}\n{}\n', SOME_INDEX))
+
+    @inlineCallbacks
+    def test_bulk_generator_body(self):
+        yield self.es.count(SOME_INDEX)
+        lines = [{'index': {'_index': SOME_OTHER_INDEX}}, SOME_VALUE]
+        yield self.es.bulk(line for line in lines)
+        yield self.es.count(SOME_INDEX)
+
+        self.assertEqual(2, self.async_client.request.call_count)
+        body = self.async_client.request.call_args_list[1][1]['data']
+        self.assertEqual(''.join(json.dumps(line) + '\n' for line in lines).encode('utf-8'), body)
+
+    @inlineCallbacks
+    def test_bulk_utility_chunks_invalidate_their_indices(self):
+        yield self.es.count(SOME_INDEX)
+        self.es._get_content.return_value = {'errors': False, 'items': [{'index': {'status': 201}}]}
+        yield self.es.bulk_utils.bulk([{'_index': SOME_OTHER_INDEX, '_type': SOME_DOC_TYPE, '_source': SOME_VALUE}],
+                                      stats_only=True, raise_on_error=False)
+        yield self.es.count(SOME_INDEX)
+        self.assertEqual(2, self.async_client.request.call_count)
+        url = self.async_client.request.call_args[0][1]
+        self.assertFalse(b'bulk_indices' in url)
+
+    @inlineCallbacks
+    def test_scroll_drops_cache_ttl(self):
+        yield self.es.scroll('SOME_SCROLL_ID', cache_ttl=10)
+        url = self.async_client.request.call_args[0][1]
+        self.assertFalse(b'cache_ttl' in url)
@@ -0,0 +1,120 @@
+from mock import MagicMock
+from twisted.internet.defer import Deferred, CancelledError, inlineCallbacks, gatherResults
+from twisted.trial.unittest import TestCase
+
+from twistes.client import Elasticsearch
+from twistes.coalescer import RequestCoalescer
+from twistes.consts import ResponseCodes
+
+SOME_HOSTS_CONFIG = [{'host': "http://SOME_HOST", 'port': 9200}]
+SOME_KEY = "SOME_KEY"
+SOME_OTHER_KEY = "SOME_OTHER_KEY"
+SOME_RESULT = {"some": "result"}
+SOME_INDEX = "SOME_INDEX"
+SOME_ID = "SOME_ID"
+
+
+class TestRequestCoalescer(TestCase):
+
+    def setUp(self):
+        self.coalescer = RequestCoalescer()
+
+    @inlineCallbacks
+    def test_identical_requests_share_one_call(self):
+        request = Deferred()
+        request_factory = MagicMock(return_value=request)
+        d1 = self.coalescer.coalesce(SOME_KEY, request_factory)
+        d2 = self.coalescer.coalesce(SOME_KEY, request_factory)
+        request.callback(SOME_RESULT)
+
+        results = yield gatherResults([d1, d2])
+        self.assertEqual(1, request_factory.call_count)
+        self.assertEqual([SOME_RESULT, SOME_RESULT], results)
+        self.assertEqual(0, len(self.coalescer))
+
+    def test_different_keys_are_not_shared(self):
+        request_factory = MagicMock(side_effect=lambda: Deferred())
+        self.coalescer.coalesce(SOME_KEY, request_factory)
+        self.coalescer.coalesce(SOME_OTHER_KEY, request_factory)
+        self.assertEqual(2, request_factory.call_count)
+
+    @inlineCallbacks
+    def test_failure_is_fanned_out(self):
+        request = Deferred()
+        d1 = self.coalescer.coalesce(SOME_KEY, lambda: request)
+        d2 = self.coalescer.coalesce(SOME_KEY, lambda: request)
+        request.errback(ValueError())
+        yield self.assertFailure(d1, ValueError)
+        yield self.assertFailure(d2, ValueError)
+
+    @inlineCallbacks
+    def test_completed_request_is_not_reused(self):
+        request = Deferred()
+        request_factory = MagicMock(side_effect=[request, Deferred()])
+        d = self.coalescer.coalesce(SOME_KEY, request_factory)
+        request.callback(SOME_RESULT)
+        yield d
+        self.coalescer.coalesce(SOME_KEY, request_factory)
+        self.assertEqual(2, request_factory.call_count)
+
+    @inlineCallbacks
+    def test_synchronous_raise_does_not_leak_the_key(self):
+        request_factory = MagicMock(side_effect=ValueError())
+        yield self.assertFailure(self.coalescer.coalesce(SOME_KEY, request_factory), ValueError)
+        self.assertEqual(0, len(self.coalescer))
+
+        request_factory.side_effect = None
+        request_factory.return_value = Deferred()
+        self.coalescer.coalesce(SOME_KEY, request_factory)
+        self.assertEqual(2, request_factory.call_count)
+
+    @inlineCallbacks
+    def test_cancelled_first_caller_does_not_cancel_the_waiters(self):
+        request = Deferred()
+        d1 = self.coalescer.coalesce(SOME_KEY, lambda: request)
+        d2 = self.coalescer.coalesce(SOME_KEY, lambda: request)
+        d1.cancel()
+        yield self.assertFailure(d1, CancelledError)
+        self.assertFalse(request.called)
+
+        request.callback(SOME_RESULT)
+        self.assertEqual(SOME_RESULT, (yield d2))
+
+    @inlineCallbacks
+    def test_request_is_cancelled_without_waiters(self):
+        request = Deferred()
+        d1 = self.coalescer.coalesce(SOME_KEY, lambda: request)
+        d2 = self.coalescer.coalesce(SOME_KEY, lambda: request)
+        d1.cancel()
+        d2.cancel()
+        yield self.assertFailure(d1, CancelledError)
+        yield self.assertFailure(d2, CancelledError)
+        self.assertTrue(request.called)
+        self.assertEqual(0, len(self.coalescer))
+
+
+class TestElasticsearchCoalescing(TestCase):
+
+    def setUp(self):
+        self.response = Deferred()
+        self.async_client = MagicMock()
+        self.async_client.request = MagicMock(return_value=self.response)
+        self.es = Elasticsearch(SOME_HOSTS_CONFIG, 10, self.async_client, coalesce_requests=True)
+        self.es._get_content = MagicMock(return_value=SOME_RESULT)
+
+    @inlineCallbacks
+    def test_concurrent_gets_are_coalesced(self):
+        d1 = self.es.get(SOME_INDEX, SOME_ID)
+        d2 = self.es.get(SOME_INDEX, SOME_ID)
+        response = MagicMock()
+        response.code = ResponseCodes.OK
+        self.response.callback(response)
+
+        self.assertEqual(SOME_RESULT, (yield d1))
+        self.assertEqual(SOME_RESULT, (yield d2))
+        self.assertEqual(1, self.async_client.request.call_count)
+
+    def test_scrolled_search_is_not_coalesced(self):
+        self.es.search(SOME_INDEX, body={}, scroll='1m')
+        self.es.search(SOME_INDEX, body={}, scroll='1m')
+        self.assertEqual(2, self.async_client.request.call_count)
@@ -0,0 +1,91 @@
+import math
+from array import array
+
+from mock import MagicMock
+from twisted.internet.defer import inlineCallbacks, succeed
+from twisted.trial.unittest import TestCase
+
+from twistes.client import Elasticsearch
+from twistes.columnar import ColumnarScan
+from twistes.consts import EsDocProperties
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+SOME_HOSTS_CONFIG = [{'host': "http://SOME_HOST", 'port': 9200}]
+SOME_INDEX = "SOME_INDEX"
+SOME_DOC_TYPE = "SOME_DOC_TYPE"
+
+
+def create_hit(id, source):
+    return {EsDocProperties.ID: id, EsDocProperties.SOURCE: source}
+
+
+SOME_PAGE_1 = [create_hit('1', {'user': {'id': 10}, 'duration': 1.5}),
+               create_hit('2', {'user': {'id': 20}})]
+SOME_PAGE_2 = [create_hit('3', {'duration': 3.5, 'user': 'not a dict'})]
+
+
+class TestColumnarScan(TestCase):
+
+    def setUp(self):
+        self.columns = ColumnarScan(['_id', 'user.id', 'duration'], typecodes={'user.id': 'l', 'duration': 'd'})
+
+    def test_add_pages(self):
+        self.columns.add_page(SOME_PAGE_1)
+        self.columns.add_page(SOME_PAGE_2)
+        result = self.columns.to_dict()
+
+        self.assertEqual(3, len(self.columns))
+        self.assertEqual(['1', '2', '3'], result['_id'])
+        self.assertEqual(array('l', [10, 20, 0]), result['user.id'])
+        self.assertEqual(1.5, result['duration'][0])
+        self.assertTrue(math.isnan(result['duration'][1]))
+        self.assertEqual(3.5, result['duration'][2])
+
+    def test_custom_missing_value(self):
+        columns = ColumnarScan(['user.id'], typecodes={'user.id': 'l'}, missing={'user.id': -1})
+        columns.add_page(SOME_PAGE_2)
+        self.assertEqual(array('l', [-1]), columns.to_dict()['user.id'])
+
+    def test_page_with_a_bad_value_is_not_added(self):
+        self.columns.add_page(SOME_PAGE_1)
+        bad_page = [create_hit('3', {'user': {'id': 30}}), create_hit('4', {'duration': 'not a number'})]
+        self.assertRaises(TypeError, self.columns.add_page, bad_page)
+
+        result = self.columns.to_dict()
+        self.assertEqual(2, len(self.columns))
+        self.assertEqual(['1', '2'], result['_id'])
+        self.assertEqual(array('l', [10, 20]), result['user.id'])
+        self.assertEqual(2, len(result['duration']))
+
+    def test_source_fields(self):
+        self.assertEqual(['user.id', 'duration'], self.columns.source_fields)
+
+    @inlineCallbacks
+    def test_consume_scroller(self):
+        scroller = iter([succeed(SOME_PAGE_1), succeed(SOME_PAGE_2)])
+        result = yield self.columns.consume(scroller)
+        self.assertIs(self.columns, result)
+        self.assertEqual(3, len(result))
+
+    def test_to_numpy(self):
+        if numpy is None:
+            self.skipTest("numpy is not installed")
+        self.columns.add_page(SOME_PAGE_1)
+        result = self.columns.to_numpy()
+        self.assertEqual(numpy.int64, result['user.id'].dtype)
+        self.assertEqual([10, 20], list(result['user.id']))
+
+
+class TestElasticsearchScanColumns(TestCase):
+
+    @inlineCallbacks
+    def test_scan_columns_filters_source(self):
+        es = Elasticsearch(SOME_HOSTS_CONFIG, 10, MagicMock())
+        es.scan = MagicMock(return_value=succeed(iter([succeed(SOME_PAGE_1)])))
+        result = yield es.scan_columns(SOME_INDEX, SOME_DOC_TYPE, ['_id', 'duration'], typecodes={'duration': 'd'})
+        es.scan.assert_called_once_with(SOME_INDEX, SOME_DOC_TYPE, None, _source='duration')
+        self.assertEqual(['1', '2'], result.to_dict()['_id'])
@@ -0,0 +1,43 @@
+from twisted.internet.defer import Deferred, succeed
+from twisted.trial.unittest import TestCase
+
+from twistes.bench.overhead import SyncHttpClient, per_call_overhead
+from twistes.client import Elasticsearch
+from twistes.deferreds import deferred_call, as_deferred
+
+
+class TestDeferredCall(TestCase):
+
+    def test_plain_result_is_wrapped(self):
+        d = deferred_call(lambda: 1)()
+        self.assertEqual(1, self.successResultOf(d))
+
+    def test_deferred_result_is_returned(self):
+        d = succeed(1)
+        self.assertIs(d, deferred_call(lambda: d)())
+
+    def test_exception_fails_the_deferred(self):
+        def raise_error():
+            raise ValueError()
+
+        self.failureResultOf(deferred_call(raise_error)(), ValueError)
+
+    def test_as_deferred(self):
+        self.assertIsInstance(as_deferred(1), Deferred)
+        self.assertEqual(1, self.successResultOf(as_deferred(1)))
+
+
+class TestRequestPath(TestCase):
+
+    def setUp(self):
+        self.es = Elasticsearch([{'host': 'localhost', 'port': 9200}], async_http_client=SyncHttpClient())
+
+    def test_api_errors_fail_the_deferred(self):
+        self.failureResultOf(self.es.exists(None, None, None), ValueError)
+
+    def test_synchronous_response_is_returned(self):
+        doc = self.successResultOf(self.es.get('bench', '1', doc_type='doc'))
+        self.assertEqual('1', doc['_id'])
+
+    def test_overhead_microbenchmark(self):
+        self.assertTrue(per_call_overhead(self.es.get, 10) > 0)
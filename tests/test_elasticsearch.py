@@ -1,12 +1,13 @@
 import json
 from twistes.compatability import urlencode, quote
-from mock import MagicMock
+from mock import MagicMock, patch
 from twisted.internet.defer import inlineCallbacks
+from twisted.internet.threads import deferToThread
 from twisted.trial.unittest import TestCase
 from twisted.web._newclient import ResponseNeverReceived
 
 from twistes.client import Elasticsearch
-from twistes.consts import HttpMethod, EsConst, ResponseCodes, EsMethods
+from twistes.consts import HttpMethod, EsConst, ResponseCodes, EsMethods, TREQ_POOL_DEFAULT_PARAMS
 from twistes.exceptions import (NotFoundError,
                                 ConnectionTimeout,
                                 ElasticsearchException,
@@ -159,7 +160,7 @@ class TestElasticsearch(TestCase):
 
         self.es._async_http_client.request.assert_called_once_with(HttpMethod.GET, expected_url,
                                                                    auth=(SOME_USER, SOME_PASS), data=json.dumps(
-                                                                       query),
+                                                                       query).encode('utf-8'),
                                                                    timeout=TIMEOUT)
 
     @inlineCallbacks
@@ -179,7 +180,7 @@ class TestElasticsearch(TestCase):
 
         self.es._async_http_client.request.assert_called_once_with(HttpMethod.POST, expected_url,
                                                                    auth=(SOME_USER, SOME_PASS), data=json.dumps(
-                                                                       query),
+                                                                       query).encode('utf-8'),
                                                                    timeout=TIMEOUT)
 
     @inlineCallbacks
@@ -193,7 +194,7 @@ class TestElasticsearch(TestCase):
 
         self.es._async_http_client.request.assert_called_once_with(HttpMethod.GET, expected_url,
                                                                    auth=(SOME_USER, SOME_PASS), data=json.dumps(
-                                                                       query),
+                                                                       query).encode('utf-8'),
                                                                    timeout=TIMEOUT)
 
     @inlineCallbacks
@@ -277,7 +278,7 @@ class TestElasticsearch(TestCase):
                                                                    auth=(
                                                                        SOME_USER, SOME_PASS),
                                                                    data=json.dumps(
-                                                                       some_search_query),
+                                                                       some_search_query).encode('utf-8'),
                                                                    timeout=TIMEOUT)
 
     @inlineCallbacks
@@ -307,7 +308,7 @@ class TestElasticsearch(TestCase):
                                                                    auth=(
                                                                        SOME_USER, SOME_PASS),
                                                                    data=json.dumps(
-                                                                       doc_to_index),
+                                                                       doc_to_index).encode('utf-8'),
                                                                    timeout=TIMEOUT)
 
     @inlineCallbacks
@@ -323,7 +324,7 @@ class TestElasticsearch(TestCase):
                                                                    auth=(
                                                                        SOME_USER, SOME_PASS),
                                                                    data=json.dumps(
-                                                                       doc_to_index),
+                                                                       doc_to_index).encode('utf-8'),
                                                                    timeout=TIMEOUT)
 
     @inlineCallbacks
@@ -349,7 +350,20 @@ class TestElasticsearch(TestCase):
         doc_to_index = {FIELD_1: 'bla', FIELD_2: 'bla2'}
         yield self.es.create(SOME_INDEX, SOME_DOC_TYPE, doc_to_index, id=SOME_ID)
         self.es.index.assert_called_once_with(SOME_INDEX, SOME_DOC_TYPE, doc_to_index, id=SOME_ID,
-                                              params={'op_type': 'create'})
+                                              op_type='create')
+
+    @inlineCallbacks
+    def test_create_with_request_timeout(self):
+        self.es._async_http_client.request = MagicMock(
+            return_value=self.generate_response(ResponseCodes.OK))
+        request_timeout = 2
+        yield self.es.create(SOME_INDEX, SOME_DOC_TYPE, {FIELD_1: 'bla'}, id=SOME_ID, request_timeout=request_timeout)
+
+        (_, url), kwargs = self.es._async_http_client.request.call_args
+        self.assertIn(b'op_type=create', url)
+        self.assertIn(b'timeout=2000ms', url)
+        self.assertNotIn(b'params', url)
+        self.assertEqual(request_timeout, kwargs['timeout'])
 
     @inlineCallbacks
     def test_scroll(self):
@@ -362,7 +376,7 @@ class TestElasticsearch(TestCase):
         self.es._async_http_client.request.assert_called_once_with(HttpMethod.GET, expected_url,
                                                                    auth=(
                                                                        SOME_USER, SOME_PASS),
-                                                                   data=scroll_id,
+                                                                   data=scroll_id.encode('utf-8'),
                                                                    timeout=TIMEOUT)
 
     @inlineCallbacks
@@ -376,7 +390,7 @@ class TestElasticsearch(TestCase):
         self.es._async_http_client.request.assert_called_once_with(HttpMethod.DELETE, expected_url,
                                                                    auth=(
                                                                        SOME_USER, SOME_PASS),
-                                                                   data=scroll_id,
+                                                                   data=scroll_id.encode('utf-8'),
                                                                    timeout=TIMEOUT)
 
     @inlineCallbacks
@@ -411,7 +425,7 @@ class TestElasticsearch(TestCase):
                                                                    auth=(
                                                                        SOME_USER, SOME_PASS),
                                                                    data=json.dumps(
-                                                                       some_search_query),
+                                                                       some_search_query).encode('utf-8'),
                                                                    timeout=TIMEOUT)
 
     @inlineCallbacks
@@ -429,9 +443,32 @@ class TestElasticsearch(TestCase):
         self.es._async_http_client.request.assert_called_once_with(HttpMethod.POST, expected_url,
                                                                    auth=(
                                                                        SOME_USER, SOME_PASS),
-                                                                   data=expected_body,
+                                                                   data=expected_body.encode('utf-8'),
                                                                    timeout=TIMEOUT)
 
+    @inlineCallbacks
+    def test_bulk_generator(self):
+        self.es._async_http_client.request = MagicMock(
+            return_value=self.generate_response(ResponseCodes.OK))
+        lines = [{FIELD_1: "blabla1"}, {FIELD_1: "blabla2"}]
+        yield self.es.bulk((line for line in lines), SOME_INDEX, SOME_DOC_TYPE)
+
+        expected_body = '{q1}\n{q2}\n'.format(q1=json.dumps(lines[0]), q2=json.dumps(lines[1]))
+        self.assertEqual(expected_body.encode('utf-8'), self.es._async_http_client.request.call_args[1]['data'])
+
+    @inlineCallbacks
+    def test_large_bulk_list_is_serialized_in_thread_pool(self):
+        es = Elasticsearch(SOME_HOSTS_CONFIG, TIMEOUT, MagicMock(), json_offload_threshold=2)
+        es._async_http_client.request = MagicMock(return_value=self.generate_response(ResponseCodes.OK))
+        index_query1 = {FIELD_1: "blabla1"}
+        index_query2 = {FIELD_1: "blabla2"}
+        with patch('twistes.client.deferToThread', side_effect=deferToThread) as defer_to_thread:
+            yield es.bulk([index_query1, index_query2], SOME_INDEX, SOME_DOC_TYPE)
+
+        defer_to_thread.assert_called_once_with(es._bulk_body, [index_query1, index_query2])
+        expected_body = '{q1}\n{q2}\n'.format(q1=json.dumps(index_query1), q2=json.dumps(index_query2))
+        self.assertEqual(expected_body.encode('utf-8'), es._async_http_client.request.call_args[1]['data'])
+
     @inlineCallbacks
     def test_msearch_list(self):
         self.es._async_http_client.request = MagicMock(
@@ -447,5 +484,70 @@ class TestElasticsearch(TestCase):
         self.es._async_http_client.request.assert_called_once_with(HttpMethod.GET, expected_url,
                                                                    auth=(
                                                                        SOME_USER, SOME_PASS),
-                                                                   data=expected_body,
+                                                                   data=expected_body.encode('utf-8'),
                                                                    timeout=TIMEOUT)
+
+    @inlineCallbacks
+    def test_search_with_request_timeout(self):
+        self.es._async_http_client.request = MagicMock(
+            return_value=self.generate_response(ResponseCodes.OK))
+        request_timeout = 2
+        yield self.es.search(SOME_INDEX, SOME_DOC_TYPE, request_timeout=request_timeout)
+        expected_url = self._generate_url(SOME_HOST, SOME_PORT, [{EsConst.TIMEOUT: '2000ms'}],
+                                          SOME_INDEX, SOME_DOC_TYPE, EsMethods.SEARCH)
+
+        self.es._async_http_client.request.assert_called_once_with(HttpMethod.POST, expected_url,
+                                                                   auth=(SOME_USER, SOME_PASS),
+                                                                   data=None,
+                                                                   timeout=request_timeout)
+
+    @inlineCallbacks
+    def test_get_with_request_timeout_does_not_send_server_timeout(self):
+        self.es._async_http_client.request = MagicMock(
+            return_value=self.generate_response(ResponseCodes.OK))
+        request_timeout = 0.05
+        yield self.es.get(SOME_INDEX, id=SOME_ID, request_timeout=request_timeout)
+        expected_url = self._generate_url(
+            SOME_HOST, SOME_PORT, None, SOME_INDEX, EsConst.ALL_VALUES, SOME_ID)
+
+        self.es._async_http_client.request.assert_called_once_with(HttpMethod.GET, expected_url,
+                                                                   auth=(SOME_USER, SOME_PASS),
+                                                                   data=None,
+                                                                   timeout=request_timeout)
+
+    @inlineCallbacks
+    def test_deadline_bounds_the_request_timeout(self):
+        self.es._async_http_client.request = MagicMock(
+            return_value=self.generate_response(ResponseCodes.OK))
+        yield self.es.get(SOME_INDEX, id=SOME_ID, deadline=TIMEOUT / 2)
+        _, kwargs = self.es._async_http_client.request.call_args
+        self.assertTrue(0 < kwargs['timeout'] <= TIMEOUT / 2)
+
+    @inlineCallbacks
+    def test_expired_deadline_raises_connection_timeout(self):
+        self.es._async_http_client.request = MagicMock()
+        yield self.assertFailure(self.es.get(SOME_INDEX, id=SOME_ID, deadline=0), ConnectionTimeout)
+        self.assertFalse(self.es._async_http_client.request.called)
+
+    def test_treq_pool_default_params_are_applied(self):
+        es = Elasticsearch(SOME_HOSTS_CONFIG, TIMEOUT)
+        pool = es._async_http_client_params["pool"]
+        for key, value in TREQ_POOL_DEFAULT_PARAMS.items():
+            self.assertEqual(value, getattr(pool, key))
+
+    def test_treq_pool_params_can_be_tuned(self):
+        es = Elasticsearch(SOME_HOSTS_CONFIG, TIMEOUT, async_http_client_params={"maxPersistentPerHost": 50})
+        self.assertEqual(50, es._async_http_client_params["pool"].maxPersistentPerHost)
+        self.assertTrue("maxPersistentPerHost" not in es._async_http_client_params)
+
+    @inlineCallbacks
+    def test_warm_up_opens_concurrent_connections(self):
+        self.es._async_http_client.request = MagicMock(
+            side_effect=[self.generate_response(ResponseCodes.OK),
+                         self.generate_response(ResponseCodes.OK),
+                         ResponseNeverReceived('test')])
+        opened = yield self.es.warm_up(3)
+        self.assertEqual(2, opened)
+        self.assertEqual(3, self.es._async_http_client.request.call_count)
+        method = self.es._async_http_client.request.call_args[0][0]
+        self.assertEqual(HttpMethod.HEAD, method)
@@ -1,6 +1,6 @@
 from unittest import TestCase
 
-from twistes.consts import HostParsing
+from twistes.consts import HostParsing, EsConst
 from twistes.parser import EsParser
 
 HTTPS_SCHEME = 'https'
@@ -54,3 +54,15 @@ class TestEsParser(TestCase):
         self.assertEqual('443', full_host[-3:])
         self.assertEqual(HostParsing.HTTPS, full_host[0:5])
         self.assertEqual(SOME_URL, full_host[8:-4])
+
+    def test_prepare_url_with_filter_path_list(self):
+        url = EsParser.prepare_url('http://localhost:9200', '/_search',
+                                   {EsConst.FILTER_PATH: ['hits.hits._id', 'hits.total']})
+
+        self.assertEqual(b'http://localhost:9200/_search?filter_path=hits.hits._id%2Chits.total', url)
+
+    def test_extend_filter_path(self):
+        self.assertEqual('hits.hits._id,_scroll_id,hits.total',
+                         EsParser.extend_filter_path('hits.hits._id,_scroll_id', ('_scroll_id', 'hits.total')))
+        self.assertEqual('took,errors', EsParser.extend_filter_path(['took'], ('errors',)))
+        self.assertIsNone(EsParser.extend_filter_path(None, ('errors',)))
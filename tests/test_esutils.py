@@ -110,6 +110,86 @@ class TestEsUtils(TestCase):
         result = EsUtils.extract_aggregation_results(agg_results, agg_name)
         self.assertEquals(result, expected)
 
+    def test_flatten_aggregation_results_nested(self):
+        agg_name = "by_user"
+        buckets = [
+            {
+                EsAggregation.KEY: "user1",
+                EsAggregation.DOC_COUNT: 3,
+                "by_day": {EsAggregation.BUCKETS: [
+                    {EsAggregation.KEY: 1000, EsAggregation.KEY_AS_STRING: "day1", EsAggregation.DOC_COUNT: 2,
+                     "avg_time": {"value": 1.5}},
+                    {EsAggregation.KEY: 2000, EsAggregation.KEY_AS_STRING: "day2", EsAggregation.DOC_COUNT: 1,
+                     "avg_time": {"value": 3.0}}
+                ]},
+                "time_stats": {"min": 1.0, "max": 4.0}
+            },
+            {
+                EsAggregation.KEY: "user2",
+                EsAggregation.DOC_COUNT: 1,
+                "by_day": {EsAggregation.BUCKETS: [
+                    {EsAggregation.KEY: 1000, EsAggregation.KEY_AS_STRING: "day1", EsAggregation.DOC_COUNT: 1}
+                ]},
+                "time_stats": {"min": 2.0, "max": 2.0}
+            }
+        ]
+        columns = EsUtils.flatten_aggregation_results(self.create_agg_results(agg_name, buckets), agg_name)
+
+        self.assertEqual(["user1", "user1", "user2"], columns["by_user.key"])
+        self.assertEqual([3, 3, 1], columns["by_user.doc_count"])
+        self.assertEqual([1000, 2000, 1000], columns["by_day.key"])
+        self.assertEqual(["day1", "day2", "day1"], columns["by_day.key_as_string"])
+        self.assertEqual([2, 1, 1], columns["by_day.doc_count"])
+        self.assertEqual([1.5, 3.0, None], columns["avg_time"])
+        self.assertEqual([4.0, 4.0, 2.0], columns["time_stats.max"])
+
+    def test_flatten_aggregation_results_keyed_buckets(self):
+        agg_name = "by_filter"
+        buckets = {"errors": {EsAggregation.DOC_COUNT: 5}, "warnings": {EsAggregation.DOC_COUNT: 7}}
+        columns = EsUtils.flatten_aggregation_results(self.create_agg_results(agg_name, buckets), agg_name)
+        self.assertEqual({("errors", 5), ("warnings", 7)},
+                         set(zip(columns["by_filter.key"], columns["by_filter.doc_count"])))
+
+    def test_flatten_aggregation_results_single_bucket(self):
+        agg_name = "by_user"
+        buckets = [
+            {
+                EsAggregation.KEY: "user1",
+                EsAggregation.DOC_COUNT: 3,
+                "errors": {
+                    EsAggregation.DOC_COUNT: 2,
+                    "avg_time": {"value": 1.5},
+                    "by_day": {EsAggregation.BUCKETS: [
+                        {EsAggregation.KEY: 1000, EsAggregation.DOC_COUNT: 1},
+                        {EsAggregation.KEY: 2000, EsAggregation.DOC_COUNT: 1}
+                    ]}
+                }
+            }
+        ]
+        columns = EsUtils.flatten_aggregation_results(self.create_agg_results(agg_name, buckets), agg_name)
+
+        self.assertEqual(["user1", "user1"], columns["by_user.key"])
+        self.assertEqual([2, 2], columns["errors.doc_count"])
+        self.assertEqual([1.5, 1.5], columns["avg_time"])
+        self.assertEqual([1000, 2000], columns["by_day.key"])
+
+    def test_flatten_aggregation_results_sibling_buckets(self):
+        agg_name = "by_user"
+        buckets = [
+            {
+                EsAggregation.KEY: "user1",
+                EsAggregation.DOC_COUNT: 3,
+                "by_day": {EsAggregation.BUCKETS: [{EsAggregation.KEY: 1000, EsAggregation.DOC_COUNT: 3}]},
+                "by_host": {EsAggregation.BUCKETS: [{EsAggregation.KEY: "host1", EsAggregation.DOC_COUNT: 3}]}
+            }
+        ]
+        self.assertRaises(ValueError, EsUtils.flatten_aggregation_results,
+                          self.create_agg_results(agg_name, buckets), agg_name)
+
+    def test_flatten_aggregation_results_no_results(self):
+        agg_name = "results"
+        columns = EsUtils.flatten_aggregation_results(self.create_agg_results(agg_name, []), agg_name)
+        self.assertEqual({}, columns)
 
     @staticmethod
     def create_agg_results(agg_name, actual_results):
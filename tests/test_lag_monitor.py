@@ -0,0 +1,132 @@
+import json
+
+from mock import MagicMock
+from twisted.internet.defer import inlineCallbacks, succeed
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+
+from twistes.bulk_utils import BulkUtility
+from twistes.client import Elasticsearch
+from twistes.consts import MonitoredSections, ResponseCodes, EsBulk, EsDocProperties
+from twistes.lag_monitor import ReactorLagMonitor, section, timed_iteration, monitoring
+
+SOME_HOSTS = [{'host': 'localhost', 'port': 9200}]
+
+
+class TestReactorLagMonitor(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.lags = []
+        self.slow_sections = []
+        self.monitor = ReactorLagMonitor(interval=0.05, lag_threshold=0.1, section_threshold=0.02,
+                                         on_lag=lambda lag, sections: self.lags.append((lag, sections)),
+                                         on_slow_section=lambda *args: self.slow_sections.append(args),
+                                         clock=self.clock)
+        self.monitor.start()
+        self.addCleanup(self.monitor.stop)
+
+    def test_lag_is_reported_with_the_sections_that_ran(self):
+        self.clock.advance(0.05)
+        self.monitor.record(MonitoredSections.JSON_DECODE, 1000, 0.2)
+        self.monitor.record(MonitoredSections.JSON_DECODE, 500, 0.05)
+        self.monitor.record(MonitoredSections.BULK_RESULTS, 10, 0.001)
+        # the reactor was blocked, the next tick comes late
+        self.clock.advance(0.3)
+
+        self.assertEqual(1, len(self.lags))
+        lag, sections = self.lags[0]
+        self.assertAlmostEqual(0.25, lag)
+        self.assertEqual(2, sections[MonitoredSections.JSON_DECODE].count)
+        self.assertEqual(1500, sections[MonitoredSections.JSON_DECODE].size)
+        self.assertAlmostEqual(0.25, sections[MonitoredSections.JSON_DECODE].seconds)
+        self.assertEqual(1, sections[MonitoredSections.BULK_RESULTS].count)
+        self.assertEqual([(MonitoredSections.JSON_DECODE, 1000, 0.2), (MonitoredSections.JSON_DECODE, 500, 0.05)],
+                         self.slow_sections)
+
+    def test_small_lag_is_not_reported(self):
+        self.clock.advance(0.05)
+        self.clock.advance(0.1)
+
+        self.assertEqual([], self.lags)
+        self.assertAlmostEqual(0.05, self.monitor.max_lag)
+
+    def test_sections_are_reset_every_tick(self):
+        self.monitor.record(MonitoredSections.JSON_ENCODE, 10, 0.001)
+        self.clock.advance(0.05)
+        self.clock.advance(0.2)
+
+        lag, sections = self.lags[0]
+        self.assertEqual({}, sections)
+
+    def test_section_measures_the_clock(self):
+        with section(MonitoredSections.JSON_ENCODE) as timed:
+            self.clock.rightNow += 0.03
+            timed.size = 42
+
+        self.assertEqual([(MonitoredSections.JSON_ENCODE, 42, 0.03)], self.slow_sections)
+
+    def test_timed_iteration(self):
+        def chunks():
+            for chunk in (['a', 'b'], ['c']):
+                self.clock.rightNow += 0.02
+                yield chunk
+
+        self.assertEqual([['a', 'b'], ['c']], list(timed_iteration(chunks(), MonitoredSections.CHUNK_ACTIONS)))
+        self.assertEqual([(MonitoredSections.CHUNK_ACTIONS, 2, 0.02), (MonitoredSections.CHUNK_ACTIONS, 1, 0.02)],
+                         self.slow_sections)
+
+    def test_one_monitor_at_a_time(self):
+        self.assertRaises(RuntimeError, ReactorLagMonitor(clock=self.clock).start)
+
+    def test_nothing_is_measured_when_stopped(self):
+        self.monitor.stop()
+
+        self.assertFalse(monitoring())
+        iterable = [['a']]
+        self.assertIs(iterable, timed_iteration(iterable, MonitoredSections.CHUNK_ACTIONS))
+        with section(MonitoredSections.JSON_ENCODE) as timed:
+            timed.size = 1
+        self.assertEqual([], self.slow_sections)
+
+
+class TestMonitoredSections(TestCase):
+
+    def setUp(self):
+        self.sections = []
+        self.monitor = ReactorLagMonitor(section_threshold=0,
+                                         on_slow_section=lambda *args: self.sections.append(args[:2]),
+                                         clock=Clock())
+        self.monitor.start()
+        self.addCleanup(self.monitor.stop)
+
+    @inlineCallbacks
+    def test_request_encoding_and_decoding(self):
+        response = MagicMock()
+        response.code = ResponseCodes.OK
+        response.content = MagicMock(return_value=succeed(b'{"took": 1}'))
+        http_client = MagicMock()
+        http_client.request = MagicMock(return_value=succeed(response))
+        es = Elasticsearch(SOME_HOSTS, async_http_client=http_client)
+        body = {'query': {'match_all': {}}}
+
+        result = yield es.search('some_index', body=body)
+
+        self.assertEqual({'took': 1}, result)
+        self.assertEqual([(MonitoredSections.JSON_ENCODE, len(json.dumps(body))),
+                          (MonitoredSections.JSON_DECODE, len(b'{"took": 1}'))], self.sections)
+
+    @inlineCallbacks
+    def test_bulk_sections(self):
+        es = MagicMock()
+        es.bulk = MagicMock(return_value=succeed({'items': [{EsBulk.INDEX: {'status': 201}}]}))
+        bulk_utility = BulkUtility(es)
+        action = {EsDocProperties.INDEX: 'some_index', EsDocProperties.TYPE: 'doc', EsDocProperties.ID: '1',
+                  EsDocProperties.SOURCE: {'field': 'value'}}
+
+        success, errors = yield bulk_utility.bulk([action])
+
+        self.assertEqual((1, []), (success, errors))
+        self.assertEqual([MonitoredSections.CHUNK_ACTIONS, MonitoredSections.BULK_ENCODE,
+                          MonitoredSections.BULK_RESULTS], [operation for operation, _ in self.sections])
+        self.assertEqual(1, self.sections[-1][1])
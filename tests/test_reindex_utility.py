@@ -0,0 +1,141 @@
+from mock import MagicMock
+from twisted.internet.defer import inlineCallbacks, succeed, fail, Deferred
+from twisted.trial.unittest import TestCase
+
+from twistes.consts import EsBulk, EsDocProperties
+from twistes.exceptions import BulkIndexError
+from twistes.reindex_utils import ReindexUtility
+
+SOURCE_INDEX = "SOURCE_INDEX"
+TARGET_INDEX = "TARGET_INDEX"
+SOME_DOC_TYPE = "SOME_DOC_TYPE"
+
+
+class FakeScroller(object):
+
+    def __init__(self, pages):
+        self._pages = iter(pages)
+        self.cleared = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._pages)
+
+    next = __next__
+
+    def clear(self):
+        self.cleared = True
+        return succeed(None)
+
+
+def create_hit(id):
+    return {EsDocProperties.INDEX: SOURCE_INDEX, EsDocProperties.TYPE: SOME_DOC_TYPE,
+            EsDocProperties.ID: id, EsDocProperties.SOURCE: {'value': id}}
+
+
+class TestReindexUtility(TestCase):
+
+    def setUp(self):
+        self.source = MagicMock()
+        self.target = MagicMock()
+        self.target.bulk_utils.bulk = MagicMock(side_effect=lambda actions, **kwargs: succeed((len(actions), 0)))
+        self.reindex_utility = ReindexUtility(self.source)
+
+    def set_pages(self, *pages):
+        self.scrollers = []
+
+        def scan(*args, **kwargs):
+            self.scrollers.append(FakeScroller([succeed(page) for page in pages]))
+            return succeed(self.scrollers[-1])
+
+        self.source.scan = MagicMock(side_effect=scan)
+
+    @inlineCallbacks
+    def test_reindex_pipes_pages_into_bulk(self):
+        self.set_pages([create_hit('1'), create_hit('2')], [create_hit('3')])
+        progress = MagicMock()
+        stats = yield self.reindex_utility.reindex(SOURCE_INDEX, TARGET_INDEX, target_client=self.target,
+                                                   progress_callback=progress)
+
+        self.assertEqual(3, stats.read)
+        self.assertEqual(3, stats.success)
+        self.assertEqual(2, stats.bulks)
+        self.assertEqual(2, progress.call_count)
+        first_actions = self.target.bulk_utils.bulk.call_args_list[0][0][0]
+        self.assertEqual({EsBulk.OP_TYPE: EsBulk.INDEX, EsDocProperties.INDEX: TARGET_INDEX,
+                          EsDocProperties.TYPE: SOME_DOC_TYPE, EsDocProperties.ID: '1',
+                          EsDocProperties.SOURCE: {'value': '1'}}, first_actions[0])
+
+    @inlineCallbacks
+    def test_transform_can_skip_documents(self):
+        self.set_pages([create_hit('1'), create_hit('2')])
+
+        def transform(hit, action):
+            if hit[EsDocProperties.ID] == '1':
+                return None
+            action[EsDocProperties.SOURCE]['copied'] = True
+            return action
+
+        stats = yield self.reindex_utility.reindex(SOURCE_INDEX, TARGET_INDEX, target_client=self.target,
+                                                   transform=transform)
+        self.assertEqual(1, stats.skipped)
+        actions = self.target.bulk_utils.bulk.call_args[0][0]
+        self.assertEqual([{'value': '2', 'copied': True}], [a[EsDocProperties.SOURCE] for a in actions])
+
+    @inlineCallbacks
+    def test_sliced_scroll(self):
+        self.set_pages([create_hit('1')])
+        stats = yield self.reindex_utility.reindex(SOURCE_INDEX, TARGET_INDEX, query={'query': {}},
+                                                   target_client=self.target, slices=3)
+        self.assertEqual(3, self.source.scan.call_count)
+        slices = [kwargs['query']['slice'] for _, kwargs in self.source.scan.call_args_list]
+        self.assertEqual([{'id': i, 'max': 3} for i in range(3)], slices)
+        self.assertEqual(3, stats.success)
+
+    def test_bulk_concurrency_is_bounded(self):
+        self.set_pages([create_hit('1')], [create_hit('2')], [create_hit('3')])
+        bulks = []
+        self.target.bulk_utils.bulk = MagicMock(side_effect=lambda actions, **kwargs: bulks.append(Deferred())
+                                                or bulks[-1])
+        self.reindex_utility.reindex(SOURCE_INDEX, TARGET_INDEX, target_client=self.target, max_concurrent_bulks=2)
+        self.assertEqual(2, len(bulks))
+        bulks[0].callback((1, 0))
+        self.assertEqual(3, len(bulks))
+
+    @inlineCallbacks
+    def test_bulk_errors_are_propagated(self):
+        self.set_pages([create_hit('1')])
+        self.target.bulk_utils.bulk = MagicMock(side_effect=BulkIndexError('failed', []))
+        d = self.reindex_utility.reindex(SOURCE_INDEX, TARGET_INDEX, target_client=self.target)
+        yield self.assertFailure(d, BulkIndexError)
+
+    @inlineCallbacks
+    def test_bulk_failure_stops_all_slices(self):
+        self.set_pages([create_hit('1')], [create_hit('2')], [create_hit('3')])
+        self.target.bulk_utils.bulk = MagicMock(side_effect=lambda actions, **kwargs: fail(BulkIndexError('failed', [])))
+        d = self.reindex_utility.reindex(SOURCE_INDEX, TARGET_INDEX, target_client=self.target, slices=2)
+        yield self.assertFailure(d, BulkIndexError)
+        self.assertEqual(1, self.target.bulk_utils.bulk.call_count)
+        self.assertTrue(all(scroller.cleared for scroller in self.scrollers))
+
+    def test_read_failure_waits_for_the_slice_bulks(self):
+        scroller = FakeScroller([succeed([create_hit('1')]), fail(ValueError('read failed'))])
+        self.source.scan = MagicMock(return_value=succeed(scroller))
+        bulk = Deferred()
+        self.target.bulk_utils.bulk = MagicMock(return_value=bulk)
+
+        d = self.reindex_utility.reindex(SOURCE_INDEX, TARGET_INDEX, target_client=self.target)
+        self.assertNoResult(d)
+        self.assertFalse(scroller.cleared)
+
+        bulk.callback((1, 0))
+        self.failureResultOf(d, ValueError)
+        self.assertTrue(scroller.cleared)
+
+    @inlineCallbacks
+    def test_scroll_is_cleared(self):
+        self.set_pages([create_hit('1')])
+        yield self.reindex_utility.reindex(SOURCE_INDEX, TARGET_INDEX, target_client=self.target)
+        self.assertTrue(self.scrollers[0].cleared)
@@ -0,0 +1,100 @@
+import json
+
+from mock import MagicMock
+from twisted.internet.defer import inlineCallbacks, succeed
+from twisted.trial.unittest import TestCase
+
+from twistes.client import Elasticsearch
+from twistes.consts import EsConst, EsDocProperties, ResponseCodes
+from twistes.exceptions import NotFoundError
+from twistes.responses import SearchResponse, Hit
+from twistes.utilities import EsUtils
+
+SOME_HOSTS_CONFIG = [{'host': "http://SOME_HOST", 'port': 9200}]
+SOME_INDEX = "SOME_INDEX"
+SOME_ID = "SOME_ID"
+SOME_SOURCE = {"user": {"name": "sonic"}, "age": 25}
+SOME_HIT = {EsDocProperties.INDEX: SOME_INDEX, EsDocProperties.ID: SOME_ID, '_score': 1.5,
+            EsDocProperties.SOURCE: SOME_SOURCE}
+SOME_BODY = {
+    'took': 3,
+    EsDocProperties.SCROLL_ID: 'SOME_SCROLL_ID',
+    EsConst.SHARDS: {EsConst.TOTAL: 2, EsConst.FAILED: 0},
+    EsConst.HITS: {EsConst.TOTAL: 1, EsConst.HITS: [SOME_HIT]}
+}
+
+
+class TestSearchResponse(TestCase):
+
+    def setUp(self):
+        self.response = SearchResponse(json.dumps(SOME_BODY).encode('utf-8'))
+
+    def test_body_is_decoded_lazily(self):
+        self.assertIsNone(self.response._body)
+        self.assertEqual(1, self.response.total)
+        self.assertEqual(SOME_BODY, self.response._body)
+        self.assertIsNone(self.response.raw)
+
+    def test_properties(self):
+        self.assertEqual(3, self.response.took)
+        self.assertEqual('SOME_SCROLL_ID', self.response.scroll_id)
+        self.assertFalse(self.response.timed_out)
+        self.assertEqual({}, self.response.aggregations)
+        self.assertEqual(1, len(self.response))
+
+    def test_hits(self):
+        hit = self.response.hits[0]
+        self.assertEqual(SOME_ID, hit.id)
+        self.assertEqual(SOME_INDEX, hit.index)
+        self.assertEqual(1.5, hit.score)
+        self.assertEqual(SOME_SOURCE, hit.source)
+        self.assertEqual('sonic', hit.get_field('user.name'))
+        self.assertIsNone(hit.get_field('user.missing'))
+
+    def test_empty_page_is_truthy(self):
+        response = SearchResponse.from_body({EsConst.HITS: {EsConst.TOTAL: 0, EsConst.HITS: []}})
+        self.assertEqual(0, len(response))
+        self.assertTrue(response)
+
+    def test_hit_has_no_instance_dict(self):
+        self.assertFalse(hasattr(Hit(SOME_HIT), '__dict__'))
+
+    def test_es_utils_support(self):
+        self.assertEqual([SOME_HIT], EsUtils.extract_hits(self.response))
+
+
+class TestElasticsearchTypedResponses(TestCase):
+
+    def setUp(self):
+        self.async_client = MagicMock()
+        self.es = Elasticsearch(SOME_HOSTS_CONFIG, 10, self.async_client, typed_responses=True)
+
+    def _respond(self, code, body):
+        response = MagicMock()
+        response.code = code
+        response.content = MagicMock(return_value=succeed(json.dumps(body).encode('utf-8')))
+        response.json = MagicMock(return_value=succeed(body))
+        self.async_client.request = MagicMock(return_value=response)
+
+    @inlineCallbacks
+    def test_search_returns_typed_response(self):
+        self._respond(ResponseCodes.OK, SOME_BODY)
+        result = yield self.es.search(SOME_INDEX, body={})
+        self.assertIsInstance(result, SearchResponse)
+        self.assertEqual(SOME_ID, result.hits[0].id)
+
+    @inlineCallbacks
+    def test_failed_search_raises(self):
+        self._respond(ResponseCodes.NOT_FOUND, {'error': 'no such index'})
+        e = yield self.assertFailure(self.es.search(SOME_INDEX, body={}), NotFoundError)
+        self.assertEqual({'error': 'no such index'}, e.info)
+
+    @inlineCallbacks
+    def test_batched_search_returns_typed_response(self):
+        es = Elasticsearch(SOME_HOSTS_CONFIG, 10, self.async_client, typed_responses=True, batch_searches=True)
+        self._respond(ResponseCodes.OK, {'responses': [SOME_BODY]})
+        d = es.search(SOME_INDEX, body={})
+        yield es._search_batcher.flush()
+        result = yield d
+        self.assertIsInstance(result, SearchResponse)
+        self.assertEqual(SOME_ID, result.hits[0].id)
@@ -1,7 +1,7 @@
 
 from twisted.internet.defer import inlineCallbacks
 from twisted.trial.unittest import TestCase
-from mock import MagicMock
+from mock import MagicMock, patch
 from twisted.web._newclient import ResponseNeverReceived
 
 from twistes.client import Elasticsearch
@@ -47,6 +47,26 @@ class TestRetries(TestCase):
         self.assertEqual(NUM_RETRIES, async_http_client.request.call_count)
         self.assertEqual(SOME_CONTENT, r)
 
+    @inlineCallbacks
+    def test_deadline_spans_retries(self):
+        now = [0]
+
+        def request_side_effect(*args, **kwargs):
+            now[0] += 2
+            raise ResponseNeverReceived("test")
+
+        async_http_client = MagicMock()
+        async_http_client.request = MagicMock(side_effect=request_side_effect)
+        es = self.get_es(async_http_client)
+
+        with patch('twistes.client.reactor.seconds', side_effect=lambda: now[0]):
+            yield self.assertFailure(es._perform_request(METHOD, PATH, BODY, params={'deadline': 3}),
+                                     ConnectionTimeout)
+
+        self.assertEqual(2, async_http_client.request.call_count)
+        timeouts = [kwargs['timeout'] for _, kwargs in async_http_client.request.call_args_list]
+        self.assertEqual([3, 1], timeouts)
+
     @staticmethod
     def generate_response(response_code):
         response = MagicMock()
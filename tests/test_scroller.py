@@ -1,9 +1,9 @@
 from mock import MagicMock
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet.defer import inlineCallbacks, succeed, fail
 from twisted.trial.unittest import TestCase
 
-from twistes.consts import EsConst, EsDocProperties
-from twistes.scroller import Scroller
+from twistes.consts import EsConst, EsDocProperties, EsAggregation
+from twistes.scroller import Scroller, CompositeAggregationScroller
 
 SOME_VALUE_1 = "SOME_VALUE_1"
 SOME_VALUE_2 = "SOME_VALUE_2"
@@ -13,6 +13,7 @@ SOME_ID_2 = "SOME_ID_2"
 SOME_ID_3 = "SOME_ID_3"
 SOME_ID_4 = "SOME_ID_4"
 SOME_SCROLL = "2m"
+SOME_AGG = "SOME_AGG"
 
 
 class TestScroller(TestCase):
@@ -38,6 +39,32 @@ class TestScroller(TestCase):
         self.assertEqual(results, expected_results)
         es.scroll.assert_called_once_with(scroll_id, scroll=SOME_SCROLL)
 
+    @inlineCallbacks
+    def test_scroll_passes_request_timeout(self):
+        some_results = self.create_valid_es_result([{SOME_VALUE_1: SOME_VALUE_2}], SOME_ID_1)
+        es = MagicMock()
+        es.scroll = MagicMock(return_value=self.create_valid_es_result([], SOME_ID_2))
+        scroller = Scroller(es, some_results, SOME_SCROLL, 1, request_timeout=120)
+        yield scroller.next()
+        yield scroller.next()
+        es.scroll.assert_called_once_with(SOME_ID_1, scroll=SOME_SCROLL, request_timeout=120)
+
+    @inlineCallbacks
+    def test_clear_after_the_last_page(self):
+        some_results = self.create_valid_es_result([{SOME_VALUE_1: SOME_VALUE_2}], SOME_ID_1)
+        es = MagicMock()
+        es.scroll = MagicMock(return_value=self.create_valid_es_result([], SOME_ID_2))
+        es.clear_scroll = MagicMock(return_value=succeed(None))
+        scroller = Scroller(es, some_results, SOME_SCROLL, 1)
+        yield scroller.next()
+        yield scroller.next()
+        self.assertRaises(StopIteration, scroller.next)
+
+        yield scroller.clear()
+        es.clear_scroll.assert_called_once_with(scroll_id=SOME_ID_2)
+        yield scroller.clear()
+        self.assertEqual(1, es.clear_scroll.call_count)
+
     @inlineCallbacks
     def test_scroll_iterator(self):
         expected_result_1 = [{
@@ -105,3 +132,89 @@ class TestScroller(TestCase):
                 EsConst.TOTAL: 2
             }
         }
+
+
+class TestCompositeAggregationScroller(TestCase):
+
+    @staticmethod
+    def create_body(size=2):
+        return {'aggs': {SOME_AGG: {'composite': {'size': size, 'sources': []}}}}
+
+    @staticmethod
+    def create_page(buckets, after_key=None):
+        agg = {EsAggregation.BUCKETS: buckets}
+        if after_key is not None:
+            agg['after_key'] = after_key
+        return {EsAggregation.AGGREGATIONS: {SOME_AGG: agg}}
+
+    def create_es(self, pages):
+        es = MagicMock()
+        searched_afters = []
+
+        def search_side_effect(index=None, doc_type=None, body=None, **query_params):
+            searched_afters.append(body['aggs'][SOME_AGG]['composite'].get('after'))
+            return succeed(pages[len(searched_afters) - 1])
+
+        es.search = MagicMock(side_effect=search_side_effect)
+        return es, searched_afters
+
+    @inlineCallbacks
+    def test_follows_after_key(self):
+        es, searched_afters = self.create_es([
+            self.create_page([{'key': {'a': 1}}, {'key': {'a': 2}}], after_key={'a': 2}),
+            self.create_page([{'key': {'a': 3}}], after_key={'a': 3})
+        ])
+        body = self.create_body()
+        scroller = CompositeAggregationScroller(es, SOME_AGG, SOME_ID_1, body=body)
+
+        pages = []
+        for d in scroller:
+            buckets = yield d
+            pages.append([bucket['key']['a'] for bucket in buckets])
+
+        self.assertEqual([[1, 2], [3]], pages)
+        self.assertEqual([None, {'a': 2}], searched_afters)
+        self.assertTrue('after' not in body['aggs'][SOME_AGG]['composite'])
+        self.assertEqual(0, es.search.call_args[1]['body']['size'])
+
+    @inlineCallbacks
+    def test_falls_back_to_last_bucket_key(self):
+        es, searched_afters = self.create_es([
+            self.create_page([{'key': {'a': 1}}, {'key': {'a': 2}}]),
+            self.create_page([])
+        ])
+        scroller = CompositeAggregationScroller(es, SOME_AGG, body=self.create_body())
+        pages = []
+        for d in scroller:
+            pages.append((yield d))
+        self.assertEqual(2, len(pages))
+        self.assertEqual([None, {'a': 2}], searched_afters)
+
+    @inlineCallbacks
+    def test_prefetch_requests_next_page_early(self):
+        es, _ = self.create_es([
+            self.create_page([{'key': {'a': 1}}, {'key': {'a': 2}}], after_key={'a': 2}),
+            self.create_page([{'key': {'a': 3}}], after_key={'a': 3})
+        ])
+        scroller = CompositeAggregationScroller(es, SOME_AGG, body=self.create_body(), prefetch=True)
+        yield scroller.next()
+        self.assertEqual(2, es.search.call_count)
+        buckets = yield scroller.next()
+        self.assertEqual([{'key': {'a': 3}}], buckets)
+        self.assertEqual(2, es.search.call_count)
+        self.assertRaises(StopIteration, scroller.next)
+
+    def test_body_without_the_aggregation(self):
+        self.assertRaises(ValueError, CompositeAggregationScroller, MagicMock(), SOME_AGG)
+
+    @inlineCallbacks
+    def test_failed_prefetch(self):
+        es = MagicMock()
+        es.search = MagicMock(side_effect=[
+            succeed(self.create_page([{'key': {'a': 1}}, {'key': {'a': 2}}], after_key={'a': 2})),
+            fail(ValueError())
+        ])
+        scroller = CompositeAggregationScroller(es, SOME_AGG, body=self.create_body(), prefetch=True)
+        yield scroller.next()
+        self.assertEqual(2, es.search.call_count)
+        yield self.assertFailure(scroller.next(), ValueError)
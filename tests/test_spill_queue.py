@@ -0,0 +1,151 @@
+import shutil
+import tempfile
+
+from mock import MagicMock
+from twisted.internet.defer import inlineCallbacks, succeed, fail
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+
+from twistes.bulk_utils import BulkUtility
+from twistes.exceptions import ConnectionTimeout, ConnectionError, RequestError
+from twistes.spill_queue import SpillQueue, SpillQueueFull
+
+SOME_CHUNK = ['{"index": {"_id": "1"}}', '{"field": "value"}']
+OTHER_CHUNK = ['{"delete": {"_id": "2"}}']
+SOME_PARAMS = {'index': 'some_index'}
+SOME_RESPONSE = {'items': [{'index': {'status': 201}}, {'delete': {'status': 404}}]}
+
+
+class TestSpillQueue(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def create_queue(self, **kwargs):
+        queue = SpillQueue(self.directory, segment_size=256, **kwargs)
+        self.addCleanup(queue.close)
+        return queue
+
+    def test_chunks_are_read_in_order(self):
+        queue = self.create_queue()
+        queue.append(SOME_CHUNK, SOME_PARAMS)
+        queue.append(OTHER_CHUNK)
+
+        self.assertEqual(2, len(queue))
+        self.assertEqual((SOME_CHUNK, SOME_PARAMS), queue.peek())
+        queue.commit()
+        self.assertEqual((OTHER_CHUNK, {}), queue.peek())
+        queue.commit()
+        self.assertIsNone(queue.peek())
+
+    def test_pending_chunks_survive_reopen(self):
+        queue = self.create_queue()
+        queue.append(SOME_CHUNK)
+        queue.append(OTHER_CHUNK)
+        queue.commit()
+        queue.close()
+
+        queue = self.create_queue()
+        self.assertEqual(1, len(queue))
+        self.assertEqual((OTHER_CHUNK, {}), queue.peek())
+
+    def test_consumed_segments_are_removed(self):
+        queue = self.create_queue()
+        for _ in range(10):
+            queue.append(SOME_CHUNK)
+        self.assertTrue(queue.disk_usage > 256)
+
+        for _ in range(10):
+            queue.commit()
+        self.assertEqual(256, queue.disk_usage)
+
+    def test_disk_usage_is_capped(self):
+        queue = self.create_queue(max_bytes=512)
+        self.assertRaises(SpillQueueFull, lambda: [queue.append(SOME_CHUNK) for _ in range(100)])
+
+
+class TestBulkSpill(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.queue = SpillQueue(self.directory, segment_size=1024)
+        self.addCleanup(self.queue.close)
+        self.es = MagicMock()
+        self.clock = Clock()
+        self.replay_failures = []
+        self.bulk_utility = self.create_bulk_utility()
+
+    def create_bulk_utility(self):
+        return BulkUtility(self.es, spill_queue=self.queue, replay_interval=5,
+                           replay_failure_callback=self.replay_failures.append, clock=self.clock)
+
+    def sent_chunks(self):
+        return [call[0][0] for call in self.es.bulk.call_args_list]
+
+    @inlineCallbacks
+    def test_timed_out_chunk_is_spilled_and_replayed(self):
+        self.es.bulk = MagicMock(side_effect=lambda *args, **kwargs: fail(ConnectionTimeout('timeout')))
+        results = yield self.bulk_utility._process_bulk_chunk(SOME_CHUNK, **SOME_PARAMS)
+        self.assertEqual([], results)
+        self.assertEqual(1, len(self.queue))
+        self.assertEqual(1, self.bulk_utility.spilled)
+
+        self.es.bulk = MagicMock(side_effect=lambda *args, **kwargs: succeed(SOME_RESPONSE))
+        self.clock.advance(5)
+        self.assertEqual(0, len(self.queue))
+        self.es.bulk.assert_called_once_with('\n'.join(SOME_CHUNK) + '\n', **SOME_PARAMS)
+        self.assertEqual([[{'delete': {'status': 404}}]], self.replay_failures)
+
+    @inlineCallbacks
+    def test_replay_stats(self):
+        self.queue.append(SOME_CHUNK, SOME_PARAMS)
+        self.es.bulk = MagicMock(side_effect=lambda *args, **kwargs: succeed(SOME_RESPONSE))
+        stats = yield self.bulk_utility.replay_spilled()
+        self.assertEqual((1, 1), stats)
+        self.assertEqual(0, len(self.queue))
+
+    @inlineCallbacks
+    def test_new_chunks_go_behind_spilled_chunks(self):
+        self.queue.append(SOME_CHUNK)
+        self.es.bulk = MagicMock(side_effect=lambda *args, **kwargs: succeed(SOME_RESPONSE))
+        results = yield self.bulk_utility._process_bulk_chunk(OTHER_CHUNK)
+        self.assertEqual([], results)
+        self.assertEqual(2, len(self.queue))
+        self.assertFalse(self.es.bulk.called)
+
+        self.clock.advance(5)
+        self.assertEqual(0, len(self.queue))
+        self.assertEqual(['\n'.join(SOME_CHUNK) + '\n', '\n'.join(OTHER_CHUNK) + '\n'], self.sent_chunks())
+
+    def test_replay_is_retried_while_unreachable(self):
+        self.queue.append(SOME_CHUNK)
+        self.es.bulk = MagicMock(side_effect=lambda *args, **kwargs: fail(ConnectionError('refused')))
+        self.bulk_utility._process_bulk_chunk(OTHER_CHUNK)
+        self.clock.advance(5)
+        self.assertEqual(2, len(self.queue))
+
+        self.es.bulk = MagicMock(side_effect=lambda *args, **kwargs: succeed(SOME_RESPONSE))
+        self.clock.advance(5)
+        self.assertEqual(0, len(self.queue))
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+    def test_rejected_chunk_does_not_block_the_queue(self):
+        self.queue.append(SOME_CHUNK)
+        self.queue.append(OTHER_CHUNK)
+        responses = [fail(RequestError({'error': 'malformed'})), succeed({'items': [{'delete': {'status': 200}}]})]
+        self.es.bulk = MagicMock(side_effect=lambda *args, **kwargs: responses.pop(0))
+        bulk_utility = self.create_bulk_utility()
+
+        self.clock.advance(5)
+        self.assertEqual(0, len(self.queue))
+        self.assertEqual(2, bulk_utility.client.bulk.call_count)
+        self.assertEqual(1, len(self.replay_failures))
+        op_type, item = self.replay_failures[0][0].popitem()
+        self.assertEqual(('index', '1'), (op_type, item['_id']))
+
+    def test_not_connection_errors_are_not_spilled(self):
+        self.es.bulk = MagicMock(side_effect=lambda *args, **kwargs: fail(RequestError({'error': 'malformed'})))
+        self.failureResultOf(self.bulk_utility._process_bulk_chunk(SOME_CHUNK), RequestError)
+        self.assertEqual(0, len(self.queue))
@@ -0,0 +1,91 @@
+from mock import MagicMock
+from twisted.internet.defer import inlineCallbacks, succeed
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+
+from twistes.client import Elasticsearch
+from twistes.consts import HttpMethod, EsMethods
+from twistes.exceptions import ElasticsearchException, BulkIndexError
+from twistes.tasks import TaskHandle
+
+SOME_TASK_ID = 'node:123'
+SOME_INDEX = 'SOME_INDEX'
+SOME_QUERY = {'query': {'match_all': {}}}
+SOME_STATUS = {'total': 10, 'deleted': 5}
+SOME_RESPONSE = {'total': 10, 'deleted': 10, 'failures': []}
+
+
+class TestTaskHandle(TestCase):
+
+    def setUp(self):
+        self.es = MagicMock()
+        self.clock = Clock()
+        self.task = TaskHandle(self.es, SOME_TASK_ID, EsMethods.DELETE_BY_QUERY, SOME_INDEX)
+
+    def set_task_infos(self, *task_infos):
+        self.es.get_task = MagicMock(side_effect=[succeed(info) for info in task_infos])
+
+    def test_wait_polls_until_completed(self):
+        self.set_task_infos({'completed': False, 'task': {'status': SOME_STATUS}},
+                            {'completed': True, 'task': {'status': SOME_RESPONSE}, 'response': SOME_RESPONSE})
+        progress = MagicMock()
+        d = self.task.wait(poll_interval=5, progress_callback=progress, clock=self.clock)
+        self.assertNoResult(d)
+        self.assertEqual(1, self.es.get_task.call_count)
+
+        self.clock.advance(5)
+        self.assertEqual(SOME_RESPONSE, self.successResultOf(d))
+        self.assertEqual(2, self.es.get_task.call_count)
+        self.assertEqual(2, progress.call_count)
+        progress.assert_called_with(SOME_RESPONSE)
+        self.es.invalidate_cache.assert_called_once_with(SOME_INDEX)
+
+    def test_wait_fails_when_the_task_failed(self):
+        self.set_task_infos({'completed': True, 'error': {'type': 'some_error'}})
+        d = self.task.wait(clock=self.clock)
+        self.failureResultOf(d, ElasticsearchException)
+
+    def test_wait_fails_on_document_failures(self):
+        failures = [{'index': SOME_INDEX, 'id': '1', 'status': 409}]
+        response = dict(SOME_RESPONSE, failures=failures)
+        self.set_task_infos({'completed': True, 'response': response}, {'completed': True, 'response': response})
+
+        e = self.failureResultOf(self.task.wait(clock=self.clock), BulkIndexError).value
+        self.assertEqual(failures, e.errors)
+        self.assertEqual(response, self.successResultOf(self.task.wait(clock=self.clock, raise_on_failures=False)))
+
+    def test_rethrottle_uses_the_task_action(self):
+        self.task.rethrottle(100)
+        self.es.rethrottle.assert_called_once_with(SOME_TASK_ID, 100, action=EsMethods.DELETE_BY_QUERY)
+
+
+class TestTaskSubmission(TestCase):
+
+    def setUp(self):
+        self.es = Elasticsearch([{'host': 'localhost', 'port': 9200}], async_http_client=MagicMock())
+        self.es._perform_write_request = MagicMock(return_value=succeed({'task': SOME_TASK_ID}))
+        self.es._perform_request = MagicMock(return_value=succeed({}))
+
+    @inlineCallbacks
+    def test_delete_by_query_returns_task_handle(self):
+        task = yield self.es.delete_by_query(SOME_INDEX, SOME_QUERY, requests_per_second=500, slices=5)
+
+        self.assertEqual(SOME_TASK_ID, task.task_id)
+        self.assertEqual(EsMethods.DELETE_BY_QUERY, task.action)
+        self.es._perform_write_request.assert_called_once_with(
+            HttpMethod.POST, '/SOME_INDEX/_delete_by_query', SOME_QUERY,
+            params={'requests_per_second': 500, 'slices': 5, 'wait_for_completion': 'false'}, index=SOME_INDEX)
+
+    @inlineCallbacks
+    def test_reindex_targets_the_dest_index(self):
+        body = {'source': {'index': 'old'}, 'dest': {'index': 'new'}}
+        task = yield self.es.reindex(body)
+
+        self.assertEqual('new', task.index)
+        self.assertEqual('/_reindex', self.es._perform_write_request.call_args[0][1])
+
+    @inlineCallbacks
+    def test_rethrottle(self):
+        yield self.es.rethrottle(SOME_TASK_ID, 1000, action=EsMethods.UPDATE_BY_QUERY)
+        self.es._perform_request.assert_called_once_with(
+            HttpMethod.POST, '/_update_by_query/node%3A123/_rethrottle', params={'requests_per_second': 1000})
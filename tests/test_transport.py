@@ -0,0 +1,107 @@
+from base64 import b64encode
+
+from twisted.internet import reactor
+from twisted.internet.defer import inlineCallbacks
+from twisted.internet.task import deferLater
+from twisted.trial.unittest import TestCase
+from twisted.web.server import Site
+
+from twistes.bench.fake_server import FakeElasticsearch, Fault, start_fake_server, hosts_of
+from twistes.client import Elasticsearch
+from twistes.consts import HostParsing
+from twistes.exceptions import ConnectionTimeout
+from twistes.transport import AgentTransport
+
+
+class HeadersRecordingElasticsearch(FakeElasticsearch):
+
+    def __init__(self, **options):
+        FakeElasticsearch.__init__(self, **options)
+        self.headers = []
+
+    def render(self, request):
+        self.headers.append(request.requestHeaders)
+        return FakeElasticsearch.render(self, request)
+
+
+class TestAgentTransport(TestCase):
+
+    def setUp(self):
+        self.listening_port, self.server = start_fake_server(total_hits=5)
+        self.addCleanup(self.listening_port.stopListening)
+        self.transport = AgentTransport()
+        self.es = Elasticsearch(hosts_of(self.listening_port), async_http_client=self.transport)
+        self.addCleanup(self.es.close)
+
+    @inlineCallbacks
+    def test_search(self):
+        result = yield self.es.search('bench', 'doc', body={'query': {'match_all': {}}, 'size': 3})
+
+        self.assertEqual(3, len(result['hits']['hits']))
+
+    @inlineCallbacks
+    def test_get(self):
+        result = yield self.es.get('bench', '7', doc_type='doc')
+
+        self.assertEqual('7', result['_id'])
+
+    @inlineCallbacks
+    def test_timeout(self):
+        self.server.slow_latency = 0.1
+        self.server.inject(Fault.SLOW, endpoint='search')
+
+        yield self.assertFailure(self.es.search('bench', 'doc', request_timeout=0.02), ConnectionTimeout)
+        # let the fake server give up on the slow response
+        yield deferLater(reactor, 0.15, lambda: None)
+
+    @inlineCallbacks
+    def test_dropped_connection(self):
+        self.server.inject(Fault.DROP, endpoint='get')
+
+        yield self.assertFailure(self.es.get('bench', '1', doc_type='doc'), ConnectionTimeout)
+
+    @inlineCallbacks
+    def test_bulk(self):
+        success, failed = yield self.es.bulk_utils.bulk(
+            ({'_index': 'bench', '_type': 'doc', '_id': str(i), 'value': i} for i in range(10)),
+            stats_only=True)
+
+        self.assertEqual((10, 0), (success, failed))
+        self.assertTrue(self.server.stats.bytes_in > 0)
+
+    @inlineCallbacks
+    def test_warm_up_uses_transport_pool(self):
+        opened = yield self.es.warm_up(connections=2)
+
+        self.assertEqual(2, opened)
+        self.assertEqual(self.transport.pool.maxPersistentPerHost,
+                         self.es._connection_pool().maxPersistentPerHost)
+
+
+class TestAgentTransportHeaders(TestCase):
+
+    def setUp(self):
+        self.server = HeadersRecordingElasticsearch()
+        site = Site(self.server)
+        site.noisy = False
+        self.listening_port = reactor.listenTCP(0, site, interface='127.0.0.1')
+        self.addCleanup(self.listening_port.stopListening)
+
+    @inlineCallbacks
+    def test_auth_and_custom_headers(self):
+        hosts = hosts_of(self.listening_port)
+        hosts[0][HostParsing.HTTP_AUTH] = 'user:secret'
+        transport = AgentTransport(headers={'X-Opaque-Id': 'bench'})
+        es = Elasticsearch(hosts, async_http_client=transport)
+        self.addCleanup(es.close)
+
+        yield es.search('bench', 'doc', body={'query': {'match_all': {}}})
+        yield es.search('bench', 'doc', body={'query': {'match_all': {}}})
+
+        self.assertEqual(2, len(self.server.headers))
+        headers = self.server.headers[0]
+        self.assertEqual([b'Basic ' + b64encode(b'user:secret')], headers.getRawHeaders(b'authorization'))
+        self.assertEqual([b'bench'], headers.getRawHeaders(b'x-opaque-id'))
+        self.assertEqual([b'application/json'], headers.getRawHeaders(b'content-type'))
+        # the headers of an auth are computed once
+        self.assertEqual(1, len(transport._headers_by_auth))
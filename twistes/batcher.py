@@ -0,0 +1,187 @@
+from operator import itemgetter
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, succeed
+
+from twistes.consts import EsConst, EsDocProperties, NULL_VALUES
+from twistes.exceptions import NotFoundError, ElasticsearchException, HTTP_EXCEPTIONS
+
+
+class Batcher(object):
+    """
+    Batching of concurrent requests (DataLoader style).
+
+    The requests that are queued within the same reactor iteration (or the given window)
+    are sent together, and each caller's deferred fires with its own result.
+    How a batch is sent and how the batch response is split are given by the callables
+    the subclasses pass in.
+    """
+
+    def __init__(self, send_batch, resolve_one, window=0, max_batch_size=1000, clock=None):
+        """
+        :param send_batch: callable that sends a list of requests and returns a deferred that fires with
+            the list of the per request responses
+        :param resolve_one: callable that fires the deferred of a caller with (or fails it by) its response
+        :param window: the time in seconds to wait for more requests before sending the batch
+        :param max_batch_size: the max number of requests in one batch, a full batch is sent right away
+        :param clock: the time provider (IReactorTime), defaults to the reactor
+        """
+        self._send_batch = send_batch
+        self._resolve_one = resolve_one
+        self._window = window
+        self._max_batch_size = max_batch_size
+        self._clock = clock or reactor
+        self._pending = []
+        self._delayed_flush = None
+
+    def _enqueue(self, request):
+        d = Deferred()
+        self._pending.append((request, d))
+
+        if len(self._pending) >= self._max_batch_size:
+            self.flush()
+        elif self._delayed_flush is None:
+            self._delayed_flush = self._clock.callLater(self._window, self.flush)
+
+        return d
+
+    def flush(self):
+        """
+        Send the pending requests now.
+        :return: deferred that fires once the batch was resolved
+        """
+        if self._delayed_flush is not None:
+            if self._delayed_flush.active():
+                self._delayed_flush.cancel()
+            self._delayed_flush = None
+
+        pending, self._pending = self._pending, []
+        if not pending:
+            return succeed(None)
+
+        d = self._send_batch([request for request, _ in pending])
+        d.addCallbacks(self._resolve, self._fail, callbackArgs=(pending,), errbackArgs=(pending,))
+        return d
+
+    def _resolve(self, responses, pending):
+        if len(responses) != len(pending):
+            msg_fmt = "batch returned {responses} responses for {requests} requests"
+            self._fail(ElasticsearchException(msg_fmt.format(responses=len(responses), requests=len(pending))),
+                       pending)
+            return
+
+        for response, (_, d) in zip(responses, pending):
+            self._resolve_one(response, d)
+
+    @staticmethod
+    def _fail(failure, pending):
+        for _, d in pending:
+            d.errback(failure)
+
+    def __len__(self):
+        return len(self._pending)
+
+
+class GetBatcher(Batcher):
+    """
+    Batch single document gets into mget requests.
+
+    Each caller gets its own document, or a NotFoundError if it wasn't found.
+    """
+    INDEX_NOT_FOUND = 'index_not_found_exception'
+
+    def __init__(self, es, window=0, max_batch_size=1000, clock=None):
+        """
+        :param es: the Elasticsearch client
+        """
+        super(GetBatcher, self).__init__(self._send_docs, self._resolve_doc, window, max_batch_size, clock)
+        self._es = es
+
+    def get(self, index, id, doc_type=EsConst.ALL_VALUES, fields=None):
+        """
+        Queue a get of a single document.
+        :return: deferred that fires with the document, like :meth:`~twistes.client.Elasticsearch.get`
+        """
+        doc = {EsDocProperties.INDEX: index, EsDocProperties.ID: id}
+        if doc_type and doc_type != EsConst.ALL_VALUES:
+            doc[EsDocProperties.TYPE] = doc_type
+        if fields:
+            doc[EsConst.FIELDS] = fields
+
+        return self._enqueue(doc)
+
+    def _send_docs(self, docs):
+        d = self._es.mget({'docs': docs})
+        d.addCallback(itemgetter('docs'))
+        return d
+
+    def _resolve_doc(self, doc, d):
+        if doc.get(EsConst.FOUND):
+            d.callback(doc)
+        elif 'error' in doc:
+            d.errback(self._doc_error(doc))
+        else:
+            d.errback(NotFoundError(doc))
+
+    def _doc_error(self, doc):
+        error = doc['error']
+        if isinstance(error, dict) and error.get('type') == self.INDEX_NOT_FOUND:
+            return NotFoundError(doc)
+
+        msg_fmt = "mget doc error; message: {msg}"
+        return ElasticsearchException(msg_fmt.format(msg=str(error)))
+
+
+class SearchBatcher(Batcher):
+    """
+    Batch searches into msearch requests.
+
+    Each caller gets its own search response, or the exception matching the
+    status of its failed response.
+    """
+    # the search params that can be passed in the msearch header of a search
+    HEADER_PARAMS = frozenset(['search_type', 'preference', 'routing', 'request_cache'])
+
+    def __init__(self, es, window=0, max_batch_size=1000, clock=None):
+        """
+        :param es: the Elasticsearch client
+        """
+        super(SearchBatcher, self).__init__(self._send_searches, self._resolve_search, window, max_batch_size,
+                                            clock)
+        self._es = es
+
+    def search(self, index=None, doc_type=None, body=None, **header_params):
+        """
+        Queue a search.
+        :param header_params: search params, only HEADER_PARAMS are supported
+        :return: deferred that fires with the search response, like :meth:`~twistes.client.Elasticsearch.search`
+        """
+        header = dict((key, value) for key, value in header_params.items() if value not in NULL_VALUES)
+        if index not in NULL_VALUES:
+            header['index'] = index
+        if doc_type not in NULL_VALUES:
+            header['type'] = doc_type
+
+        return self._enqueue((header, body or {}))
+
+    def _send_searches(self, searches):
+        lines = []
+        for header, body in searches:
+            lines.append(header)
+            lines.append(body)
+
+        d = self._es.msearch(lines)
+        d.addCallback(itemgetter('responses'))
+        return d
+
+    def _resolve_search(self, response, d):
+        if 'error' not in response:
+            d.callback(response)
+            return
+
+        status = response.get('status')
+        if status in HTTP_EXCEPTIONS:
+            d.errback(HTTP_EXCEPTIONS[status](response))
+        else:
+            msg_fmt = "unknown error; code: {code} | message: {msg}"
+            d.errback(ElasticsearchException(msg_fmt.format(code=status, msg=str(response['error']))))
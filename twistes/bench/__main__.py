@@ -0,0 +1,80 @@
+"""
+Load generator: drive a mix of operations against a cluster, or the local fake server when no target is given.
+
+Examples:
+    python -m twistes.bench --mix search=8 get=2 --users 50 --duration 30
+    python -m twistes.bench --target http://localhost:9200 --mix bulk=1 --rate 200 --histogram
+"""
+import argparse
+import sys
+
+from twisted.internet import task
+from twisted.internet.defer import inlineCallbacks
+
+from twistes.bench.fake_server import start_fake_server, hosts_of
+from twistes.bench.load import LoadGenerator, OPERATIONS, format_report
+from twistes.client import Elasticsearch
+from twistes.transport import AgentTransport
+
+
+def parse_mix(value):
+    operation, _, weight = value.partition('=')
+    if operation not in OPERATIONS:
+        raise argparse.ArgumentTypeError('unknown operation {operation}, one of: {operations}'.format(
+            operation=operation, operations=', '.join(OPERATIONS)))
+    return operation, float(weight or 1)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='python -m twistes.bench', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--target', help='the cluster url, a local fake server is started when not given')
+    parser.add_argument('--mix', nargs='+', type=parse_mix, default=[('search', 1)], metavar='OP=WEIGHT',
+                        help='the operations and their relative weights, of: {ops}'.format(ops=', '.join(OPERATIONS)))
+    parser.add_argument('--users', type=int, default=10, help='virtual users (max operations in flight)')
+    parser.add_argument('--duration', type=float, default=10, help='seconds to generate load')
+    parser.add_argument('--rate', type=float, help='open loop arrival rate in operations/s, closed loop if not set')
+    parser.add_argument('--index', default='bench')
+    parser.add_argument('--doc-type', default='doc')
+    parser.add_argument('--search-size', type=int, default=10, help='hits per search')
+    parser.add_argument('--bulk-size', type=int, default=100, help='documents per bulk')
+    parser.add_argument('--doc-size', type=int, default=100, help='size in bytes of the written documents')
+    parser.add_argument('--timeout', type=float, default=10, help='client request timeout in seconds')
+    parser.add_argument('--latency', type=float, default=0, help='latency in seconds of the local fake server')
+    parser.add_argument('--seed', type=int, help='seed of the operation mix and document ids')
+    parser.add_argument('--histogram', action='store_true', help='print the latency percentile distribution')
+    parser.add_argument('--transport', choices=('treq', 'agent'), default='treq',
+                        help='the http client, treq or the lean twisted.web Agent transport')
+    return parser.parse_args(argv)
+
+
+@inlineCallbacks
+def main(reactor, *argv):
+    args = parse_args(argv)
+    listening_port = None
+    if args.target:
+        hosts = args.target
+    else:
+        listening_port, _ = start_fake_server(latency=args.latency, doc_size=args.doc_size, seed=args.seed)
+        hosts = hosts_of(listening_port)
+
+    if args.transport == 'agent':
+        transport = AgentTransport(maxPersistentPerHost=args.users)
+        es = Elasticsearch(hosts, timeout=args.timeout, async_http_client=transport)
+    else:
+        es = Elasticsearch(hosts, timeout=args.timeout, async_http_client_params={'maxPersistentPerHost': args.users})
+    load = LoadGenerator(es, dict(args.mix), users=args.users, duration=args.duration, rate=args.rate,
+                         index=args.index, doc_type=args.doc_type, search_size=args.search_size,
+                         bulk_size=args.bulk_size, doc_size=args.doc_size, seed=args.seed)
+    try:
+        stats = yield load.run()
+    finally:
+        yield es.close()
+        if listening_port is not None:
+            yield listening_port.stopListening()
+
+    print(format_report(stats, load.elapsed, distribution=args.histogram))
+
+
+if __name__ == '__main__':
+    task.react(main, sys.argv[1:])
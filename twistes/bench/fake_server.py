@@ -0,0 +1,360 @@
+import json
+import random
+
+from twisted.internet import reactor
+from twisted.web.resource import Resource
+from twisted.web.server import Site, NOT_DONE_YET
+
+from twistes.consts import EsBulk, EsConst, EsDocProperties, EsMethods, HttpMethod, ResponseCodes
+
+TOO_MANY_REQUESTS = 429
+
+
+class ServerStats(object):
+    """
+    Counters of the traffic the fake server handled
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.faults = {}
+
+    @property
+    def bytes(self):
+        return self.bytes_in + self.bytes_out
+
+
+class Fault(object):
+    """
+    The faults the fake server can inject
+    """
+    # answer after the slow latency instead of the normal one
+    SLOW = 'slow'
+    # close the connection without answering (the client gets ResponseNeverReceived)
+    DROP = 'drop'
+    # send only the first half of the response body and close the connection
+    TRUNCATE = 'truncate'
+    # search, scroll and msearch results with a failed shard
+    SHARD_FAILURE = 'shard_failure'
+    # all the items of a bulk are rejected with a 429 status
+    REJECT = 'reject'
+
+    # the endpoints each fault applies to, None for all
+    ENDPOINTS = {SLOW: None, DROP: None, TRUNCATE: None,
+                 SHARD_FAILURE: ('search', 'scroll', 'msearch'), REJECT: ('bulk',)}
+
+    @classmethod
+    def applies_to(cls, fault, endpoint):
+        endpoints = cls.ENDPOINTS[fault]
+        return endpoints is None or endpoint in endpoints
+
+
+class FakeElasticsearch(Resource):
+    """
+    In process stand-in for an elasticsearch node, for benchmarks and resilience tests.
+
+    It answers the apis the client uses with generated documents of a configurable size
+    after a configurable latency, without keeping any data: every document exists and every
+    search matches ``total_hits`` documents. Scroll contexts are encoded in the scroll id.
+
+    Faults (see :class:`Fault`) are injected at random by their ``fault_rates``, or scripted with
+    :meth:`inject` for the next matching requests, e.g.:
+        server.inject(Fault.DROP, times=2, endpoint='search')
+    """
+    isLeaf = True
+    INDEX = 'bench'
+    DOC_TYPE = 'doc'
+
+    def __init__(self, latency=0, doc_size=100, total_hits=1000, rejection_rate=0, fault_rates=None,
+                 slow_latency=1.0, seed=None, clock=None):
+        """
+        :param latency: the time in seconds to wait before answering each request
+        :param doc_size: the approximate size in bytes of the _source of each generated document
+        :param total_hits: the number of documents every search matches
+        :param rejection_rate: the fraction of bulk items that are rejected with a 429 status
+        :param fault_rates: dict of :class:`Fault` to the fraction of the (applicable) requests it is injected to
+        :param slow_latency: the latency in seconds of requests with the slow fault
+        :param seed: the seed of the random rejections and faults, for reproducible runs
+        :param clock: the time provider (IReactorTime), defaults to the reactor
+        """
+        Resource.__init__(self)
+        self.latency = latency
+        self.doc_size = doc_size
+        self.total_hits = total_hits
+        self.rejection_rate = rejection_rate
+        self.fault_rates = fault_rates or {}
+        self.slow_latency = slow_latency
+        self.stats = ServerStats()
+        self._scripted_faults = []
+        self._random = random.Random(seed)
+        self._clock = clock or reactor
+        self._padding = 'x' * max(doc_size - 20, 0)
+
+    def inject(self, fault, times=1, endpoint=None):
+        """
+        Inject a fault to the next requests.
+        :param fault: the :class:`Fault`
+        :param times: the number of requests to inject the fault to
+        :param endpoint: the endpoint name (e.g. 'bulk', 'search', 'scroll', 'get'), any applicable one when not given
+        """
+        self._scripted_faults.append([fault, times, endpoint])
+
+    def _choose_fault(self, endpoint):
+        for scripted in self._scripted_faults:
+            fault, _, fault_endpoint = scripted
+            if fault_endpoint in (None, endpoint) and Fault.applies_to(fault, endpoint):
+                scripted[1] -= 1
+                if not scripted[1]:
+                    self._scripted_faults.remove(scripted)
+                return fault
+
+        for fault, rate in self.fault_rates.items():
+            if Fault.applies_to(fault, endpoint) and self._random.random() < rate:
+                return fault
+
+        return None
+
+    def render(self, request):
+        body = request.content.read()
+        self.stats.requests += 1
+        self.stats.bytes_in += len(body)
+
+        path = [part.decode('utf-8') for part in request.postpath if part]
+        method = request.method.decode('utf-8')
+        endpoint = self.endpoint(path, method)
+        fault = self._choose_fault(endpoint)
+        if fault is not None:
+            self.stats.faults[fault] = self.stats.faults.get(fault, 0) + 1
+
+        if fault == Fault.DROP:
+            request.transport.abortConnection()
+            return NOT_DONE_YET
+
+        args = dict((key.decode('utf-8'), values[-1].decode('utf-8')) for key, values in request.args.items())
+        code, response = self.handle(endpoint, path, method, args, body, fault)
+        if args.get(EsConst.FILTER_PATH):
+            response = filter_response(response, args[EsConst.FILTER_PATH])
+        return self._respond(request, code, response, fault)
+
+    @staticmethod
+    def endpoint(path, method):
+        """
+        :return: the name of the api of the request path
+        """
+        if not path:
+            return 'info'
+        if path[-2:] == [EsMethods.SEARCH, EsMethods.SCROLL]:
+            return 'scroll'
+
+        endpoints = {EsMethods.BULK: 'bulk', EsMethods.SEARCH: 'search', EsMethods.MULTIPLE_SEARCH: 'msearch',
+                     EsMethods.MULTIPLE_GET: 'mget', EsMethods.COUNT: 'count'}
+        if path[-1] in endpoints:
+            return endpoints[path[-1]]
+        if len(path) == 3 and method in (HttpMethod.GET, HttpMethod.HEAD):
+            return 'get'
+        if len(path) in (2, 3) and method in (HttpMethod.PUT, HttpMethod.POST):
+            return 'index'
+        return None
+
+    def handle(self, endpoint, path, method, args, body, fault=None):
+        """
+        :return: the status code and the response body of the request
+        """
+        if endpoint == 'info':
+            return ResponseCodes.OK, {'version': {'number': '5.6.0'}, 'tagline': 'You Know, for Search'}
+        if endpoint == 'bulk':
+            return ResponseCodes.OK, self.bulk(body, reject_all=fault == Fault.REJECT)
+        if endpoint == 'scroll':
+            return ResponseCodes.OK, self.scroll(body, args, fault == Fault.SHARD_FAILURE)
+        if endpoint == 'search':
+            return ResponseCodes.OK, self.search(self._load(body), args, fault == Fault.SHARD_FAILURE)
+        if endpoint == 'msearch':
+            return ResponseCodes.OK, self.msearch(body, fault == Fault.SHARD_FAILURE)
+        if endpoint == 'mget':
+            return ResponseCodes.OK, self.mget(self._load(body))
+        if endpoint == 'count':
+            return ResponseCodes.OK, {'count': self.total_hits}
+        if endpoint == 'get':
+            return ResponseCodes.OK, self.document(*path)
+        if endpoint == 'index':
+            doc_id = path[2] if len(path) == 3 else str(self._random.getrandbits(32))
+            return ResponseCodes.CREATED, self._write_result(EsBulk.INDEX, path[0], path[1], doc_id, 201)
+
+        return ResponseCodes.NOT_FOUND, {'error': 'no handler for {method} {path}'.format(method=method,
+                                                                                          path='/'.join(path))}
+
+    def _respond(self, request, code, response, fault=None):
+        data = json.dumps(response).encode('utf-8')
+        self.stats.bytes_out += len(data)
+        request.setResponseCode(code)
+        request.setHeader(b'content-type', b'application/json; charset=UTF-8')
+
+        if fault == Fault.TRUNCATE:
+            request.setHeader(b'content-length', str(len(data)).encode('ascii'))
+            data = data[:len(data) // 2]
+
+        latency = self.slow_latency if fault == Fault.SLOW else self.latency
+        if not latency and fault != Fault.TRUNCATE:
+            return data
+
+        finished = []
+        request.notifyFinish().addBoth(finished.append)
+
+        def write():
+            if finished:
+                return
+            request.write(data)
+            if fault == Fault.TRUNCATE:
+                request.transport.loseConnection()
+            else:
+                request.finish()
+
+        if latency:
+            self._clock.callLater(latency, write)
+        else:
+            write()
+        return NOT_DONE_YET
+
+    @staticmethod
+    def _load(body):
+        return json.loads(body.decode('utf-8')) if body else {}
+
+    def document(self, index, doc_type, doc_id):
+        return {EsDocProperties.INDEX: index, EsDocProperties.TYPE: doc_type, EsDocProperties.ID: doc_id,
+                EsDocProperties.VERSION: 1, EsConst.FOUND: True, EsDocProperties.SOURCE: self._source(doc_id)}
+
+    def _source(self, doc_id):
+        return {'id': doc_id, 'payload': self._padding}
+
+    def _hits(self, start, count):
+        return [{EsDocProperties.INDEX: self.INDEX, EsDocProperties.TYPE: self.DOC_TYPE,
+                 EsDocProperties.ID: str(doc_id), '_score': 1.0, EsDocProperties.SOURCE: self._source(str(doc_id))}
+                for doc_id in range(start, start + count)]
+
+    def _search_result(self, start, size, scroll_id=None, shard_failure=False):
+        shards = {EsConst.TOTAL: 2, 'successful': 2, EsConst.FAILED: 0}
+        if shard_failure:
+            shards.update({'successful': 1, EsConst.FAILED: 1, 'failures': [
+                {'shard': 1, 'index': self.INDEX, 'reason': {'type': 'node_disconnected_exception'}}]})
+        result = {'took': 1, 'timed_out': False,
+                  EsConst.SHARDS: shards,
+                  EsConst.HITS: {EsConst.TOTAL: self.total_hits, 'max_score': 1.0,
+                                 EsConst.HITS: self._hits(start, max(min(size, self.total_hits - start), 0))}}
+        if scroll_id is not None:
+            result[EsDocProperties.SCROLL_ID] = scroll_id
+        return result
+
+    def search(self, body, args, shard_failure=False):
+        size = int(args.get('size', body.get('size', 10)))
+        start = int(args.get('from', body.get('from', 0)))
+        scroll_id = self._scroll_id(start + size, size) if EsConst.SCROLL in args else None
+        return self._search_result(start, size, scroll_id, shard_failure)
+
+    def msearch(self, body, shard_failure=False):
+        lines = [line for line in body.decode('utf-8').splitlines() if line]
+        # the header lines are ignored, all the searches run on the generated documents
+        return {'responses': [dict(self.search(json.loads(search_body), {}, shard_failure), status=200)
+                              for search_body in lines[1::2]]}
+
+    def scroll(self, body, args, shard_failure=False):
+        scroll_id = args.get(EsConst.SCROLL_ID)
+        if scroll_id is None:
+            body = body.decode('utf-8')
+            scroll_id = json.loads(body)[EsConst.SCROLL_ID] if body.startswith('{') else body
+
+        _, start, size = scroll_id.split(':')
+        start, size = int(start), int(size)
+        return self._search_result(start, size, self._scroll_id(start + size, size), shard_failure)
+
+    @staticmethod
+    def _scroll_id(start, size):
+        return 'scroll:{start}:{size}'.format(start=start, size=size)
+
+    def mget(self, body):
+        return {'docs': [self.document(doc.get(EsDocProperties.INDEX, self.INDEX),
+                                       doc.get(EsDocProperties.TYPE, self.DOC_TYPE),
+                                       doc[EsDocProperties.ID])
+                         for doc in body.get('docs', ())]}
+
+    def bulk(self, body, reject_all=False):
+        lines = iter(body.decode('utf-8').splitlines())
+        items = []
+        for line in lines:
+            if not line:
+                continue
+            op_type, action = next(iter(json.loads(line).items()))
+            if op_type != EsBulk.DELETE:
+                next(lines)
+
+            status = 201
+            if reject_all or (self.rejection_rate and self._random.random() < self.rejection_rate):
+                status = TOO_MANY_REQUESTS
+            items.append({op_type: self._write_result(op_type, action.get(EsDocProperties.INDEX, self.INDEX),
+                                                      action.get(EsDocProperties.TYPE, self.DOC_TYPE),
+                                                      action.get(EsDocProperties.ID), status)})
+
+        return {'took': 1, 'errors': any(next(iter(item.values()))['status'] >= 300 for item in items),
+                'items': items}
+
+    @staticmethod
+    def _write_result(op_type, index, doc_type, doc_id, status):
+        result = {EsDocProperties.INDEX: index, EsDocProperties.TYPE: doc_type, EsDocProperties.ID: doc_id,
+                  'status': status}
+        if status == TOO_MANY_REQUESTS:
+            result['error'] = {'type': 'es_rejected_execution_exception',
+                               'reason': 'rejected execution of {op_type}'.format(op_type=op_type)}
+        else:
+            result[EsDocProperties.VERSION] = 1
+            result['result'] = 'created'
+        return result
+
+
+def filter_response(response, filter_path):
+    """
+    Apply an elasticsearch ``filter_path`` (comma separated paths, ``*`` matches any key) to a response
+    """
+    filtered = _filter_value(response, [path.split('.') for path in filter_path.split(',')])
+    return {} if filtered is None else filtered
+
+
+def _filter_value(value, paths):
+    if any(not path for path in paths):
+        return value
+    if isinstance(value, list):
+        items = [_filter_value(item, paths) for item in value]
+        return [item for item in items if item is not None] or None
+    if not isinstance(value, dict):
+        return None
+
+    filtered = {}
+    for key, sub_value in value.items():
+        sub_paths = [path[1:] for path in paths if path[0] in ('*', key)]
+        if sub_paths:
+            sub_value = _filter_value(sub_value, sub_paths)
+            if sub_value is not None:
+                filtered[key] = sub_value
+    return filtered or None
+
+
+def start_fake_server(port=0, interface='127.0.0.1', **options):
+    """
+    Start listening with a :class:`FakeElasticsearch`.
+    :param port: the port to listen on, 0 for any free port
+    :param options: the options of the fake server
+    :return: tuple of the listening port and the fake server resource
+    """
+    resource = FakeElasticsearch(**options)
+    site = Site(resource)
+    site.noisy = False
+    listening_port = reactor.listenTCP(port, site, interface=interface)
+    return listening_port, resource
+
+
+def hosts_of(listening_port):
+    """
+    :return: the hosts config of the Elasticsearch client for the listening port
+    """
+    address = listening_port.getHost()
+    return [{'host': address.host, 'port': address.port}]
@@ -0,0 +1,125 @@
+import math
+
+
+class LatencyHistogram(object):
+    """
+    HDR style histogram of latencies with a fixed relative precision.
+
+    The values are recorded as integers of the unit (microseconds by default) in log-linear buckets:
+    values below the sub bucket count are exact, larger values share a bucket with values that
+    differ in less than the given number of significant figures. The memory is bounded by the
+    number of distinct buckets, not by the number of samples.
+    """
+    DEFAULT_PERCENTILES = (50, 75, 90, 95, 99, 99.9, 99.99, 100)
+
+    def __init__(self, significant_figures=3, unit=1e-6):
+        """
+        :param significant_figures: the number of significant decimal figures the values keep (1-5)
+        :param unit: the resolution in seconds of the recorded values
+        """
+        self._unit = unit
+        self._sub_bucket_bits = int(math.ceil(math.log(2 * 10 ** significant_figures, 2)))
+        self._sub_bucket_count = 2 ** self._sub_bucket_bits
+        self._sub_bucket_half = self._sub_bucket_count // 2
+        self._counts = {}
+        self.count = 0
+        self._sum = 0
+        self._min = None
+        self._max = None
+
+    def record(self, seconds, count=1):
+        """
+        Record a latency.
+        :param seconds: the latency in seconds
+        :param count: the number of times it occurred
+        """
+        value = max(int(round(seconds / self._unit)), 0)
+        index = self._index(value)
+        self._counts[index] = self._counts.get(index, 0) + count
+        self.count += count
+        self._sum += value * count
+        self._min = value if self._min is None else min(self._min, value)
+        self._max = value if self._max is None else max(self._max, value)
+
+    def merge(self, other):
+        """
+        Add the samples of another histogram with the same precision.
+        """
+        for index, count in other._counts.items():
+            self._counts[index] = self._counts.get(index, 0) + count
+        self.count += other.count
+        self._sum += other._sum
+        if other._min is not None:
+            self._min = other._min if self._min is None else min(self._min, other._min)
+            self._max = other._max if self._max is None else max(self._max, other._max)
+
+    def _index(self, value):
+        if value < self._sub_bucket_count:
+            return value
+
+        shift = value.bit_length() - self._sub_bucket_bits
+        sub_bucket = value >> shift
+        return self._sub_bucket_count + (shift - 1) * self._sub_bucket_half + sub_bucket - self._sub_bucket_half
+
+    def _highest_equivalent_value(self, index):
+        if index < self._sub_bucket_count:
+            return index
+
+        offset = index - self._sub_bucket_count
+        shift = offset // self._sub_bucket_half + 1
+        sub_bucket = offset % self._sub_bucket_half + self._sub_bucket_half
+        return ((sub_bucket + 1) << shift) - 1
+
+    def percentile(self, percentile):
+        """
+        :param percentile: the percentile (0-100)
+        :return: the latency in seconds that the given percentage of the samples are at or below
+        """
+        if not self.count:
+            return 0
+
+        target = max(int(math.ceil(percentile / 100.0 * self.count)), 1)
+        seen = 0
+        for index in sorted(self._counts):
+            seen += self._counts[index]
+            if seen >= target:
+                return min(self._highest_equivalent_value(index), self._max) * self._unit
+        return self._max * self._unit
+
+    @property
+    def min(self):
+        return (self._min or 0) * self._unit
+
+    @property
+    def max(self):
+        return (self._max or 0) * self._unit
+
+    @property
+    def mean(self):
+        return self._sum * self._unit / self.count if self.count else 0
+
+    def percentile_distribution(self, percentiles=DEFAULT_PERCENTILES):
+        """
+        :return: list of (percentile, latency in seconds, the number of samples at or below it)
+        """
+        distribution = []
+        for percentile in percentiles:
+            value = self.percentile(percentile)
+            count = sum(count for index, count in self._counts.items()
+                        if min(self._highest_equivalent_value(index), self._max) * self._unit <= value)
+            distribution.append((percentile, value, count))
+        return distribution
+
+    def format_distribution(self, percentiles=DEFAULT_PERCENTILES):
+        """
+        :return: the percentile distribution as text, in milliseconds
+        """
+        lines = ['{:>12} {:>12} {:>12}'.format('percentile', 'value ms', 'total count')]
+        for percentile, value, count in self.percentile_distribution(percentiles):
+            lines.append('{:>12} {:>12.3f} {:>12}'.format(percentile, value * 1000, count))
+        lines.append('#[mean = {mean:.3f} ms, max = {max:.3f} ms, count = {count}]'.format(
+            mean=self.mean * 1000, max=self.max * 1000, count=self.count))
+        return '\n'.join(lines)
+
+    def __len__(self):
+        return self.count
@@ -0,0 +1,200 @@
+import random
+from bisect import bisect
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, DeferredSemaphore, gatherResults, inlineCallbacks, maybeDeferred
+
+from twistes.bench.histogram import LatencyHistogram
+from twistes.exceptions import NotFoundError
+
+OPERATIONS = ('search', 'get', 'index', 'bulk')
+
+
+class OperationStats(object):
+    """
+    The latency histogram and the errors of an operation
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.histogram = LatencyHistogram()
+        self.errors = {}
+
+    @property
+    def count(self):
+        return self.histogram.count
+
+    @property
+    def error_count(self):
+        return sum(self.errors.values())
+
+
+class LoadGenerator(object):
+    """
+    Drive a mix of operations against a cluster with virtual users on one reactor.
+
+    In closed loop mode (no rate) each of the users sends its next operation once the previous one completed,
+    so the load adapts to the latency. In open loop mode the operations arrive at a fixed rate whatever
+    the latency is, at most ``users`` of them are in flight and the rest wait, and each latency is measured
+    from the intended arrival time so waiting behind a slow response is accounted for.
+    Usage:
+        load = LoadGenerator(es, {'search': 0.8, 'bulk': 0.2}, users=50, duration=60, rate=2000)
+        stats = yield load.run()
+    """
+
+    def __init__(self, es, mix, users=10, duration=10, rate=None, index='bench', doc_type='doc',
+                 search_size=10, bulk_size=100, doc_size=100, id_space=100000, seed=None, clock=None):
+        """
+        :param es: the Elasticsearch client
+        :param mix: dict of operation (search, get, index or bulk) to its relative weight
+        :param users: the number of virtual users (the max number of operations in flight)
+        :param duration: the time in seconds new operations are started
+        :param rate: the arrival rate of operations per second (open loop), closed loop when not given
+        :param index: the index the operations target
+        :param doc_type: the doc type the operations target
+        :param search_size: the number of hits of each search
+        :param bulk_size: the number of documents of each bulk
+        :param doc_size: the approximate size in bytes of each indexed document
+        :param id_space: the ids of the read and written documents are drawn from range(id_space)
+        :param seed: the seed of the operation mix and ids, for reproducible runs
+        :param clock: the time provider (IReactorTime), defaults to the reactor
+        """
+        unknown = set(mix) - set(OPERATIONS)
+        if unknown:
+            raise ValueError('unknown operations: {ops}'.format(ops=', '.join(sorted(unknown))))
+
+        self._es = es
+        self._operations = sorted(operation for operation, weight in mix.items() if weight > 0)
+        self._cumulative_weights = []
+        for operation in self._operations:
+            self._cumulative_weights.append(mix[operation] + (self._cumulative_weights[-1]
+                                                              if self._cumulative_weights else 0))
+        self._users = users
+        self._duration = duration
+        self._rate = rate
+        self._index = index
+        self._doc_type = doc_type
+        self._search_size = search_size
+        self._bulk_size = bulk_size
+        self._padding = 'x' * max(doc_size - 20, 0)
+        self._id_space = id_space
+        self._random = random.Random(seed)
+        self._clock = clock or reactor
+        self.stats = dict((operation, OperationStats(operation)) for operation in self._operations)
+        self.elapsed = 0
+
+    def run(self):
+        """
+        :return: deferred that fires with the dict of operation to its :class:`OperationStats`
+            once the duration passed and the operations in flight completed
+        """
+        self._started = self._clock.seconds()
+        self._deadline = self._started + self._duration
+        d = self._open_loop() if self._rate else self._closed_loop()
+        d.addCallback(self._finish)
+        return d
+
+    def _finish(self, _):
+        self.elapsed = self._clock.seconds() - self._started
+        return self.stats
+
+    def _closed_loop(self):
+        return gatherResults([self._user() for _ in range(self._users)])
+
+    @inlineCallbacks
+    def _user(self):
+        while self._clock.seconds() < self._deadline:
+            yield self._timed(self._next_operation(), self._clock.seconds())
+
+    def _open_loop(self):
+        semaphore = DeferredSemaphore(self._users)
+        interval = 1.0 / self._rate
+        in_flight = []
+        done = Deferred()
+
+        def arrive(arrival):
+            if arrival >= self._deadline:
+                gatherResults(list(in_flight)).chainDeferred(done)
+                return
+
+            d = semaphore.run(self._timed, self._next_operation(), arrival)
+            in_flight.append(d)
+            d.addBoth(lambda result: in_flight.remove(d))
+
+            # schedule by the intended arrival times so the rate doesn't drift
+            next_arrival = arrival + interval
+            self._clock.callLater(max(next_arrival - self._clock.seconds(), 0), arrive, next_arrival)
+
+        arrive(self._started)
+        return done
+
+    def _next_operation(self):
+        if len(self._operations) == 1:
+            return self._operations[0]
+        point = self._random.random() * self._cumulative_weights[-1]
+        return self._operations[bisect(self._cumulative_weights, point)]
+
+    def _timed(self, operation, start):
+        stats = self.stats[operation]
+
+        def record(_):
+            stats.histogram.record(self._clock.seconds() - start)
+
+        def count_error(failure):
+            name = failure.type.__name__
+            stats.errors[name] = stats.errors.get(name, 0) + 1
+
+        d = maybeDeferred(getattr(self, operation))
+        d.addCallbacks(record, count_error)
+        return d
+
+    def _doc_id(self):
+        return str(self._random.randrange(self._id_space))
+
+    def _document(self):
+        return {'value': self._random.random(), 'payload': self._padding}
+
+    def search(self):
+        return self._es.search(self._index, self._doc_type, body={'query': {'match_all': {}},
+                                                                   'size': self._search_size})
+
+    def get(self):
+        d = self._es.get(self._index, self._doc_id(), doc_type=self._doc_type)
+        # a missing document is a valid answer of the cluster
+        d.addErrback(lambda failure: failure.trap(NotFoundError))
+        return d
+
+    def index(self):
+        return self._es.index(self._index, self._doc_type, self._document(), id=self._doc_id())
+
+    def bulk(self):
+        actions = [{'_index': self._index, '_type': self._doc_type, '_id': self._doc_id(),
+                    '_source': self._document()} for _ in range(self._bulk_size)]
+        return self._es.bulk_utils.bulk(actions, stats_only=True, raise_on_error=False)
+
+
+def format_report(stats, elapsed, distribution=False):
+    """
+    :param stats: dict of operation to its :class:`OperationStats`
+    :param elapsed: the run time in seconds
+    :param distribution: add the percentile distribution of all the operations
+    :return: the report of the run as text
+    """
+    lines = ['{:<8} {:>10} {:>10} {:>8} {:>10} {:>10} {:>10} {:>10} {:>10}'.format(
+        'op', 'count', 'ops/s', 'errors', 'p50 ms', 'p90 ms', 'p99 ms', 'p99.9 ms', 'max ms')]
+    total = LatencyHistogram()
+    for name in sorted(stats):
+        op_stats = stats[name]
+        histogram = op_stats.histogram
+        total.merge(histogram)
+        lines.append('{:<8} {:>10} {:>10.1f} {:>8} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f}'.format(
+            name, histogram.count, histogram.count / elapsed if elapsed else 0, op_stats.error_count,
+            histogram.percentile(50) * 1000, histogram.percentile(90) * 1000, histogram.percentile(99) * 1000,
+            histogram.percentile(99.9) * 1000, histogram.max * 1000))
+        for error, count in sorted(op_stats.errors.items()):
+            lines.append('    {error}: {count}'.format(error=error, count=count))
+
+    if distribution:
+        lines.append('')
+        lines.append(total.format_distribution())
+    return '\n'.join(lines)
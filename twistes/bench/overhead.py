@@ -0,0 +1,90 @@
+"""
+Microbenchmark of the client's per call overhead, without any network.
+
+The http client is replaced by one that answers synchronously, so the measured time is
+only the client's own work (url building, deferred chaining, response checking) per call.
+It's compared to a reference of the same path built with nested inlineCallbacks generators.
+
+Run with: python -m twistes.bench.overhead --calls 100000
+"""
+import argparse
+import sys
+import timeit
+
+from twisted.internet.defer import inlineCallbacks, returnValue, succeed
+
+from twistes.client import Elasticsearch
+from twistes.consts import HttpMethod, ResponseCodes
+
+SOME_DOC = {'_index': 'bench', '_type': 'doc', '_id': '1', 'found': True, '_source': {'value': 1}}
+
+
+class SyncResponse(object):
+    code = ResponseCodes.OK
+
+    def json(self):
+        return succeed(SOME_DOC)
+
+
+class SyncHttpClient(object):
+    """
+    Http client that answers every request right away
+    """
+    response = SyncResponse()
+
+    def request(self, method, url, **kwargs):
+        return succeed(self.response)
+
+
+class InlineCallbacksReference(object):
+    """
+    The request path as three nested inlineCallbacks generators (api method, request, content)
+    """
+
+    def __init__(self, es):
+        self._es = es
+
+    @inlineCallbacks
+    def get(self, index, id, doc_type):
+        path = self._es._es_parser.make_path(index, doc_type, id)
+        result = yield self._perform_request(HttpMethod.GET, path)
+        returnValue(result)
+
+    @inlineCallbacks
+    def _perform_request(self, method, path, params=None):
+        url = self._es._es_parser.prepare_url(self._es._hostname, path, params)
+        response = yield self._es._async_http_client.request(method, url, data=None, timeout=self._es._timeout,
+                                                             auth=self._es._auth)
+        content = yield self._get_content(response)
+        if response.code == ResponseCodes.OK:
+            returnValue(content)
+
+    @inlineCallbacks
+    def _get_content(self, response):
+        content = yield response.json()
+        returnValue(content)
+
+
+def per_call_overhead(get, calls):
+    """
+    :return: the time in microseconds of a call
+    """
+    return timeit.timeit(lambda: get('bench', '1', doc_type='doc'), number=calls) / calls * 1e6
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Measure the per call overhead of the client')
+    parser.add_argument('--calls', type=int, default=100000)
+    args = parser.parse_args(argv)
+
+    es = Elasticsearch([{'host': 'localhost', 'port': 9200}], async_http_client=SyncHttpClient())
+    chained = per_call_overhead(es.get, args.calls)
+    reference = per_call_overhead(InlineCallbacksReference(es).get, args.calls)
+
+    print('client get:              {:8.2f} us/call'.format(chained))
+    print('inlineCallbacks path:    {:8.2f} us/call'.format(reference))
+    print('overhead reduction:      {:8.1f} %'.format((1 - chained / reference) * 100))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,246 @@
+"""
+End to end benchmarks of the client against the in process fake elasticsearch server.
+
+Run with: python -m twistes.bench.suite --requests 2000 --concurrency 20 --latency 0.001
+"""
+import argparse
+import sys
+import time
+
+from twisted.internet import task
+from twisted.internet.defer import inlineCallbacks, returnValue, DeferredSemaphore, gatherResults, maybeDeferred
+
+from twistes.bench.fake_server import start_fake_server, hosts_of, FakeElasticsearch, Fault
+from twistes.client import Elasticsearch
+
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
+WORKLOADS = ('search', 'get', 'bulk', 'scan')
+
+
+def peak_rss():
+    """
+    :return: the peak resident set size of the process in bytes, None if it can't be measured
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kilobytes, mac bytes
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def percentile(sorted_values, pct):
+    """
+    :param sorted_values: the sorted samples
+    :param pct: the percentile (0-100)
+    :return: the nearest rank percentile of the samples
+    """
+    if not sorted_values:
+        return 0
+    rank = int(round(pct / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[rank]
+
+
+class BenchmarkResult(object):
+    """
+    The measurements of a workload run
+    """
+
+    def __init__(self, name, requests, docs, bytes, elapsed, latencies, rss=None, errors=None):
+        self.name = name
+        self.requests = requests
+        self.docs = docs
+        self.errors = errors or {}
+        self.bytes = bytes
+        self.elapsed = elapsed
+        self.latencies = sorted(latencies)
+        self.peak_rss = rss
+
+    @property
+    def requests_per_sec(self):
+        return self.requests / self.elapsed if self.elapsed else 0
+
+    @property
+    def docs_per_sec(self):
+        return self.docs / self.elapsed if self.elapsed else 0
+
+    @property
+    def bytes_per_sec(self):
+        return self.bytes / self.elapsed if self.elapsed else 0
+
+    @property
+    def p50(self):
+        return percentile(self.latencies, 50)
+
+    @property
+    def p99(self):
+        return percentile(self.latencies, 99)
+
+    def as_dict(self):
+        return {'name': self.name, 'requests': self.requests, 'docs': self.docs, 'bytes': self.bytes,
+                'elapsed': self.elapsed, 'requests_per_sec': self.requests_per_sec,
+                'docs_per_sec': self.docs_per_sec, 'bytes_per_sec': self.bytes_per_sec,
+                'p50': self.p50, 'p99': self.p99, 'peak_rss': self.peak_rss, 'errors': self.errors}
+
+    HEADER = '{:<8} {:>12} {:>12} {:>14} {:>10} {:>10} {:>12} {:>8}'.format(
+        'workload', 'requests/s', 'docs/s', 'bytes/s', 'p50 ms', 'p99 ms', 'peak rss MB', 'errors')
+
+    def __str__(self):
+        rss = '{:.1f}'.format(self.peak_rss / 1024.0 / 1024) if self.peak_rss else '-'
+        line = '{:<8} {:>12.1f} {:>12.1f} {:>14.1f} {:>10.3f} {:>10.3f} {:>12} {:>8}'.format(
+            self.name, self.requests_per_sec, self.docs_per_sec, self.bytes_per_sec,
+            self.p50 * 1000, self.p99 * 1000, rss, sum(self.errors.values()))
+        if self.errors:
+            line += '  ' + ', '.join('{error}: {count}'.format(error=error, count=count)
+                                     for error, count in sorted(self.errors.items()))
+        return line
+
+
+class BenchmarkSuite(object):
+    """
+    Run the client workloads against a fake server and measure them.
+
+    Each workload runs ``requests`` operations with at most ``concurrency`` of them in flight.
+    The bytes are the request and response bodies the server handled during the run.
+    """
+
+    def __init__(self, es, server, requests=1000, concurrency=10, docs_per_request=100):
+        """
+        :param es: the Elasticsearch client, connected to the server
+        :param server: the :class:`~twistes.bench.fake_server.FakeElasticsearch` resource
+        :param requests: the number of operations of each workload
+        :param concurrency: the max number of operations in flight
+        :param docs_per_request: the number of documents of each search, bulk and scroll page
+        """
+        self.es = es
+        self.server = server
+        self.requests = requests
+        self.concurrency = concurrency
+        self.docs_per_request = docs_per_request
+
+    @inlineCallbacks
+    def run(self, workloads=WORKLOADS):
+        """
+        :return: list of the :class:`BenchmarkResult` of the workloads
+        """
+        results = []
+        for name in workloads:
+            result = yield self.run_workload(name, getattr(self, name))
+            results.append(result)
+        returnValue(results)
+
+    @inlineCallbacks
+    def run_workload(self, name, operation):
+        """
+        :param operation: callable that gets the operation number and returns a deferred
+            that fires with the number of documents it handled
+        """
+        semaphore = DeferredSemaphore(self.concurrency)
+        latencies = []
+        docs = []
+        errors = {}
+        requests_before, bytes_before = self.server.stats.requests, self.server.stats.bytes
+
+        def count_error(failure):
+            # the failed operations are counted by error type, so injected faults don't stop the run
+            name = failure.type.__name__
+            errors[name] = errors.get(name, 0) + 1
+
+        def timed(i):
+            start = time.time()
+            d = maybeDeferred(operation, i)
+            d.addCallbacks(lambda count: (latencies.append(time.time() - start), docs.append(count)),
+                           count_error)
+            return d
+
+        start = time.time()
+        yield gatherResults([semaphore.run(timed, i) for i in range(self.requests)], consumeErrors=True)
+        elapsed = time.time() - start
+
+        returnValue(BenchmarkResult(name, self.server.stats.requests - requests_before, sum(docs),
+                                    self.server.stats.bytes - bytes_before, elapsed, latencies, peak_rss(),
+                                    errors))
+
+    def search(self, i):
+        d = self.es.search(FakeElasticsearch.INDEX, body={'size': self.docs_per_request})
+        d.addCallback(lambda result: len(result['hits']['hits']))
+        return d
+
+    def get(self, i):
+        d = self.es.get(FakeElasticsearch.INDEX, str(i), doc_type=FakeElasticsearch.DOC_TYPE)
+        d.addCallback(lambda result: 1)
+        return d
+
+    def bulk(self, i):
+        actions = ({'_index': FakeElasticsearch.INDEX, '_type': FakeElasticsearch.DOC_TYPE,
+                    '_id': '{i}-{j}'.format(i=i, j=j), '_source': {'value': j}}
+                   for j in range(self.docs_per_request))
+        d = self.es.bulk_utils.bulk(actions, stats_only=True, raise_on_error=False)
+        d.addCallback(lambda stats: sum(stats))
+        return d
+
+    @inlineCallbacks
+    def scan(self, i):
+        scroller = yield self.es.scan(FakeElasticsearch.INDEX, FakeElasticsearch.DOC_TYPE,
+                                      size=self.docs_per_request)
+        count = 0
+        for page in scroller:
+            hits = yield page
+            count += len(hits)
+        returnValue(count)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Benchmark the twistes client against a local fake server')
+    parser.add_argument('--requests', type=int, default=1000, help='operations per workload')
+    parser.add_argument('--concurrency', type=int, default=10, help='max operations in flight')
+    parser.add_argument('--docs', type=int, default=100, help='documents per search, bulk and scroll page')
+    parser.add_argument('--doc-size', type=int, default=100, help='size in bytes of each document')
+    parser.add_argument('--total-hits', type=int, default=1000, help='documents matched by each scan')
+    parser.add_argument('--latency', type=float, default=0, help='server latency in seconds')
+    parser.add_argument('--rejection-rate', type=float, default=0, help='fraction of rejected bulk items')
+    parser.add_argument('--fault', action='append', default=[], metavar='FAULT=RATE', type=parse_fault,
+                        help='inject a fault to a fraction of the requests, one of: {faults}'.format(
+                            faults=', '.join(sorted(Fault.ENDPOINTS))))
+    parser.add_argument('--slow-latency', type=float, default=1.0, help='latency in seconds of the slow fault')
+    parser.add_argument('--timeout', type=float, default=10, help='client request timeout in seconds')
+    parser.add_argument('--retry-on-timeout', action='store_true', help='retry requests that got no response')
+    parser.add_argument('--workloads', nargs='+', choices=WORKLOADS, default=list(WORKLOADS))
+    return parser.parse_args(argv)
+
+
+def parse_fault(value):
+    fault, _, rate = value.partition('=')
+    if fault not in Fault.ENDPOINTS:
+        raise argparse.ArgumentTypeError('unknown fault {fault}'.format(fault=fault))
+    return fault, float(rate or 1)
+
+
+@inlineCallbacks
+def main(reactor, *argv):
+    args = parse_args(argv)
+    listening_port, server = start_fake_server(latency=args.latency, doc_size=args.doc_size,
+                                               total_hits=args.total_hits, rejection_rate=args.rejection_rate,
+                                               fault_rates=dict(args.fault), slow_latency=args.slow_latency, seed=0)
+    es = Elasticsearch(hosts_of(listening_port), timeout=args.timeout, retry_on_timeout=args.retry_on_timeout,
+                       async_http_client_params={'maxPersistentPerHost': args.concurrency})
+    try:
+        suite = BenchmarkSuite(es, server, args.requests, args.concurrency, args.docs)
+        results = yield suite.run(args.workloads)
+    finally:
+        yield es.close()
+        yield listening_port.stopListening()
+
+    print(BenchmarkResult.HEADER)
+    for result in results:
+        print(result)
+    if server.stats.faults:
+        print('injected faults: ' + ', '.join('{fault}: {count}'.format(fault=fault, count=count)
+                                              for fault, count in sorted(server.stats.faults.items())))
+
+
+if __name__ == '__main__':
+    task.react(main, sys.argv[1:])
@@ -0,0 +1,144 @@
+import json
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, DeferredSemaphore, DeferredList, succeed
+
+from twistes.bulk_utils import BulkUtility, ActionParser, SpilledBulkResults
+from twistes.compatability import string_types
+from twistes.exceptions import BulkIndexError, ElasticsearchException
+
+
+class BulkIndexer(object):
+    """
+    Long lived indexer that batches single actions into bulk requests.
+
+    Callers add one action at a time and get a deferred of its own result, while the actions are
+    sent in chunks once the chunk is full (by count or bytes) or the flush interval passes.
+    Usage:
+        indexer = BulkIndexer(es, chunk_size=1000, flush_interval=0.5)
+        result = yield indexer.add({'_index': 'events', '_type': 'event', '_source': event})
+        ...
+        yield indexer.close()
+    """
+
+    def __init__(self, es, chunk_size=500, max_chunk_bytes=10 * 1024 * 1024, flush_interval=1.0,
+                 max_concurrent_flushes=2, expand_action_callback=ActionParser.expand_action,
+                 bulk_utils=None, clock=None, **bulk_params):
+        """
+        :param es: the Elasticsearch client
+        :param chunk_size: the max number of actions in one bulk
+        :param max_chunk_bytes: the max size in bytes of one bulk
+        :param flush_interval: the max time in seconds an action waits before its chunk is sent
+        :param max_concurrent_flushes: the max number of bulks in flight, the next chunks wait for them
+        :param expand_action_callback: callback that gets an action and returns the action and data lines
+            (see :meth:`~twistes.bulk_utils.ActionParser.expand_action`)
+        :param bulk_utils: the :class:`~twistes.bulk_utils.BulkUtility` that sends the chunks,
+            defaults to the client's one
+        :param clock: the time provider (IReactorTime), defaults to the reactor
+        :param bulk_params: query params for the :meth:`~twistes.client.Elasticsearch.bulk` requests
+        """
+        self._bulk_utils = bulk_utils or getattr(es, 'bulk_utils', None) or BulkUtility(es)
+        self._chunk_size = chunk_size
+        self._max_chunk_bytes = max_chunk_bytes
+        self._flush_interval = flush_interval
+        self._expand_action = expand_action_callback
+        self._bulk_params = bulk_params
+        self._clock = clock or reactor
+        self._flush_semaphore = DeferredSemaphore(max_concurrent_flushes)
+        self._in_flight = set()
+        self._delayed_flush = None
+        self._reset_chunk()
+
+    def _reset_chunk(self):
+        self._lines = []
+        self._deferreds = []
+        self._size = 0
+
+    def add(self, action):
+        """
+        Queue an action.
+        :param action: the action, in the format accepted by :meth:`~twistes.bulk_utils.BulkUtility.bulk`
+        :return: deferred that fires with the bulk item of the action ({op_type: item}),
+            or fails with a BulkIndexError if the action failed. When its chunk was spilled (see
+            :class:`~twistes.spill_queue.SpillQueue`) it fails with a BulkIndexError of an item marked as
+            ``spilled``, the action itself is sent later by the replay
+        """
+        action, data = self._expand_action(action)
+        lines = [action if isinstance(action, string_types) else json.dumps(action)]
+        if data is not None:
+            lines.append(data if isinstance(data, string_types) else json.dumps(data))
+        size = sum(len(line) + 1 for line in lines)
+
+        if self._deferreds and self._size + size > self._max_chunk_bytes:
+            self.flush()
+
+        d = Deferred()
+        self._lines.extend(lines)
+        self._deferreds.append(d)
+        self._size += size
+
+        if len(self._deferreds) >= self._chunk_size or self._size >= self._max_chunk_bytes:
+            self.flush()
+        elif self._delayed_flush is None:
+            self._delayed_flush = self._clock.callLater(self._flush_interval, self.flush)
+
+        return d
+
+    def flush(self):
+        """
+        Send the queued actions now.
+        :return: deferred that fires once the chunk was sent and its actions were resolved
+        """
+        if self._delayed_flush is not None:
+            if self._delayed_flush.active():
+                self._delayed_flush.cancel()
+            self._delayed_flush = None
+
+        lines, deferreds = self._lines, self._deferreds
+        self._reset_chunk()
+        if not deferreds:
+            return succeed(None)
+
+        d = self._flush_semaphore.run(self._bulk_utils._process_bulk_chunk, lines, raise_on_error=False,
+                                      **self._bulk_params)
+        d.addCallbacks(self._resolve, self._fail, callbackArgs=(deferreds,), errbackArgs=(deferreds,))
+        self._in_flight.add(d)
+        d.addBoth(self._done, d)
+        return d
+
+    def close(self):
+        """
+        Flush the queued actions and wait for all the bulks in flight.
+        """
+        self.flush()
+        return DeferredList(list(self._in_flight))
+
+    @staticmethod
+    def _resolve(results, deferreds):
+        if isinstance(results, SpilledBulkResults):
+            # the replay results can't be routed back to the callers
+            results = [(False, item) for item in results.failed_items()]
+
+        for (ok, item), d in zip(results, deferreds):
+            if ok:
+                d.callback(item)
+            else:
+                d.errback(BulkIndexError('1 document(s) failed to index.', [item]))
+
+        if len(results) < len(deferreds):
+            msg_fmt = "bulk returned {results} results for {actions} actions"
+            error = ElasticsearchException(msg_fmt.format(results=len(results), actions=len(deferreds)))
+            for d in deferreds[len(results):]:
+                d.errback(error)
+
+    @staticmethod
+    def _fail(failure, deferreds):
+        for d in deferreds:
+            d.errback(failure)
+
+    def _done(self, result, d):
+        self._in_flight.discard(d)
+        return result
+
+    def __len__(self):
+        return len(self._deferreds)
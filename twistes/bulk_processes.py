@@ -0,0 +1,350 @@
+"""
+Bulk ingestion across worker processes, each with its own reactor and :class:`~twistes.client.Elasticsearch` client,
+see :class:`BulkProcessPool`. Run as ``python -m twistes.bulk_processes`` this module is the worker.
+"""
+import os
+import pickle
+import struct
+import sys
+import zlib
+from multiprocessing import cpu_count
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, DeferredList, inlineCallbacks, returnValue, succeed
+from twisted.internet.protocol import ProcessProtocol, Protocol
+
+from twistes.consts import EsDocProperties
+from twistes.exceptions import ElasticsearchException, BulkIndexError
+
+# each message is a pickle prefixed by its length
+FRAME_HEADER = struct.Struct('>I')
+
+
+class BulkWorkerError(ElasticsearchException):
+    """
+    Raised when a bulk worker process failed (it died, or raised an exception that can't be sent back)
+    """
+
+
+class _Messages(object):
+    CONFIG = 'config'
+    BULK = 'bulk'
+    DONE = 'done'
+    ERROR = 'error'
+
+
+def _frame(message):
+    data = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+    return FRAME_HEADER.pack(len(data)) + data
+
+
+class _FrameReader(object):
+    """
+    Split a byte stream into the messages written by :func:`_frame`
+    """
+
+    def __init__(self, message_received):
+        self._message_received = message_received
+        # the received data is joined only once a whole frame arrived
+        self._chunks = []
+        self._buffered = 0
+        self._needed = FRAME_HEADER.size
+
+    def feed(self, data):
+        self._chunks.append(data)
+        self._buffered += len(data)
+        if self._buffered < self._needed:
+            return
+
+        buffer = b''.join(self._chunks)
+        offset = 0
+        while len(buffer) - offset >= FRAME_HEADER.size:
+            length = FRAME_HEADER.unpack_from(buffer, offset)[0]
+            end = offset + FRAME_HEADER.size + length
+            if len(buffer) < end:
+                break
+            self._message_received(pickle.loads(buffer[offset + FRAME_HEADER.size:end]))
+            offset = end
+
+        rest = buffer[offset:]
+        self._chunks = [rest] if rest else []
+        self._buffered = len(rest)
+        self._needed = FRAME_HEADER.size
+        if len(rest) >= FRAME_HEADER.size:
+            self._needed += FRAME_HEADER.unpack_from(rest)[0]
+
+
+class _WorkerProcess(ProcessProtocol):
+    """
+    The parent side of a worker process, the batches sent to it complete in order
+    """
+
+    def __init__(self):
+        self._reader = _FrameReader(self._message_received)
+        self._pending = {}
+        self._stderr = []
+        self.ended = Deferred()
+
+    def send(self, message):
+        self.transport.write(_frame(message))
+
+    def run_batch(self, batch_id, actions, params, utility_params):
+        d = self._pending[batch_id] = Deferred()
+        self.send((_Messages.BULK, batch_id, actions, params, utility_params))
+        return d
+
+    @property
+    def in_flight(self):
+        return len(self._pending)
+
+    def outReceived(self, data):
+        self._reader.feed(data)
+
+    def errReceived(self, data):
+        # keep the tail of the worker output for the error of a dead worker
+        self._stderr = (self._stderr + [data])[-20:]
+
+    def _message_received(self, message):
+        kind, batch_id, result = message
+        d = self._pending.pop(batch_id)
+        if kind == _Messages.DONE:
+            d.callback(result)
+        else:
+            d.errback(result)
+
+    def processEnded(self, reason):
+        pending, self._pending = self._pending, {}
+        for d in pending.values():
+            d.errback(BulkWorkerError('bulk worker ended: {output}'.format(
+                output=b''.join(self._stderr).decode('utf-8', 'replace') or reason.getErrorMessage())))
+        self.ended.callback(None)
+
+
+class BulkProcessPool(object):
+    """
+    Bulk ingestion that scales with cores: the actions are sharded across worker processes by their id,
+    and each worker expands, serializes and sends them with its own reactor and client.
+    The actions of the same document id always go to the same worker and are sent in order,
+    the actions without an id are spread round robin.
+    Usage:
+        pool = BulkProcessPool(hosts, processes=4, timeout=30)
+        pool.start()
+        success, errors = yield pool.bulk(actions)
+        yield pool.close()
+    The actions, the expand action callback and the results are pickled between the processes, so the
+    callback should be a module level function.
+    """
+
+    def __init__(self, hosts, processes=None, max_batches_in_flight=2, **client_params):
+        """
+        :param hosts: the hosts of the :class:`~twistes.client.Elasticsearch` client of each worker
+        :param processes: the number of worker processes, defaults to the number of cores
+        :param max_batches_in_flight: the max number of batches sent to a worker and not completed yet,
+            reading the actions waits for the workers beyond it
+        :param client_params: other params of the workers clients (must be picklable)
+        """
+        self._hosts = hosts
+        self._processes = processes or cpu_count()
+        self._max_batches_in_flight = max_batches_in_flight
+        self._client_params = client_params
+        self._workers = []
+        self._batch_ids = 0
+        self._round_robin = 0
+
+    def start(self):
+        """
+        Spawn the worker processes
+        """
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(sys.path)
+        for _ in range(self._processes):
+            worker = _WorkerProcess()
+            reactor.spawnProcess(worker, sys.executable, [sys.executable, '-m', __name__], env=env)
+            worker.send((_Messages.CONFIG, self._hosts, self._client_params))
+            self._workers.append(worker)
+
+    def close(self):
+        """
+        Stop the workers once they completed the batches sent to them.
+        :return: deferred that fires once all the workers ended
+        """
+        workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.transport.closeStdin()
+        return DeferredList([worker.ended for worker in workers])
+
+    def _shard(self, action):
+        doc_id = action.get(EsDocProperties.ID) if isinstance(action, dict) else None
+        if doc_id is None:
+            self._round_robin = (self._round_robin + 1) % len(self._workers)
+            return self._round_robin
+        return zlib.crc32(str(doc_id).encode('utf-8')) % len(self._workers)
+
+    @inlineCallbacks
+    def bulk(self, actions, stats_only=False, verbose=False, batch_size=500, raise_on_error=True,
+             offload_threshold=None, minimal_responses=None, **kwargs):
+        """
+        Send the actions through the workers, with the same results as :meth:`~twistes.bulk_utils.BulkUtility.bulk`.
+        :param actions: iterator of the actions
+        :param stats_only: only return the number of successful and failed actions
+        :param verbose: return the (ok, item) result of every action
+        :param batch_size: the number of actions sent to a worker at once, the worker sends them
+            in chunks (by ``chunk_size`` and ``max_chunk_bytes``)
+        :param raise_on_error: raise a ``BulkIndexError`` with the failed items, the first batch with a failed
+            item stops sending the rest, and the error is raised once the batches in flight ended
+        :param offload_threshold: overrides the ``offload_threshold`` of the workers bulk utility
+            (see :class:`~twistes.bulk_utils.BulkUtility`), None to keep the one of their client
+        :param minimal_responses: overrides the ``minimal_responses`` of the workers bulk utility,
+            None to keep the one of their client
+        :param kwargs: the other params of :meth:`~twistes.bulk_utils.BulkUtility.bulk` (e.g. ``chunk_size``,
+            ``raise_on_exception``, ``expand_action_callback``) and the bulk query params
+        """
+        if not self._workers:
+            raise BulkWorkerError('the bulk process pool is not started')
+
+        # the workers send back only what the results are built from: the counts, and the failed items
+        # unless they aren't needed, every item result only when verbose
+        counts_only = stats_only and not verbose and not raise_on_error
+        if verbose:
+            params = dict(kwargs, verbose=True, raise_on_error=False)
+        else:
+            params = dict(kwargs, stats_only=counts_only, raise_on_error=False)
+        utility_params = dict((name, value) for name, value in (('offload_threshold', offload_threshold),
+                                                                  ('minimal_responses', minimal_responses))
+                              if value is not None)
+        stats = [0, 0]
+        results = []
+        errors = []
+        failures = []
+
+        def collect(result):
+            if counts_only:
+                stats[0] += result[0]
+                stats[1] += result[1]
+                return
+
+            if verbose:
+                results.extend(result)
+                batch_errors = [item for ok, item in result if not ok]
+            else:
+                success, batch_errors = result
+                stats[0] += success
+            stats[1] += len(batch_errors)
+            errors.extend(batch_errors)
+
+        def stopped():
+            # like the local bulk, the first failed item stops the bulk when it's raised
+            return failures or (raise_on_error and errors)
+
+        in_flight = []
+
+        def run_batch(worker_index, batch):
+            self._batch_ids += 1
+            d = self._workers[worker_index].run_batch(self._batch_ids, batch, params, utility_params)
+            d.addCallbacks(collect, failures.append)
+            in_flight.append(d)
+            d.addBoth(lambda _: in_flight.remove(d))
+
+        batches = [[] for _ in self._workers]
+        for action in actions:
+            if stopped():
+                break
+
+            index = self._shard(action)
+            batches[index].append(action)
+            if len(batches[index]) < batch_size:
+                continue
+
+            worker = self._workers[index]
+            while worker.in_flight >= self._max_batches_in_flight and not stopped():
+                yield DeferredList(list(in_flight), fireOnOneCallback=True, fireOnOneErrback=True,
+                                   consumeErrors=True)
+            if stopped():
+                break
+            run_batch(index, batches[index])
+            batches[index] = []
+
+        if not stopped():
+            for index, batch in enumerate(batches):
+                if batch:
+                    run_batch(index, batch)
+
+        yield DeferredList(list(in_flight))
+        if failures:
+            failures[0].raiseException()
+
+        if errors and raise_on_error:
+            raise BulkIndexError('{num} document(s) failed to index.'.format(num=len(errors)), errors)
+
+        if verbose:
+            returnValue(results)
+        if stats_only:
+            returnValue(tuple(stats))
+        returnValue((stats[0], errors))
+
+
+class _Worker(Protocol):
+    """
+    The worker side: it creates the client on the config message and runs the bulk batches one after the other
+    """
+
+    def __init__(self):
+        self._reader = _FrameReader(self._message_received)
+        self._es = None
+        self._last = succeed(None)
+        self.done = Deferred()
+
+    def dataReceived(self, data):
+        self._reader.feed(data)
+
+    def _message_received(self, message):
+        if message[0] == _Messages.CONFIG:
+            from twistes.client import Elasticsearch
+
+            _, hosts, client_params = message
+            self._es = Elasticsearch(hosts, **client_params)
+            return
+
+        _, batch_id, actions, params, utility_params = message
+        # the batches run in order, so the actions of a document are sent in order
+        self._last.addCallback(lambda _: self._bulk_utils(utility_params).bulk(actions, **params))
+        self._last.addCallbacks(self._reply, self._reply_error, callbackArgs=(batch_id,), errbackArgs=(batch_id,))
+
+    def _bulk_utils(self, utility_params):
+        if not utility_params:
+            return self._es.bulk_utils
+
+        from twistes.bulk_utils import BulkUtility
+
+        bulk_utils = self._es.bulk_utils
+        params = dict(offload_threshold=bulk_utils.offload_threshold, minimal_responses=bulk_utils.minimal_responses)
+        params.update(utility_params)
+        return BulkUtility(self._es, **params)
+
+    def _reply(self, result, batch_id):
+        self.transport.write(_frame((_Messages.DONE, batch_id, result)))
+
+    def _reply_error(self, failure, batch_id):
+        try:
+            message = _frame((_Messages.ERROR, batch_id, failure.value))
+        except Exception:
+            message = _frame((_Messages.ERROR, batch_id, BulkWorkerError(failure.getErrorMessage())))
+        self.transport.write(message)
+
+    def connectionLost(self, reason):
+        self._last.addCallback(lambda _: self._es.close() if self._es is not None else None)
+        self._last.addBoth(lambda _: self.done.callback(None))
+
+
+def main(reactor):
+    from twisted.internet.stdio import StandardIO
+
+    worker = _Worker()
+    StandardIO(worker)
+    return worker.done
+
+
+if __name__ == '__main__':
+    from twisted.internet import task
+
+    task.react(main)
@@ -1,10 +1,19 @@
 import json
 from operator import methodcaller
 
-from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, inlineCallbacks, returnValue, succeed
+from twisted.internet.error import ConnectError, ConnectionLost
+from twisted.internet.threads import deferToThread
+from twisted.web.client import ResponseFailed
 from twistes.compatability import string_types
-from twistes.consts import EsBulk, EsDocProperties
-from twistes.exceptions import BulkIndexError, ConnectionTimeout
+from twistes.consts import EsBulk, EsConst, EsClientParams, EsDocProperties, MonitoredSections, NULL_VALUES
+from twistes.exceptions import BulkIndexError, ConnectionError, ElasticsearchException, ImproperlyConfigured
+from twistes.lag_monitor import section, timed_iteration
+from twistes.parser import EsParser
+
+# the errors of a bulk request that didn't get through to the cluster, the chunk can be sent again later
+CONNECTION_ERRORS = (ConnectionError, ConnectError, ConnectionLost, ResponseFailed)
 
 
 class ActionParser(object):
@@ -47,13 +56,130 @@ class ActionParser(object):
         return action
 
 
+class BulkChunk(list):
+    """
+    The serialized lines of a bulk chunk, with the ``_index`` of its actions (None for the actions without one)
+    """
+    __slots__ = ('indices',)
+
+    def __init__(self, lines=()):
+        super(BulkChunk, self).__init__(lines)
+        self.indices = set()
+
+
+class SuccessfulBulkResults(object):
+    """
+    The results of a bulk chunk without errors: a read only sequence of the (True, {op_type: item}) results
+    of its items, the tuples are created only when they are read and its length is known without reading them.
+    """
+    __slots__ = ('_items',)
+
+    def __init__(self, items):
+        """
+        :param items: the items of the bulk response
+        """
+        self._items = items
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return ((True, item) for item in self._items)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [(True, item) for item in self._items[index]]
+        return True, self._items[index]
+
+    def __eq__(self, other):
+        try:
+            other = list(other)
+        except TypeError:
+            return NotImplemented
+        return list(self) == other
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    # compared by value like the list it stands for, so not hashable
+    __hash__ = None
+
+    def __repr__(self):
+        return 'SuccessfulBulkResults({count} items)'.format(count=len(self))
+
+
+class SpilledBulkResults(list):
+    """
+    The (empty) results of a chunk that was spilled to the spill queue instead of being sent,
+    its actions are sent later by the replay.
+    """
+    __slots__ = ('bulk_actions', 'error')
+
+    def __init__(self, bulk_actions, error=None):
+        """
+        :param bulk_actions: the serialized lines of the chunk
+        :param error: the connection error the chunk failed with, None if it was spilled behind pending chunks
+        """
+        super(SpilledBulkResults, self).__init__()
+        self.bulk_actions = bulk_actions
+        self.error = error
+
+    def failed_items(self):
+        """
+        :return: a failed item ({op_type: item}) per action of the chunk, with the reason it was spilled,
+            for the callers that have to resolve each action now
+        """
+        error = self.error or ElasticsearchException('spilled behind the pending chunks of the spill queue')
+        items = BulkUtility._handle_transport_error(self.bulk_actions, error, raise_on_error=False)
+        for item in items:
+            next(iter(item.values()))[EsBulk.SPILLED] = True
+        return items
+
+
 class BulkUtility(object):
 
-    def __init__(self, es):
+    def __init__(self, es, spill_queue=None, offload_threshold=None, process_pool=None, minimal_responses=False,
+                 replay_interval=5, replay_failure_callback=None, clock=None):
+        """
+        :param es: the Elasticsearch client
+        :param spill_queue: optional :class:`~twistes.spill_queue.SpillQueue`, when given the chunks
+            that fail with a connection error are spilled to it instead of failing, and replayed in order
+            by :meth:`replay_spilled`. While the queue isn't empty the new chunks are spilled behind the
+            pending ones right away. The spilled actions are not included in the bulk results,
+            ``spilled`` counts the spilled chunks.
+        :param offload_threshold: the number of actions from which :meth:`bulk` serializes the chunks in the
+            reactor thread pool instead of the reactor thread, None to always serialize them in the reactor thread
+        :param process_pool: optional started :class:`~twistes.bulk_processes.BulkProcessPool`, when given
+            :meth:`bulk` (without a result callback) sends the actions through its worker processes, with the
+            ``offload_threshold`` and ``minimal_responses`` of this utility. It can't be used with a spill queue
+        :param minimal_responses: request only the status and error of each item (with ``filter_path``),
+            instead of the full items. The failed items get their action metadata (``_index``, ``_type``, ``_id``...)
+            from the sent actions, the successful ones have only their status
+        :param replay_interval: the time in seconds between the replays of the spilled chunks
+        :param replay_failure_callback: callable called with the list of the failed items of each replayed chunk
+        :param clock: the time provider (IReactorTime) of the replays, defaults to the reactor
+        """
+        if spill_queue is not None and process_pool is not None:
+            raise ImproperlyConfigured("a spill queue can't be used with a process pool, the workers send the chunks")
+
         self.client = es
+        self.spill_queue = spill_queue
+        self.offload_threshold = offload_threshold
+        self.process_pool = process_pool
+        self.minimal_responses = minimal_responses
+        self.replay_interval = replay_interval
+        self.replay_failure_callback = replay_failure_callback
+        self.spilled = 0
+        self._clock = clock or reactor
+        self._replaying = False
+        self._delayed_replay = None
+        if spill_queue:
+            # chunks that were spilled before a restart
+            self._schedule_replay()
 
     @inlineCallbacks
-    def bulk(self, actions, stats_only=False, verbose=False, **kwargs):
+    def bulk(self, actions, stats_only=False, verbose=False, result_callback=None, **kwargs):
         """
         Helper for the :meth:`~elasticsearch.Elasticsearch.bulk` api that provides
         a more human friendly interface - it consumes an iterator of actions and
@@ -67,30 +193,121 @@ class BulkUtility(object):
             operations instead of just number of successful and a list of error responses
         Any additional keyword arguments will be passed to
         :arg verbose: return verbose data: (inserted, errors)
+        :arg result_callback: callable called with (action, ok, item) for each action as its chunk completes,
+            when given the actions are consumed lazily, the item results are not kept and only the
+            number of successful/failed operations is returned, so memory doesn't grow with the input.
+            The failed items are reported to the callback instead of raising (unless `raise_on_error` is set),
+            and so are the actions of a chunk that wasn't sent (a transport error without `raise_on_exception`,
+            or a spilled chunk), with the error as their item
         :func:`~elasticsearch.helpers.streaming_bulk` which is used to execute
         the operation.
         """
+        if self.process_pool is not None and result_callback is None:
+            results = yield self.process_pool.bulk(actions, stats_only=stats_only, verbose=verbose,
+                                                    offload_threshold=self.offload_threshold,
+                                                    minimal_responses=self.minimal_responses, **kwargs)
+            returnValue(results)
 
+        if result_callback is not None:
+            kwargs.setdefault('raise_on_error', False)
+            stats = yield self._correlated_bulk(actions, result_callback, **kwargs)
+            returnValue(stats)
+
+        counters = [0, 0]
         inserted = []
         errors = []
         all = []
-        for deferred_bulk in self.streaming_bulk(actions, **kwargs):
-            bulk_results = yield deferred_bulk
+
+        def collect(bulk_results):
+            if stats_only and not verbose and isinstance(bulk_results, SuccessfulBulkResults):
+                counters[0] += len(bulk_results)
+                return
+
             for ok, item in bulk_results:
+                if stats_only and not verbose:
+                    # only the counters are needed
+                    counters[0 if ok else 1] += 1
+                    continue
+
                 # go through request-response pairs and detect failures
                 all.append((ok, item))
                 l = inserted if ok else errors
                 l.append(item)
 
+        for deferred_bulk in self.streaming_bulk(actions, **kwargs):
+            bulk_results = yield deferred_bulk
+            collect(bulk_results)
+        success, failed = counters
+
         if verbose:
             returnValue(all)
 
         if stats_only:
-            returnValue((len(inserted), len(errors)))
+            returnValue((success, failed))
 
         # here for backwards compatibility
         returnValue((len(inserted), errors))
 
+    @inlineCallbacks
+    def _correlated_bulk(self, actions, result_callback, chunk_size=500, max_chunk_bytes=100 * 1024 * 1024,
+                         expand_action_callback=ActionParser.expand_action, raise_on_exception=True,
+                         raise_on_error=False, **kwargs):
+        """
+        Send the actions chunk by chunk, reporting the result of each action with its source action
+        """
+        success, failed = 0, 0
+        for chunk_actions, bulk_actions in self._correlated_chunks(actions, chunk_size, max_chunk_bytes,
+                                                                   expand_action_callback):
+            bulk_results = yield self._process_bulk_chunk(bulk_actions, raise_on_exception, raise_on_error, **kwargs)
+            if isinstance(bulk_results, SpilledBulkResults):
+                # the actions are replayed later, but their callers learn now that they weren't sent
+                bulk_results = [(False, item) for item in bulk_results.failed_items()]
+
+            if len(bulk_results) < len(chunk_actions):
+                bulk_results = list(bulk_results) + self._missing_results(bulk_actions, len(bulk_results),
+                                                                          raise_on_error)
+
+            for action, (ok, item) in zip(chunk_actions, bulk_results):
+                if ok:
+                    success += 1
+                else:
+                    failed += 1
+                result_callback(action, ok, item)
+
+        returnValue((success, failed))
+
+    @staticmethod
+    def _missing_results(bulk_actions, count, raise_on_error):
+        """
+        :return: the failed results of the actions of a chunk after the first ``count`` ones,
+            for a bulk response that has fewer items than the actions sent
+        """
+        error = ElasticsearchException('the bulk response has no item for the action')
+        items = BulkUtility._handle_transport_error(bulk_actions, error, raise_on_error=False)[count:]
+        if raise_on_error:
+            raise BulkIndexError('{num} document(s) failed to index.'.format(num=len(items)), items)
+        return [(False, item) for item in items]
+
+    def _correlated_chunks(self, actions, chunk_size, max_chunk_bytes, expand_action_callback):
+        """
+        Lazily split the actions into serialized chunks, yielding each chunk with its source actions
+        """
+        sources = []
+        exhausted = []
+
+        def expand():
+            for action in actions:
+                sources.append(action)
+                yield expand_action_callback(action)
+            exhausted.append(True)
+
+        chunks = self._chunk_actions(expand(), chunk_size, max_chunk_bytes, self._collect_indices)
+        for bulk_actions in self._timed_chunks(chunks):
+            # a full chunk is yielded after the next action was read
+            count = len(sources) if exhausted else len(sources) - 1
+            chunk_actions, sources[:] = sources[:count], sources[count:]
+            yield chunk_actions, bulk_actions
+
     def streaming_bulk(self, actions, chunk_size=500, max_chunk_bytes=100 * 1024 * 1024,
                        raise_on_error=True, expand_action_callback=ActionParser.expand_action,
                        raise_on_exception=True, **kwargs):
@@ -112,18 +329,89 @@ class BulkUtility(object):
         """
         actions = list(map(expand_action_callback, actions))
 
-        for bulk_actions in self._chunk_actions(actions, chunk_size, max_chunk_bytes):
-            yield self._process_bulk_chunk(bulk_actions, raise_on_exception, raise_on_error, **kwargs)
+        if not actions or self.offload_threshold is None or len(actions) < self.offload_threshold:
+            chunks = self._chunk_actions(actions, chunk_size, max_chunk_bytes, self._collect_indices)
+            for bulk_actions in self._timed_chunks(chunks):
+                yield self._process_bulk_chunk(bulk_actions, raise_on_exception, raise_on_error, **kwargs)
+            return
+
+        # serialize the chunks in the reactor thread pool, the next chunk while the current one is sent.
+        # The serialization is a python loop over the actions, so the reactor thread keeps running in between.
+        # The actions are cut by count here, so there is a deferred per chunk however they are consumed,
+        # and a chunk over max_chunk_bytes is sent in consecutive requests. Each chunk is sent once the
+        # previous one ended.
+        slices = [actions[start:start + chunk_size] for start in range(0, len(actions), chunk_size)]
+        collect_indices = self._collect_indices
+        prefetched = [deferToThread(lambda: list(self._chunk_actions(slices[0], chunk_size, max_chunk_bytes,
+                                                                     collect_indices)))]
+
+        def send(_, index):
+            serialized = prefetched.pop()
+            if index + 1 < len(slices):
+                prefetched.append(deferToThread(lambda: list(self._chunk_actions(slices[index + 1], chunk_size,
+                                                                                 max_chunk_bytes, collect_indices))))
+            return serialized.addCallback(self._process_bulk_chunks, raise_on_exception, raise_on_error, **kwargs)
+
+        previous = succeed(None)
+        try:
+            for index in range(len(slices)):
+                sent = previous.addBoth(send, index)
+                previous = Deferred()
+                sent.addBoth(self._chain_result, previous)
+                yield sent
+        except GeneratorExit:
+            # the prefetched chunk of a bulk that was given up won't be sent
+            for d in prefetched:
+                d.addErrback(lambda _: None)
+            raise
 
     @staticmethod
-    def _chunk_actions(actions, chunk_size, max_chunk_bytes):
+    def _chain_result(result, d):
+        d.callback(None)
+        return result
+
+    @inlineCallbacks
+    def _process_bulk_chunks(self, chunks, raise_on_exception, raise_on_error, **kwargs):
+        """
+        Send consecutive chunks, with the results of all of them
+        """
+        if len(chunks) == 1:
+            results = yield self._process_bulk_chunk(chunks[0], raise_on_exception, raise_on_error, **kwargs)
+            returnValue(results)
+
+        results = []
+        for bulk_actions in chunks:
+            chunk_results = yield self._process_bulk_chunk(bulk_actions, raise_on_exception, raise_on_error, **kwargs)
+            results.extend(chunk_results)
+        returnValue(results)
+
+    @property
+    def _collect_indices(self):
+        # the indices of a chunk are only needed to invalidate the cached responses of the client
+        return getattr(self.client, '_cache', None) is not None
+
+    @staticmethod
+    def _timed_chunks(chunks):
+        """
+        Time the serialization of each chunk when the reactor lag is monitored (see :mod:`~twistes.lag_monitor`)
+        """
+        return timed_iteration(chunks, MonitoredSections.CHUNK_ACTIONS,
+                               size=lambda bulk_actions: sum(len(line) + 1 for line in bulk_actions))
+
+    @staticmethod
+    def _chunk_actions(actions, chunk_size, max_chunk_bytes, collect_indices=False):
         """
         Split actions into chunks by number or size, serialize them into strings in
         the process.
+        :param collect_indices: yield :class:`BulkChunk` chunks with the indices of their actions
         """
-        bulk_actions = []
+        new_chunk = BulkChunk if collect_indices else list
+        bulk_actions = new_chunk()
         size, action_count = 0, 0
         for action, data in actions:
+            if collect_indices:
+                action_indices = [meta.get(EsDocProperties.INDEX) if isinstance(meta, dict) else None
+                                        for meta in action.values()] if isinstance(action, dict) else [None]
             action = json.dumps(action)
             cur_size = len(action) + 1
 
@@ -134,10 +422,12 @@ class BulkUtility(object):
             # full chunk, send it and start a new one
             if bulk_actions and (size + cur_size > max_chunk_bytes or action_count == chunk_size):
                 yield bulk_actions
-                bulk_actions = []
+                bulk_actions = new_chunk()
                 size, action_count = 0, 0
 
             bulk_actions.append(action)
+            if collect_indices:
+                bulk_actions.indices.update(action_indices)
             if data is not None:
                 bulk_actions.append(data)
 
@@ -151,35 +441,66 @@ class BulkUtility(object):
     def _process_bulk_chunk(self, bulk_actions, raise_on_exception=True, raise_on_error=True, **kwargs):
         """
         Send a bulk request to elasticsearch and process the output.
+        :return: list of the (ok, item) results of the actions, a :class:`SuccessfulBulkResults` when none failed
+            and a :class:`SpilledBulkResults` when the chunk was spilled
         """
         # if raise on error is set, we need to collect errors per chunk before
         # raising them
+        kwargs = self._bulk_params(kwargs)
+        indices = self._chunk_indices(bulk_actions, kwargs.get('index'))
+        if indices is not None:
+            # so the client won't parse the chunk to know which cached responses it invalidates
+            kwargs[EsClientParams.BULK_INDICES] = indices
+
+        if self.spill_queue:
+            # keep the write order, the chunk goes behind the spilled chunks
+            self._spill(bulk_actions, kwargs)
+            returnValue(SpilledBulkResults(bulk_actions))
 
         resp = None
         try:
             # send the actual request
-            actions = "{}\n".format('\n'.join(bulk_actions))
+            with section(MonitoredSections.BULK_ENCODE) as timed:
+                actions = "{}\n".format('\n'.join(bulk_actions))
+                timed.size = len(actions)
             resp = yield self.client.bulk(actions, **kwargs)
-        except ConnectionTimeout as e:
+        except CONNECTION_ERRORS as e:
+            if self.spill_queue is not None:
+                self._spill(bulk_actions, kwargs)
+                returnValue(SpilledBulkResults(bulk_actions, e))
+
             # default behavior - just propagate exception
             if raise_on_exception:
                 raise
 
-            self._handle_transport_error(bulk_actions, e, raise_on_error)
-            returnValue([])
+            errors = self._handle_transport_error(bulk_actions, e, raise_on_error)
+            returnValue([(False, item) for item in errors])
+
+        if resp.get(EsBulk.ERRORS) is False:
+            # all the items succeeded, their results are created only if they are read
+            returnValue(SuccessfulBulkResults(resp[EsBulk.ITEMS]))
 
         # go through request-response pairs and detect failures
         errors = []
         results = []
-        for op_type, item in map(methodcaller('popitem'), resp['items']):
-            ok = 200 <= item.get('status', 500) < 300
-            if not ok and raise_on_error:
-                errors.append({op_type: item})
-
-            if ok or not errors:
-                # if we are not just recording all errors to be able to raise
-                # them all at once, yield items individually
-                results.append((ok, {op_type: item}))
+        metadata = None
+        filtered = EsConst.FILTER_PATH in kwargs
+        with section(MonitoredSections.BULK_RESULTS, len(resp['items'])):
+            for position, (op_type, item) in enumerate(map(methodcaller('popitem'), resp['items'])):
+                ok = 200 <= item.get('status', 500) < 300
+                if not ok and filtered:
+                    # the response was filtered, take the metadata of the failed item from its action
+                    metadata = metadata or self._actions_metadata(bulk_actions)
+                    for key, value in metadata[position].items():
+                        item.setdefault(key, value)
+
+                if not ok and raise_on_error:
+                    errors.append({op_type: item})
+
+                if ok or not errors:
+                    # if we are not just recording all errors to be able to raise
+                    # them all at once, yield items individually
+                    results.append((ok, {op_type: item}))
 
         if errors:
             msg_fmt = '{num} document(s) failed to index.'
@@ -187,8 +508,107 @@ class BulkUtility(object):
         else:
             returnValue(results)
 
+    def _bulk_params(self, params):
+        """
+        :return: the bulk query params, when a filter path is given (or minimal responses are requested) it
+            includes the parts of the response the results are built from
+        """
+        filter_path = params.get(EsConst.FILTER_PATH)
+        if filter_path in NULL_VALUES:
+            if not self.minimal_responses:
+                return params
+            filter_path = EsBulk.RESULT_FILTER_PATH
+
+        return dict(params, filter_path=EsParser.extend_filter_path(filter_path, EsBulk.RESULT_FILTER_PATH))
+
+    @staticmethod
+    def _chunk_indices(bulk_actions, default_index):
+        """
+        :return: the comma separated indices the actions of a chunk write to, None when unknown
+        """
+        indices = getattr(bulk_actions, 'indices', None)
+        if not indices:
+            return None
+
+        indices = set(default_index if index is None else index for index in indices)
+        if None in indices:
+            return None
+        return ','.join(sorted(indices))
+
+    @staticmethod
+    def _actions_metadata(bulk_actions):
+        """
+        :return: the metadata of each action of a serialized chunk, only the action lines are decoded
+        """
+        metadata = []
+        lines = iter(bulk_actions)
+        for line in lines:
+            op_type, action = json.loads(line).popitem()
+            metadata.append(action)
+            if op_type != EsBulk.DELETE:
+                # skip the data line
+                next(lines, None)
+        return metadata
+
+    def _spill(self, bulk_actions, params):
+        self.spill_queue.append(bulk_actions, params)
+        self.spilled += 1
+        self._schedule_replay()
+
+    def _schedule_replay(self):
+        if self._delayed_replay is None:
+            self._delayed_replay = self._clock.callLater(self.replay_interval, self._timed_replay)
+
+    def _timed_replay(self):
+        self._delayed_replay = None
+        d = self.replay_spilled()
+        d.addErrback(lambda _: None)
+        d.addCallback(lambda _: self._schedule_replay() if self.spill_queue else None)
+
+    @inlineCallbacks
+    def replay_spilled(self):
+        """
+        Send the spilled chunks in order, until the queue is empty or the cluster is unreachable again.
+        It's called every ``replay_interval`` seconds while the queue isn't empty, and can be called
+        directly to drain the queue sooner.
+        A chunk that fails with another error than a connection error (e.g. a rejected request) would fail
+        on every replay, so it's removed from the queue and all its actions are failed items.
+        The failed items of each chunk are passed to the ``replay_failure_callback``.
+        :return: tuple of the number of successful and failed actions of the replayed chunks
+        """
+        success, failed = 0, 0
+        if self._replaying or not self.spill_queue:
+            returnValue((success, failed))
+
+        self._replaying = True
+        try:
+            while self.spill_queue:
+                bulk_actions, params = self.spill_queue.peek()
+                try:
+                    resp = yield self.client.bulk("{}\n".format('\n'.join(bulk_actions)), **params)
+                except CONNECTION_ERRORS:
+                    break
+                except Exception as e:
+                    errors = self._handle_transport_error(bulk_actions, e, raise_on_error=False)
+                else:
+                    errors = [item for item in resp[EsBulk.ITEMS]
+                              if not 200 <= next(iter(item.values())).get(EsBulk.STATUS, 500) < 300]
+                    success += len(resp[EsBulk.ITEMS]) - len(errors)
+
+                self.spill_queue.commit()
+                failed += len(errors)
+                if errors and self.replay_failure_callback is not None:
+                    self.replay_failure_callback(errors)
+        finally:
+            self._replaying = False
+
+        returnValue((success, failed))
+
     @staticmethod
     def _handle_transport_error(bulk_actions, e, raise_on_error):
+        """
+        :return: the failed items of all the actions of the chunk, with the error
+        """
         # if we are not propagating, mark all actions in current chunk as
         # failed
         exc_errors = []
@@ -216,3 +636,4 @@ class BulkUtility(object):
             msg_fmt = '{num} document(s) failed to index.'
             raise BulkIndexError(msg_fmt.format(num=len(exc_errors)),
                                  exc_errors)
+        return exc_errors
@@ -0,0 +1,155 @@
+import json
+from collections import OrderedDict
+
+from twisted.internet import reactor
+
+from twistes.compatability import string_types
+from twistes.consts import EsConst, NULL_VALUES
+from twistes.responses import SearchResponse
+
+
+class ResponseCache(object):
+    """
+    Bounded TTL + LRU cache for read api responses.
+
+    Entries are evicted by ttl, by the number of entries and by their (serialized) size in bytes.
+    Each entry is tagged with the indices it was read from, so a write to an index can
+    invalidate only the entries that may have changed. Entries read from all indices,
+    wildcards or unknown indices are invalidated by any write.
+    Note: cached results are shared between callers, treat them as read only.
+    """
+    ALL_INDICES = EsConst.ALL_VALUES
+
+    def __init__(self, max_entries=1000, max_bytes=50 * 1024 * 1024, default_ttl=60, clock=None):
+        """
+        :param max_entries: the max number of cached responses
+        :param max_bytes: the max total size of the cached responses
+        :param default_ttl: the ttl in seconds of an entry when no per call ttl is given
+        :param clock: the time provider (IReactorTime), defaults to the reactor
+        """
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._default_ttl = default_ttl
+        self._clock = clock or reactor
+        self._entries = OrderedDict()
+        self._index_keys = {}
+        self._size = 0
+        # bumped by the writes, a response read before a write to its indices may be stale
+        self._generation = 0
+        self._index_generations = {}
+
+    def get(self, key, default=None):
+        """
+        :return: the cached value of the key, or default if it is missing or expired
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+
+        value, expires_at, _, _ = entry
+        if expires_at <= self._clock.seconds():
+            self._remove(key)
+            return default
+
+        # mark as recently used
+        del self._entries[key]
+        self._entries[key] = entry
+        return value
+
+    def put(self, key, value, index=None, ttl=None, generation=None):
+        """
+        Cache a response.
+        :param key: the request key
+        :param value: the response
+        :param index: the index (or comma separated indices) the response was read from
+        :param ttl: the ttl of the entry in seconds, defaults to the cache default ttl
+        :param generation: the :meth:`generation` of the index when the request was sent, if the index
+            was invalidated since, the response may be stale and won't be cached
+        """
+        if generation is not None and generation != self.generation(index):
+            return
+
+        size = self._sizeof(value)
+        if size > self._max_bytes:
+            return
+
+        if key in self._entries:
+            self._remove(key)
+
+        tags = self._index_tags(index)
+        ttl = self._default_ttl if ttl is None else ttl
+        self._entries[key] = (value, self._clock.seconds() + ttl, size, tags)
+        self._size += size
+        for tag in tags:
+            self._index_keys.setdefault(tag, set()).add(key)
+
+        while len(self._entries) > self._max_entries or self._size > self._max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def invalidate(self, index=None):
+        """
+        Drop the entries that may be affected by a write to the index.
+        :param index: the written index (or comma separated indices),
+            all the entries are dropped when it's empty, all indices or a wildcard
+        """
+        tags = self._index_tags(index)
+        if self.ALL_INDICES in tags:
+            self._generation += 1
+            self.clear()
+            return
+
+        tags.add(self.ALL_INDICES)
+        for tag in tags:
+            self._index_generations[tag] = self._index_generations.get(tag, 0) + 1
+            for key in list(self._index_keys.get(tag, ())):
+                self._remove(key)
+
+    def generation(self, index=None):
+        """
+        :param index: the index (or comma separated indices) a response is read from
+        :return: the generation of the index, it changes on every invalidation that may affect the index
+        """
+        tags = sorted(self._index_tags(index))
+        return self._generation, tuple(self._index_generations.get(tag, 0) for tag in tags)
+
+    def clear(self):
+        self._entries.clear()
+        self._index_keys.clear()
+        self._size = 0
+
+    def _remove(self, key):
+        _, _, size, tags = self._entries.pop(key)
+        self._size -= size
+        for tag in tags:
+            keys = self._index_keys.get(tag)
+            keys.discard(key)
+            if not keys:
+                del self._index_keys[tag]
+
+    @staticmethod
+    def _sizeof(value):
+        if isinstance(value, SearchResponse):
+            # typed responses are sized by their raw body, they may be decoded already
+            if value.raw_size is not None:
+                return value.raw_size
+            value = value.body
+        return len(json.dumps(value))
+
+    @classmethod
+    def _index_tags(cls, index):
+        if index in NULL_VALUES:
+            return {cls.ALL_INDICES}
+
+        indices = index.split(',') if isinstance(index, string_types) else list(index)
+        if any(i == cls.ALL_INDICES or '*' in i for i in indices):
+            return {cls.ALL_INDICES}
+
+        return set(indices)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size(self):
+        """ The total size in bytes of the cached responses """
+        return self._size
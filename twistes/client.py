@@ -1,44 +1,108 @@
 from twisted.internet.task import deferLater
+from twisted.internet.threads import deferToThread
 
 import treq
 import json
-from twisted.internet.defer import inlineCallbacks, returnValue, CancelledError
+from twisted.internet.defer import inlineCallbacks, returnValue, CancelledError, DeferredList, succeed, fail
 from twisted.internet.error import ConnectingCancelledError
 from twisted.web._newclient import ResponseNeverReceived
 from twistes.compatability import string_types, urlparse
-from twistes.exceptions import (NotFoundError,
-                                ConnectionTimeout,
-                                RequestError,
-                                ElasticsearchException)
-from twistes.scroller import Scroller
-from twistes.consts import HttpMethod, EsMethods, EsConst, NULL_VALUES, TREQ_POOL_DEFAULT_PARAMS
+from twistes.exceptions import (ConnectionTimeout,
+                                ElasticsearchException,
+                                HTTP_EXCEPTIONS)
+from twistes.scroller import Scroller, CompositeAggregationScroller
+from twistes.consts import (HttpMethod, EsMethods, EsConst, EsClientParams, EsBulk, EsDocProperties,
+                            MonitoredSections, NULL_VALUES, TREQ_POOL_DEFAULT_PARAMS)
 from twistes.parser import EsParser
 from twistes.consts import ResponseCodes
 from twistes.bulk_utils import BulkUtility
+from twistes.reindex_utils import ReindexUtility
+from twistes.coalescer import RequestCoalescer
+from twistes.batcher import GetBatcher, SearchBatcher
+from twistes.responses import SearchResponse
+from twistes.columnar import ColumnarScan
+from twistes.tasks import TaskHandle
+from twistes.deferreds import deferred_call, as_deferred
+from twistes.lag_monitor import section, monitoring
 
 from twisted.web.client import HTTPConnectionPool
 from twisted.internet import reactor
 from twisted.internet.tcp import Client
 
+_MISSING = object()
+
 
 class Elasticsearch(object):
     """
     Elastic search asynchronous http client implemented with treq and twisted
+
+    Every api method also accepts the following per call params (they are not sent as url params):
+    :arg request_timeout: the timeout in seconds of a single attempt, overrides the client timeout
+    :arg deadline: the overall time in seconds the call may take, retries included, each attempt
+        gets only the remaining budget. When one of them is given the remaining budget is also sent
+        as the elasticsearch ``timeout`` param on apis that support it
+
+    When ``coalesce_requests`` is set, identical concurrent read requests (get, get_source, exists,
+    mget, search and count with the same method, url and body) share a single network call,
+    the callers share the result object so it should be treated as read only.
+
+    When a ``cache`` (:class:`~twistes.cache.ResponseCache`) is given, the responses of the read
+    requests are cached and every index, update, delete or bulk call made through this client
+    invalidates the entries of the written index. The read apis then accept a per call
+    ``cache_ttl`` param (seconds, 0 to bypass the cache).
+
+    When ``batch_gets`` is set, the gets without query params (other than ``fields``) that are
+    issued within the same reactor iteration (or ``batch_window`` seconds) are sent as one mget,
+    see :class:`~twistes.batcher.GetBatcher`.
+    Likewise when ``batch_searches`` is set, the searches whose query params can be passed in an msearch
+    header (see :class:`~twistes.batcher.SearchBatcher`) are sent together as one msearch.
+    The batched searches bypass the response cache and the request coalescing, a batched get is cached
+    (and coalesced) only as part of its whole mget.
+
+    When ``typed_responses`` is set, search and scroll return a :class:`~twistes.responses.SearchResponse`
+    that keeps the raw body and decodes it (and wraps its hits) only on access.
+
+    When ``json_offload_threshold`` is set, bulks of at least that many actions or lines (through :meth:`bulk`
+    or ``bulk_utils``) are serialized in the reactor thread pool so large bulks won't block the reactor.
+
+    Every api method accepts a ``filter_path`` (comma separated or a list) to shrink the response to the
+    given parts. When ``minimal_bulk_responses`` is set, the bulks of ``bulk_utils`` request only the status
+    and error of each item, see :class:`~twistes.bulk_utils.BulkUtility`.
+
+    The ``async_http_client`` defaults to treq, any object with a treq like ``request`` method can be given
+    instead (e.g. :class:`~twistes.transport.AgentTransport`). When it keeps its own connection pool
+    it exposes it as ``pool``, and that pool is the one warmed up and closed by the client.
     """
 
     def __init__(self, hosts, timeout=10,
                  async_http_client=None,
                  async_http_client_params=None,
                  retry_on_timeout=False,
-                 max_retries=3):
+                 max_retries=3,
+                 coalesce_requests=False,
+                 cache=None,
+                 batch_gets=False,
+                 batch_searches=False,
+                 batch_window=0,
+                 typed_responses=False,
+                 json_offload_threshold=None,
+                 minimal_bulk_responses=False):
         self._es_parser = EsParser()
         self._hostname, self._auth = self._es_parser.parse_host(hosts)
         self._timeout = timeout
         self._async_http_client = async_http_client or treq
         self._async_http_client_params = async_http_client_params or {}
-        self.bulk_utils = BulkUtility(self)
+        self._json_offload_threshold = json_offload_threshold
+        self.bulk_utils = BulkUtility(self, offload_threshold=json_offload_threshold,
+                                      minimal_responses=minimal_bulk_responses)
+        self.reindex_utils = ReindexUtility(self)
         self._retry_on_timeout = retry_on_timeout
         self._max_retries = max_retries
+        self._coalescer = RequestCoalescer() if coalesce_requests else None
+        self._cache = cache
+        self._get_batcher = GetBatcher(self, batch_window) if batch_gets else None
+        self._search_batcher = SearchBatcher(self, batch_window) if batch_searches else None
+        self._search_response_class = SearchResponse if typed_responses else None
 
         if self._async_http_client == treq \
                 and 'pool' not in self._async_http_client_params:
@@ -46,11 +110,42 @@ class Elasticsearch(object):
 
     @staticmethod
     def inject_pool_to_treq(params):
+        """
+        Create the connection pool treq will use, the pool sizing can be tuned through the
+        async http client params (e.g. ``maxPersistentPerHost``, ``cachedConnectionTimeout``),
+        any value not given is taken from TREQ_POOL_DEFAULT_PARAMS.
+        :param params: the async http client params, the pool params are consumed from it
+        """
         params["pool"] = HTTPConnectionPool(reactor, params.pop("persistent", True))
 
         for key, default_value in TREQ_POOL_DEFAULT_PARAMS.items():
             setattr(params["pool"], key, params.pop(key, default_value))
 
+    def _connection_pool(self):
+        """
+        :return: the connection pool of the async http client, None if it isn't known
+        """
+        return self._async_http_client_params.get("pool") or getattr(self._async_http_client, "pool", None)
+
+    def warm_up(self, connections=None):
+        """
+        Pre open keep alive connections to the cluster (tls handshake included),
+        so the first requests after startup won't pay the connect latency.
+        :param connections: the number of connections to open,
+            defaults to the max persistent connections per host of the pool
+        :return: deferred that fires with the number of connections that were opened successfully
+        """
+        if connections is None:
+            connections = getattr(self._connection_pool(), "maxPersistentPerHost",
+                                  TREQ_POOL_DEFAULT_PARAMS["maxPersistentPerHost"])
+
+        # concurrent requests can't share a connection, so each one opens its own
+        # and returns it to the pool once done
+        requests = [self._perform_request(HttpMethod.HEAD, '/') for _ in range(connections)]
+        d = DeferredList(requests, consumeErrors=True)
+        d.addCallback(lambda results: len([success for success, _ in results if success]))
+        return d
+
     @inlineCallbacks
     def info(self, **query_params):
         """
@@ -59,7 +154,7 @@ class Elasticsearch(object):
         """
         yield self._perform_request(HttpMethod.GET, '/', params=query_params)
 
-    @inlineCallbacks
+    @deferred_call
     def get(self, index, id, fields=None, doc_type=EsConst.ALL_VALUES, **query_params):
         """
         Retrieve specific record by id
@@ -71,14 +166,16 @@ class Elasticsearch(object):
         :param query_params: params
         :return:
         """
+        if self._get_batcher is not None and not query_params:
+            return self._get_batcher.get(index, id, doc_type, fields)
+
         if fields:
             query_params[EsConst.FIELDS] = fields
 
         path = self._es_parser.make_path(index, doc_type, id)
-        result = yield self._perform_request(HttpMethod.GET, path, params=query_params)
-        returnValue(result)
+        return self._perform_read_request(HttpMethod.GET, path, params=query_params, index=index)
 
-    @inlineCallbacks
+    @deferred_call
     def exists(self, index, doc_type, id, **query_params):
         """
         Check if the doc exist in the elastic search
@@ -97,12 +194,12 @@ class Elasticsearch(object):
         """
         self._es_parser.is_not_empty_params(index, doc_type, id)
         path = self._es_parser.make_path(index, doc_type, id)
-        result = yield self._perform_request(HttpMethod.HEAD,
-                                             path,
-                                             params=query_params)
-        returnValue(result)
+        return self._perform_read_request(HttpMethod.HEAD,
+                                          path,
+                                          params=query_params,
+                                          index=index)
 
-    @inlineCallbacks
+    @deferred_call
     def get_source(self, index, doc_type, id, **query_params):
         """
         Get the _source of the document
@@ -130,12 +227,12 @@ class Elasticsearch(object):
         """
         self._es_parser.is_not_empty_params(index, doc_type, id)
         path = self._es_parser.make_path(index, doc_type, id, EsMethods.SOURCE)
-        result = yield self._perform_request(HttpMethod.GET,
-                                             path,
-                                             params=query_params)
-        returnValue(result)
+        return self._perform_read_request(HttpMethod.GET,
+                                          path,
+                                          params=query_params,
+                                          index=index)
 
-    @inlineCallbacks
+    @deferred_call
     def mget(self, body, index=None, doc_type=None, **query_params):
         """
         Get multiple document from the same index and doc_type (optionally) by ids
@@ -165,13 +262,13 @@ class Elasticsearch(object):
                                          doc_type,
                                          EsMethods.MULTIPLE_GET)
 
-        result = yield self._perform_request(HttpMethod.GET,
-                                             path,
-                                             body=body,
-                                             params=query_params)
-        returnValue(result)
+        return self._perform_read_request(HttpMethod.GET,
+                                          path,
+                                          body=body,
+                                          params=query_params,
+                                          index=self._mget_indices(body, index))
 
-    @inlineCallbacks
+    @deferred_call
     def update(self, index, doc_type, id, body=None, **query_params):
         """
         Update a document with the body param or list of ids
@@ -205,10 +302,10 @@ class Elasticsearch(object):
         """
         self._es_parser.is_not_empty_params(index, doc_type, id)
         path = self._es_parser.make_path(index, doc_type, id, EsMethods.UPDATE)
-        result = yield self._perform_request(HttpMethod.POST, path, body=body, params=query_params)
-        returnValue(result)
+        return self._perform_write_request(HttpMethod.POST, path, body=body, params=query_params,
+                                           index=index, server_timeout=True)
 
-    @inlineCallbacks
+    @deferred_call
     def search(self, index=None, doc_type=None, body=None, **query_params):
         """
         Make a search query on the elastic search
@@ -278,11 +375,24 @@ class Elasticsearch(object):
         :arg version: Specify whether to return document version as part of a
             hit
         """
+        if self._search_batcher is not None and SearchBatcher.HEADER_PARAMS.issuperset(query_params):
+            d = self._search_batcher.search(index, doc_type, body, **query_params)
+            if self._search_response_class is not None:
+                d.addCallback(self._search_response_class.from_body)
+            return d
+
         path = self._es_parser.make_path(index, doc_type, EsMethods.SEARCH)
-        result = yield self._perform_request(HttpMethod.POST, path, body=body, params=query_params)
-        returnValue(result)
+        # a scrolled search opens a search context per call, it can't be shared
+        if EsConst.SCROLL in query_params:
+            return self._perform_request(HttpMethod.POST, path, body=body, params=query_params,
+                                         server_timeout=True,
+                                         response_class=self._search_response_class)
 
-    @inlineCallbacks
+        return self._perform_read_request(HttpMethod.POST, path, body=body, params=query_params,
+                                          index=index, server_timeout=True,
+                                          response_class=self._search_response_class)
+
+    @deferred_call
     def explain(self, index, doc_type, id, body=None, **query_params):
         """
         The explain api computes a score explanation for a query and a specific
@@ -323,13 +433,12 @@ class Elasticsearch(object):
                                          id,
                                          EsMethods.EXPLAIN)
 
-        result = yield self._perform_request(HttpMethod.GET,
-                                             path,
-                                             body,
-                                             params=query_params)
-        returnValue(result)
+        return self._perform_request(HttpMethod.GET,
+                                     path,
+                                     body,
+                                     params=query_params)
 
-    @inlineCallbacks
+    @deferred_call
     def delete(self, index, doc_type, id, **query_params):
         """
         Delete specific record by id
@@ -341,10 +450,10 @@ class Elasticsearch(object):
         :return:
         """
         path = self._es_parser.make_path(index, doc_type, id)
-        result = yield self._perform_request(HttpMethod.DELETE, path, params=query_params)
-        returnValue(result)
+        return self._perform_write_request(HttpMethod.DELETE, path, params=query_params, index=index,
+                                           server_timeout=True)
 
-    @inlineCallbacks
+    @deferred_call
     def index(self, index, doc_type, body, id=None, **query_params):
         """
         Adds or updates a typed JSON document in a specific index, making it searchable.
@@ -373,10 +482,10 @@ class Elasticsearch(object):
 
         method = HttpMethod.POST if id in NULL_VALUES else HttpMethod.PUT
         path = self._es_parser.make_path(index, doc_type, id)
-        result = yield self._perform_request(method, path, body, params=query_params)
-        returnValue(result)
+        return self._perform_write_request(method, path, body, params=query_params, index=index,
+                                           server_timeout=True)
 
-    @inlineCallbacks
+    @deferred_call
     def create(self, index, doc_type, body, id=None, **query_params):
         """
         Adds a typed JSON document in a specific index, making it searchable.
@@ -401,10 +510,9 @@ class Elasticsearch(object):
             'external', 'external_gte', 'force'
         """
         query_params['op_type'] = 'create'
-        result = yield self.index(index, doc_type, body, id=id, params=query_params)
-        returnValue(result)
+        return self.index(index, doc_type, body, id=id, **query_params)
 
-    @inlineCallbacks
+    @deferred_call
     def scroll(self, scroll_id=None, body=None, **query_params):
         """
         Scroll a search request created by specifying the scroll parameter.
@@ -422,11 +530,14 @@ class Elasticsearch(object):
         elif scroll_id:
             query_params[EsConst.SCROLL_ID] = scroll_id
 
+        # scroll pages are never cached
+        query_params.pop(EsClientParams.CACHE_TTL, None)
+
         path = self._es_parser.make_path(EsMethods.SEARCH, EsMethods.SCROLL)
-        result = yield self._perform_request(HttpMethod.GET, path, body, params=query_params)
-        returnValue(result)
+        return self._perform_request(HttpMethod.GET, path, body, params=query_params,
+                                     response_class=self._search_response_class)
 
-    @inlineCallbacks
+    @deferred_call
     def clear_scroll(self, scroll_id=None, body=None, **query_params):
         """
         Clear the scroll request created by specifying the scroll parameter to
@@ -444,8 +555,7 @@ class Elasticsearch(object):
             query_params[EsConst.SCROLL_ID] = scroll_id
 
         path = self._es_parser.make_path(EsMethods.SEARCH, EsMethods.SCROLL)
-        result = yield self._perform_request(HttpMethod.DELETE, path, body, params=query_params)
-        returnValue(result)
+        return self._perform_request(HttpMethod.DELETE, path, body, params=query_params)
 
     @inlineCallbacks
     def scan(self, index, doc_type, query=None, scroll='5m', preserve_order=False, size=10, **kwargs):
@@ -471,7 +581,8 @@ class Elasticsearch(object):
         :param size: the number of results to fetch in each scroll query
 
         Any additional keyword arguments will be passed to the initial
-        :meth:`~elasticsearch.Elasticsearch.search` call::
+        :meth:`~elasticsearch.Elasticsearch.search` call, a ``filter_path`` is applied
+        to the scroll requests as well::
 
             scan(index="coding_languages",
                 doc_type="languages_description",
@@ -483,6 +594,10 @@ class Elasticsearch(object):
         """
         if not preserve_order:
             kwargs['search_type'] = 'scan'
+        if EsConst.FILTER_PATH in kwargs:
+            # the scroller needs the scroll id and the shards and hits totals
+            kwargs[EsConst.FILTER_PATH] = self._es_parser.extend_filter_path(kwargs[EsConst.FILTER_PATH],
+                                                                             Scroller.REQUIRED_FILTER_PATH)
         # initial search
         results = yield self.search(index=index,
                                     doc_type=doc_type,
@@ -491,9 +606,44 @@ class Elasticsearch(object):
                                     scroll=scroll,
                                     **kwargs)
 
-        returnValue(Scroller(self, results, scroll, size))
+        returnValue(Scroller(self, results, scroll, size, kwargs.get(EsClientParams.REQUEST_TIMEOUT),
+                             kwargs.get(EsConst.FILTER_PATH)))
+
+    def composite_scan(self, agg_name, index=None, doc_type=None, body=None, prefetch=False, **query_params):
+        """
+        Iterate over all the buckets of a composite aggregation, page by page.
+        `<https://www.elastic.co/guide/en/elasticsearch/reference/current/search-aggregations-bucket-composite-aggregation.html>`_
+        :param agg_name: the name of the composite aggregation in the body
+        :param index: the index to query on
+        :param doc_type: the doc_type to query on
+        :param body: the search body that holds the composite aggregation
+        :param prefetch: request the next page while the current one is handled
+        Any additional keyword arguments will be passed to each :meth:`search` call
+        :return: a :class:`~twistes.scroller.CompositeAggregationScroller`
+        """
+        return CompositeAggregationScroller(self, agg_name, index, doc_type, body, prefetch, **query_params)
 
     @inlineCallbacks
+    def scan_columns(self, index, doc_type, fields, query=None, typecodes=None, missing=None, **kwargs):
+        """
+        Scan the matching documents and collect only the given fields into column buffers,
+        instead of building a dict per hit. Only the needed fields of the _source are fetched.
+        :param index: the index to query on
+        :param doc_type: the doc_type to query on
+        :param fields: the fields to collect, dotted paths in the _source or hit metadata fields (e.g. '_id')
+        :param query: body for the :meth:`~elasticsearch.Elasticsearch.search` api
+        :param typecodes: dict of field to ``array`` typecode, see :class:`~twistes.columnar.ColumnarScan`
+        :param missing: dict of field to the value to use when the field is missing in a hit
+        Any additional keyword arguments will be passed to :meth:`scan`
+        :return: a :class:`~twistes.columnar.ColumnarScan` holding the collected columns
+        """
+        columns = ColumnarScan(fields, typecodes, missing)
+        kwargs.setdefault(EsMethods.SOURCE, ','.join(columns.source_fields) or 'false')
+        scroller = yield self.scan(index, doc_type, query, **kwargs)
+        result = yield columns.consume(scroller)
+        returnValue(result)
+
+    @deferred_call
     def count(self, index=None, doc_type=None, body=None, **query_params):
         """
         Execute a query and get the number of matches for that query.
@@ -532,10 +682,9 @@ class Elasticsearch(object):
             index = EsConst.ALL_VALUES
 
         path = self._es_parser.make_path(index, doc_type, EsMethods.COUNT)
-        result = yield self._perform_request(HttpMethod.GET, path, body, params=query_params)
-        returnValue(result)
+        return self._perform_read_request(HttpMethod.GET, path, body, params=query_params, index=index)
 
-    @inlineCallbacks
+    @deferred_call
     def bulk(self, body, index=None, doc_type=None, **query_params):
         """
         Perform many index/delete operations in a single API call.
@@ -557,13 +706,26 @@ class Elasticsearch(object):
         """
         self._es_parser.is_not_empty_params(body)
         path = self._es_parser.make_path(index, doc_type, EsMethods.BULK)
-        result = yield self._perform_request(HttpMethod.POST,
-                                             path,
-                                             self._bulk_body(body),
-                                             params=query_params)
-        returnValue(result)
-
-    @inlineCallbacks
+        indices = query_params.pop(EsClientParams.BULK_INDICES, None)
+        if not indices and self._cache is not None:
+            if not isinstance(body, (string_types, list, tuple)):
+                # the body is read for its indices and then serialized
+                body = list(body)
+            indices = self._bulk_indices(body, index)
+        if self._json_offload_threshold is not None and not isinstance(body, string_types) \
+                and hasattr(body, '__len__') and len(body) >= self._json_offload_threshold:
+            d = deferToThread(self._bulk_body, body)
+        else:
+            d = succeed(self._bulk_body(body))
+        d.addCallback(lambda bulk_body: self._perform_write_request(HttpMethod.POST,
+                                                                    path,
+                                                                    bulk_body,
+                                                                    params=query_params,
+                                                                    index=indices,
+                                                                    server_timeout=True))
+        return d
+
+    @deferred_call
     def msearch(self, body, index=None, doc_type=None, **query_params):
         """
         Execute several search requests within the same API.
@@ -582,80 +744,380 @@ class Elasticsearch(object):
                                          doc_type,
                                          EsMethods.MULTIPLE_SEARCH)
 
-        result = yield self._perform_request(HttpMethod.GET,
-                                             path,
-                                             self._bulk_body(body),
-                                             params=query_params)
-        returnValue(result)
+        return self._perform_request(HttpMethod.GET,
+                                     path,
+                                     self._bulk_body(body),
+                                     params=query_params)
+
+    @inlineCallbacks
+    def delete_by_query(self, index, body, doc_type=None, **query_params):
+        """
+        Delete all the documents matching a query, the deletion runs on the cluster as a background task.
+        `<https://www.elastic.co/guide/en/elasticsearch/reference/current/docs-delete-by-query.html>`_
+        :param index: A comma-separated list of index names to search
+        :param body: The search definition using the Query DSL
+        :param doc_type: A comma-separated list of document types to search
+        :arg conflicts: What to do when the operation hits version conflicts, valid choices are:
+            'abort', 'proceed'
+        :arg requests_per_second: The throttle of the task in sub-requests per second, -1 means no throttle
+        :arg scroll_size: The size of the scroll request powering the operation
+        :arg slices: The number of slices the task should be divided into, or 'auto'
+        :arg refresh: Refresh the affected shards once the operation completes
+        :return: a :class:`~twistes.tasks.TaskHandle` of the submitted task
+        """
+        self._es_parser.is_not_empty_params(index, body)
+        path = self._es_parser.make_path(index, doc_type, EsMethods.DELETE_BY_QUERY)
+        query_params[EsConst.WAIT_FOR_COMPLETION] = 'false'
+        result = yield self._perform_write_request(HttpMethod.POST, path, body, params=query_params, index=index)
+        returnValue(TaskHandle(self, result[EsConst.TASK], EsMethods.DELETE_BY_QUERY, index))
+
+    @inlineCallbacks
+    def update_by_query(self, index, body=None, doc_type=None, **query_params):
+        """
+        Update all the documents matching a query, the update runs on the cluster as a background task.
+        `<https://www.elastic.co/guide/en/elasticsearch/reference/current/docs-update-by-query.html>`_
+        :param index: A comma-separated list of index names to search
+        :param body: The search definition using the Query DSL and the update script
+        :param doc_type: A comma-separated list of document types to search
+        :arg conflicts: What to do when the operation hits version conflicts, valid choices are:
+            'abort', 'proceed'
+        :arg pipeline: The ingest pipeline to set on index requests made by this action
+        :arg requests_per_second: The throttle of the task in sub-requests per second, -1 means no throttle
+        :arg scroll_size: The size of the scroll request powering the operation
+        :arg slices: The number of slices the task should be divided into, or 'auto'
+        :arg refresh: Refresh the affected shards once the operation completes
+        :return: a :class:`~twistes.tasks.TaskHandle` of the submitted task
+        """
+        self._es_parser.is_not_empty_params(index)
+        path = self._es_parser.make_path(index, doc_type, EsMethods.UPDATE_BY_QUERY)
+        query_params[EsConst.WAIT_FOR_COMPLETION] = 'false'
+        result = yield self._perform_write_request(HttpMethod.POST, path, body, params=query_params, index=index)
+        returnValue(TaskHandle(self, result[EsConst.TASK], EsMethods.UPDATE_BY_QUERY, index))
 
     @inlineCallbacks
-    def _perform_request(self, method, path, body=None, params=None, num_retries=None):
+    def reindex(self, body, **query_params):
+        """
+        Copy documents from one index to another on the cluster, the copy runs as a background task.
+        See :class:`~twistes.reindex_utils.ReindexUtility` for a client side copy (e.g. between clusters).
+        `<https://www.elastic.co/guide/en/elasticsearch/reference/current/docs-reindex.html>`_
+        :param body: The search definition using the Query DSL and the prototype for the index request
+        :arg requests_per_second: The throttle of the task in sub-requests per second, -1 means no throttle
+        :arg slices: The number of slices the task should be divided into, or 'auto'
+        :arg refresh: Refresh the affected shards once the operation completes
+        :return: a :class:`~twistes.tasks.TaskHandle` of the submitted task
+        """
+        self._es_parser.is_not_empty_params(body)
+        index = body.get('dest', {}).get('index')
+        path = self._es_parser.make_path(EsMethods.REINDEX)
+        query_params[EsConst.WAIT_FOR_COMPLETION] = 'false'
+        result = yield self._perform_write_request(HttpMethod.POST, path, body, params=query_params, index=index)
+        returnValue(TaskHandle(self, result[EsConst.TASK], EsMethods.REINDEX, index))
+
+    @deferred_call
+    def get_task(self, task_id, **query_params):
+        """
+        Get the information of a task.
+        `<https://www.elastic.co/guide/en/elasticsearch/reference/current/tasks.html>`_
+        :param task_id: The task id ('<node id>:<task number>')
+        :arg wait_for_completion: Wait for the matching task to complete
+        """
+        self._es_parser.is_not_empty_params(task_id)
+        path = self._es_parser.make_path(EsMethods.TASKS, task_id)
+        return self._perform_request(HttpMethod.GET, path, params=query_params)
+
+    @deferred_call
+    def rethrottle(self, task_id, requests_per_second, action=EsMethods.REINDEX, **query_params):
+        """
+        Change the throttling of a running delete by query, update by query or reindex task.
+        :param task_id: The task id
+        :param requests_per_second: The throttle in sub-requests per second, -1 means no throttle
+        :param action: The api that created the task
+        """
+        self._es_parser.is_not_empty_params(task_id)
+        query_params[EsConst.REQUESTS_PER_SECOND] = requests_per_second
+        path = self._es_parser.make_path(action, task_id, EsMethods.RETHROTTLE)
+        return self._perform_request(HttpMethod.POST, path, params=query_params)
+
+    @deferred_call
+    def cancel_task(self, task_id, **query_params):
+        """
+        Cancel a running task.
+        :param task_id: The task id
+        """
+        self._es_parser.is_not_empty_params(task_id)
+        path = self._es_parser.make_path(EsMethods.TASKS, task_id, EsMethods.CANCEL)
+        return self._perform_request(HttpMethod.POST, path, params=query_params)
 
+    def invalidate_cache(self, index=None):
+        """
+        Drop the cached responses of the index, when the response cache is enabled.
+        :param index: the index (or comma separated indices), all the cached responses when not given
+        """
+        if self._cache is not None:
+            self._cache.invalidate(index)
+
+    @deferred_call
+    def _perform_request(self, method, path, body=None, params=None, num_retries=None,
+                         deadline=None, server_timeout=False, response_class=None):
+        """
+        Send a request to elasticsearch and translate the response.
+        :param params: the query params, may also hold the per call ``request_timeout``
+            (seconds per attempt) and ``deadline`` (seconds for the whole call, retries included)
+        :param num_retries: the number of retries left for this call
+        :param deadline: the absolute reactor time in which the call expires (used by retries)
+        :param server_timeout: whether the endpoint accepts the elasticsearch ``timeout`` param,
+            if so and a per call timeout was given, the remaining budget is sent to the server as well
+        :param response_class: when given, a successful response is returned as response_class(raw body)
+        """
         num_retries = self._max_retries if num_retries is None else num_retries
-        url = self._es_parser.prepare_url(self._hostname, path, params)
+        query_params = dict(params or {})
+        request_timeout = query_params.pop(EsClientParams.REQUEST_TIMEOUT, None)
+        call_deadline = query_params.pop(EsClientParams.DEADLINE, None)
+        if deadline is None and call_deadline is not None:
+            deadline = reactor.seconds() + call_deadline
+
+        timeout = self._remaining_timeout(request_timeout, deadline)
+        if server_timeout and timeout and EsConst.TIMEOUT not in query_params \
+                and (request_timeout or deadline):
+            query_params[EsConst.TIMEOUT] = '{ms}ms'.format(ms=int(timeout * 1000))
+
+        url = self._es_parser.prepare_url(self._hostname, path, query_params)
 
         if body is not None and not isinstance(body, string_types):
-            body = json.dumps(body)
+            with section(MonitoredSections.JSON_ENCODE) as timed:
+                body = json.dumps(body)
+                timed.size = len(body)
+        if body is not None and not isinstance(body, bytes):
+            # the http client sends bytes
+            body = body.encode('utf-8')
         try:
-            response = yield self._async_http_client.request(method,
-                                                             url,
-                                                             data=body,
-                                                             timeout=self._timeout,
-                                                             auth=self._auth,
-                                                             **self._async_http_client_params)
+            d = as_deferred(self._async_http_client.request(method,
+                                                            url,
+                                                            data=body,
+                                                            timeout=timeout,
+                                                            auth=self._auth,
+                                                            **self._async_http_client_params))
+        except Exception:
+            d = fail()
+
+        d.addCallback(self._read_response, response_class)
+        d.addErrback(self._handle_request_error, method, path, body, params, num_retries,
+                     deadline, server_timeout, response_class)
+        return d
+
+    def _read_response(self, response, response_class):
+        if response_class is None:
+            d = as_deferred(self._get_content(response))
+        else:
+            d = as_deferred(self._get_typed_content(response, response_class))
+        d.addCallback(self._check_response, response.code)
+        return d
+
+    @staticmethod
+    def _check_response(content, code):
+        if code in (ResponseCodes.OK,
+                    ResponseCodes.CREATED,
+                    ResponseCodes.ACCEPTED):
+            return content
+
+        if code in HTTP_EXCEPTIONS:
+            raise HTTP_EXCEPTIONS[code](content)
+
+        # This is a place holder for unknown exceptions
+        # that haven't been encapsulated yet
+        msg_fmt = "unknown error; code: {code} | message: {msg}"
+        raise ElasticsearchException(msg_fmt.format(code=code,
+                                                    msg=str(content)))
+
+    def _handle_request_error(self, failure, method, path, body, params, num_retries,
+                              deadline, server_timeout, response_class):
+        if failure.check(ResponseNeverReceived):
+            if self._retry_on_timeout and num_retries > 0:
+                return self._perform_request(method, path, body, params, num_retries - 1,
+                                             deadline, server_timeout, response_class)
+
+            raise ConnectionTimeout(str(failure.value))
 
-            content = yield self._get_content(response)
+        if failure.check(CancelledError,
+                         ConnectingCancelledError):
+            raise ConnectionTimeout(str(failure.value))
 
-            if response.code in (ResponseCodes.OK,
-                                 ResponseCodes.CREATED,
-                                 ResponseCodes.ACCEPTED):
-                returnValue(content)
+        return failure
 
-            if response.code == ResponseCodes.NOT_FOUND:
-                raise NotFoundError(content)
+    def _perform_read_request(self, method, path, body=None, params=None, index=None, **kwargs):
+        """
+        Perform a read only request, when request coalescing is enabled identical
+        concurrent read requests share one network call, and when a cache is set
+        the response is served from / stored in the cache.
+        :param index: the index (or comma separated indices) the request reads from
+        """
+        cache_ttl = None
+        if params and EsClientParams.CACHE_TTL in params:
+            params = dict(params)
+            cache_ttl = params.pop(EsClientParams.CACHE_TTL)
+
+        if self._coalescer is None and self._cache is None:
+            return self._perform_request(method, path, body, params, **kwargs)
+
+        if body is not None and not isinstance(body, string_types):
+            body = json.dumps(body)
 
-            if response.code == ResponseCodes.BAD_REQUEST:
-                raise RequestError(content)
+        # sort the params so the key won't depend on their order
+        url = self._es_parser.prepare_url(self._hostname, path, sorted(params.items()) if params else None)
+        key = (method, url, body)
 
-            # This is a place holder for unknown exceptions
-            # that haven't been encapsulated yet
-            msg_fmt = "unknown error; code: {code} | message: {msg}"
-            raise ElasticsearchException(msg_fmt.format(code=response.code,
-                                                        msg=str(content)))
+        use_cache = self._cache is not None and cache_ttl != 0
+        if use_cache:
+            cached = self._cache.get(key, _MISSING)
+            if cached is not _MISSING:
+                return succeed(cached)
 
-        except ResponseNeverReceived as e:
+        def perform_request():
+            d = self._perform_request(method, path, body, params, **kwargs)
+            if use_cache:
+                d.addCallback(self._cache_result, key, index, cache_ttl, self._cache.generation(index))
+            return d
 
-            if self._retry_on_timeout and num_retries > 0:
-                response = yield self._perform_request(method, path, body, params, num_retries - 1)
-                returnValue(response)
+        if self._coalescer is None:
+            return perform_request()
 
-            raise ConnectionTimeout(str(e))
+        return self._coalescer.coalesce(key, perform_request)
 
-        except (CancelledError,
-                ConnectingCancelledError) as e:
-            raise ConnectionTimeout(str(e))
+    def _cache_result(self, result, key, index, ttl, generation):
+        self._cache.put(key, result, index=index, ttl=ttl, generation=generation)
+        return result
+
+    def _perform_write_request(self, method, path, body=None, params=None, index=None, **kwargs):
+        """
+        Perform a request that modifies the index, the cached responses of the index are invalidated.
+        :param index: the index (or comma separated indices) the request writes to, None for unknown
+        """
+        if self._cache is None:
+            return self._perform_request(method, path, body, params, **kwargs)
+
+        self._cache.invalidate(index)
+        d = self._perform_request(method, path, body, params, **kwargs)
+        # reads that were sent before the write was applied may hold stale data
+        d.addBoth(self._invalidate_after_write, index)
+        return d
+
+    def _invalidate_after_write(self, result, index):
+        self._cache.invalidate(index)
+        return result
+
+    @staticmethod
+    def _mget_indices(body, index):
+        """
+        :return: the indices an mget request reads from, the default index and the docs specific indices
+        """
+        docs = body.get('docs', ()) if isinstance(body, dict) else ()
+        indices = set(doc[EsDocProperties.INDEX] for doc in docs
+                      if isinstance(doc, dict) and EsDocProperties.INDEX in doc)
+        if not indices:
+            return index
+
+        if index:
+            indices.add(index)
+        return ','.join(indices)
+
+    @staticmethod
+    def _bulk_indices(body, index):
+        """
+        :return: the indices a bulk request writes to, None when they can't be known
+            without parsing the body (the body is already serialized)
+        """
+        if isinstance(body, string_types):
+            return None
+
+        indices = set()
+        for line in body:
+            if not isinstance(line, dict) or len(line) != 1:
+                continue
+            op_type, action = next(iter(line.items()))
+            if op_type in EsBulk.OPERATIONS and isinstance(action, dict):
+                indices.add(action.get(EsDocProperties.INDEX, index))
+
+        if not indices or None in indices:
+            return None
+        return ','.join(indices)
+
+    def _remaining_timeout(self, request_timeout, deadline):
+        """
+        Calculate the timeout of the next attempt, the per call timeout (or the client default)
+        bounded by what is left from the call deadline.
+        :raise ConnectionTimeout: if the deadline already passed
+        """
+        timeout = request_timeout or self._timeout
+        if deadline is None:
+            return timeout
+
+        remaining = deadline - reactor.seconds()
+        if remaining <= 0:
+            raise ConnectionTimeout("deadline exceeded")
+
+        return remaining if timeout is None else min(timeout, remaining)
 
-    @inlineCallbacks
     def _get_content(self, response):
-        content = None
+        """
+        Decode the json response body, unknown errors are ignored and the content is set to None
+        """
+        try:
+            if monitoring():
+                # decode here so the decoding is timed by the lag monitor
+                d = as_deferred(response.content())
+                d.addCallback(self._loads)
+            else:
+                d = as_deferred(response.json())
+        except Exception:
+            d = fail()
+        d.addErrback(self._decode_content, response)
+        return d
+
+    @staticmethod
+    def _decode_content(failure, response):
+        if not failure.check(ValueError):
+            return None
+
+        d = as_deferred(response.content())
+        d.addCallback(Elasticsearch._loads)
+        d.addErrback(lambda _: None)
+        return d
+
+    @staticmethod
+    def _loads(content):
+        with section(MonitoredSections.JSON_DECODE, len(content)):
+            return json.loads(content.decode('utf-8') if isinstance(content, bytes) else content)
+
+    def _get_typed_content(self, response, response_class):
+        """
+        Read the raw body, a successful response is wrapped by the response class (which decodes it lazily)
+        """
+        d = as_deferred(response.content())
+        d.addCallback(self._wrap_typed_content, response.code, response_class)
+        return d
+
+    @staticmethod
+    def _wrap_typed_content(content, code, response_class):
+        if code in (ResponseCodes.OK,
+                    ResponseCodes.CREATED,
+                    ResponseCodes.ACCEPTED):
+            return response_class(content)
+
         try:
-            content = yield response.json()
-        except ValueError as e:
-            content_txt = yield response.content()
-            content = json.loads(content_txt)
-        except Exception as e:
-            # unknown exceptions are ignored
-            # and the content is set to None
+            content = json.loads(content.decode('utf-8'))
+        except ValueError:
+            # keep the raw content for the error message
             pass
-        finally:
-            returnValue(content)
+        return content
 
     @staticmethod
     def _bulk_body(body):
         # if not passed in a string, serialize items and join by newline
         line_feed = '\n'
         if not isinstance(body, str):
-            body = line_feed.join(map(json.dumps, body))
+            with section(MonitoredSections.BULK_ENCODE) as timed:
+                body = line_feed.join(map(json.dumps, body))
+                timed.size = len(body)
 
         # bulk body must end with a newline
         if not body.endswith(line_feed):
@@ -688,5 +1150,7 @@ class Elasticsearch(object):
 
             return deferLater(reactor, 0, _check_fds, None)
 
-        pool = self._async_http_client_params["pool"]
+        pool = self._connection_pool()
+        if pool is None:
+            return succeed(None)
         return pool.closeCachedConnections().addBoth(_check_fds)
@@ -0,0 +1,67 @@
+from twisted.internet.defer import Deferred, maybeDeferred
+
+
+class _Flight(object):
+    """
+    A request in flight and the callers waiting for it
+    """
+    __slots__ = ('request', 'waiters')
+
+    def __init__(self):
+        self.request = None
+        self.waiters = []
+
+
+class RequestCoalescer(object):
+    """
+    Single flight of identical concurrent requests.
+
+    The first call with a given key performs the request, calls with the same key
+    that arrive while it is in flight wait for it and get the same result (or failure).
+    Every caller gets its own deferred: cancelling it only detaches that caller, the request
+    itself is cancelled once no caller waits for it anymore.
+    Note: the callers share the result object, treat it as read only.
+    """
+
+    def __init__(self):
+        self._in_flight = {}
+
+    def coalesce(self, key, request_factory):
+        """
+        :param key: a hashable identifier of the request
+        :param request_factory: a callable that performs the request and returns a deferred
+        :return: deferred that fires with the result of the (possibly shared) request
+        """
+        flight = self._in_flight.get(key)
+        leader = flight is None
+        if leader:
+            flight = self._in_flight[key] = _Flight()
+
+        waiter = Deferred(lambda waiter: self._detach(key, flight, waiter))
+        flight.waiters.append(waiter)
+
+        if leader:
+            # a factory that raises (or returns an already fired deferred) completes the flight right away
+            flight.request = maybeDeferred(request_factory)
+            flight.request.addBoth(self._fan_out, key, flight)
+        return waiter
+
+    def _detach(self, key, flight, waiter):
+        flight.waiters.remove(waiter)
+        if not flight.waiters and flight.request is not None:
+            self._remove(key, flight)
+            flight.request.cancel()
+
+    def _fan_out(self, result, key, flight):
+        self._remove(key, flight)
+        # the result (or failure) goes to the waiters, the request deferred itself ends with None
+        waiters, flight.waiters = flight.waiters, []
+        for waiter in waiters:
+            waiter.callback(result)
+
+    def _remove(self, key, flight):
+        if self._in_flight.get(key) is flight:
+            del self._in_flight[key]
+
+    def __len__(self):
+        return len(self._in_flight)
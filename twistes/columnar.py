@@ -0,0 +1,148 @@
+from array import array
+
+from twisted.internet.defer import inlineCallbacks, returnValue
+
+from twistes.consts import EsDocProperties
+from twistes.exceptions import ImproperlyConfigured
+
+# hit properties that are read from the hit itself and not from its _source
+HIT_METADATA_FIELDS = (EsDocProperties.ID, EsDocProperties.INDEX, EsDocProperties.TYPE,
+                       EsDocProperties.ROUTING, EsDocProperties.VERSION, '_score')
+
+# array typecodes of float columns, their missing values default to nan
+FLOAT_TYPECODES = ('f', 'd')
+
+
+class ColumnarScan(object):
+    """
+    Accumulate the values of selected fields of scan results into column buffers.
+
+    Each field is appended page by page straight into its column, a typed ``array.array``
+    when a typecode is given for it and a list otherwise, so no per hit objects are built.
+    The columns can then be converted to numpy arrays, a pandas DataFrame or an arrow Table.
+    Usage:
+        columns = yield es.scan_columns('logs', 'event', ['_id', 'user.id', 'duration'],
+                                        typecodes={'user.id': 'l', 'duration': 'd'})
+        durations = columns.to_numpy()['duration']
+    """
+
+    def __init__(self, fields, typecodes=None, missing=None):
+        """
+        :param fields: the fields to collect, dotted paths in the hit _source (e.g. 'user.id')
+            or hit metadata fields (e.g. '_id')
+        :param typecodes: dict of field to ``array`` typecode, the fields without typecode are kept in lists
+        :param missing: dict of field to the value to use when the field is missing in a hit,
+            defaults to nan for float columns, 0 for other typed columns and None for lists
+        """
+        typecodes = typecodes or {}
+        missing = missing or {}
+        self.fields = list(fields)
+        self._columns = []
+        self._getters = []
+        for field in self.fields:
+            typecode = typecodes.get(field)
+            self._columns.append(array(typecode) if typecode else [])
+            self._getters.append((self._field_path(field),
+                                  missing.get(field, self._default_missing(typecode))))
+        self.rows = 0
+
+    @staticmethod
+    def _field_path(field):
+        if field in HIT_METADATA_FIELDS:
+            return field, ()
+        return EsDocProperties.SOURCE, tuple(field.split('.'))
+
+    @staticmethod
+    def _default_missing(typecode):
+        if typecode in FLOAT_TYPECODES:
+            return float('nan')
+        return 0 if typecode else None
+
+    @property
+    def source_fields(self):
+        """ The _source fields that are needed, used to filter the _source of the hits """
+        return [field for field in self.fields if field not in HIT_METADATA_FIELDS]
+
+    def add_page(self, hits):
+        """
+        Append the values of a page of hits to the columns.
+        When a value doesn't fit its typed column (e.g. a string in a float column) none of the page is added.
+        :param hits: list of hits as returned by the scroller
+        :raise TypeError, OverflowError: if a value doesn't fit its typed column
+        """
+        try:
+            for column, ((top_key, path), missing) in zip(self._columns, self._getters):
+                append = column.append
+                for hit in hits:
+                    value = hit.get(top_key, missing)
+                    for key in path:
+                        try:
+                            value = value[key]
+                        except (KeyError, TypeError):
+                            value = missing
+                            break
+                    append(missing if value is None else value)
+        except Exception:
+            # the columns are filled one after the other, keep them aligned
+            for column in self._columns:
+                del column[self.rows:]
+            raise
+        self.rows += len(hits)
+
+    @inlineCallbacks
+    def consume(self, scroller):
+        """
+        Collect all the pages of the scroller.
+        :param scroller: a :class:`~twistes.scroller.Scroller`
+        :return: deferred that fires with this ColumnarScan once the scroll is exhausted
+        """
+        for page in scroller:
+            hits = yield page
+            self.add_page(hits)
+        returnValue(self)
+
+    def to_dict(self):
+        """
+        :return: dict of field to its column (array.array or list)
+        """
+        return dict(zip(self.fields, self._columns))
+
+    def to_numpy(self):
+        """
+        :return: dict of field to numpy array, typed columns are converted with a single buffer copy
+        """
+        try:
+            import numpy
+        except ImportError:
+            raise ImproperlyConfigured("numpy is required for numpy output, install twistes[columnar]")
+
+        return dict((field, numpy.frombuffer(column, dtype=column.typecode).copy() if isinstance(column, array)
+                     else numpy.array(column))
+                    for field, column in zip(self.fields, self._columns))
+
+    def to_pandas(self):
+        """
+        :return: pandas DataFrame with a column per field
+        """
+        try:
+            import pandas
+        except ImportError:
+            raise ImproperlyConfigured("pandas is required for pandas output, install twistes[columnar]")
+
+        return pandas.DataFrame(self.to_numpy(), columns=self.fields)
+
+    def to_arrow(self):
+        """
+        :return: pyarrow Table with a column per field
+        """
+        try:
+            import pyarrow
+        except ImportError:
+            raise ImproperlyConfigured("pyarrow is required for arrow output")
+
+        columns = self.to_numpy()
+        return pyarrow.Table.from_arrays([pyarrow.array(columns[field]) for field in self.fields],
+                                         names=self.fields)
+
+    def __len__(self):
+        return self.rows
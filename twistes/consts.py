@@ -35,6 +35,12 @@ class EsMethods(object):
     SOURCE = '_source'
     SEARCH = '_search'
     SCROLL = 'scroll'
+    DELETE_BY_QUERY = '_delete_by_query'
+    UPDATE_BY_QUERY = '_update_by_query'
+    REINDEX = '_reindex'
+    TASKS = '_tasks'
+    RETHROTTLE = '_rethrottle'
+    CANCEL = '_cancel'
 
 
 class EsConst(object):
@@ -45,8 +51,25 @@ class EsConst(object):
     FIELD = 'field'
     FIELDS = 'fields'
     SCROLL_ID = 'scroll_id'
+    SCROLL = 'scroll'
     HITS = 'hits'
     FOUND = 'found'
+    TIMEOUT = 'timeout'
+    TASK = 'task'
+    WAIT_FOR_COMPLETION = 'wait_for_completion'
+    REQUESTS_PER_SECOND = 'requests_per_second'
+    FILTER_PATH = 'filter_path'
+
+
+class EsClientParams(object):
+    """
+    Per call params that are consumed by the client and never sent to elasticsearch
+    """
+    REQUEST_TIMEOUT = 'request_timeout'
+    DEADLINE = 'deadline'
+    CACHE_TTL = 'cache_ttl'
+    # the comma separated indices a bulk request writes to, when the caller knows them
+    BULK_INDICES = 'bulk_indices'
 
 
 class EsBulk(object):
@@ -55,6 +78,14 @@ class EsBulk(object):
     CREATE = 'create'
     DELETE = 'delete'
     UPDATE = 'update'
+    OPERATIONS = (INDEX, CREATE, DELETE, UPDATE)
+    ERRORS = 'errors'
+    ITEMS = 'items'
+    STATUS = 'status'
+    # set on the failed items of the actions of a chunk that was spilled instead of sent
+    SPILLED = 'spilled'
+    # the parts of a bulk response the results are built from
+    RESULT_FILTER_PATH = ('errors', 'items.*.status', 'items.*.error')
 
 
 class EsDocProperties(object):
@@ -78,7 +109,12 @@ class EsAggregation(object):
     BUCKETS = 'buckets'
     DOC_COUNT = 'doc_count'
     KEY = 'key'
+    KEY_AS_STRING = 'key_as_string'
+    VALUE = 'value'
     AGGS = 'aggs'
+    COMPOSITE = 'composite'
+    AFTER = 'after'
+    AFTER_KEY = 'after_key'
 
 
 class EsQuery(object):
@@ -103,3 +139,15 @@ TREQ_POOL_DEFAULT_PARAMS = {
 
 # parts of URL to be omitted
 NULL_VALUES = (None, '', b'', [], ())
+
+
+class MonitoredSections(object):
+    """
+    The synchronous sections timed by the :class:`~twistes.lag_monitor.ReactorLagMonitor`
+    """
+    JSON_ENCODE = 'json_encode'
+    JSON_DECODE = 'json_decode'
+    BULK_ENCODE = 'bulk_encode'
+    CHUNK_ACTIONS = 'chunk_actions'
+    BULK_RESULTS = 'bulk_results'
+    FLATTEN_AGGREGATIONS = 'flatten_aggregations'
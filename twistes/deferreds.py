@@ -0,0 +1,29 @@
+from functools import wraps
+
+from twisted.internet.defer import Deferred, succeed, fail
+
+
+def as_deferred(result):
+    """
+    :return: the result as a deferred, wrapped if it isn't one already (like a yield in inlineCallbacks)
+    """
+    return result if isinstance(result, Deferred) else succeed(result)
+
+
+def deferred_call(f):
+    """
+    Decorator that makes a function always return a deferred, like maybeDeferred:
+    exceptions raised by the function fail the deferred and plain results are wrapped.
+    Used instead of inlineCallbacks on the request path, where the function only chains
+    callbacks, to avoid the generator and the extra deferred of inlineCallbacks on every call.
+    """
+
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        try:
+            result = f(*args, **kwargs)
+        except Exception:
+            return fail()
+        return result if isinstance(result, Deferred) else succeed(result)
+
+    return wrapper
@@ -97,3 +97,10 @@ class RequestError(TransportError):
         super(RequestError, self).__init__(error="bad request",
                                            info=info,
                                            status_code=400)
+
+
+# the exceptions matching the http status codes of failed elasticsearch responses
+HTTP_EXCEPTIONS = {
+    400: RequestError,
+    404: NotFoundError,
+}
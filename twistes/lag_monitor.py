@@ -0,0 +1,214 @@
+from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
+from twisted.python import threadable
+
+# the started monitor, sections are measured only while one is running
+_active_monitor = None
+
+
+def _in_reactor_thread():
+    # the reactor thread is known only once the reactor runs
+    return threadable.ioThread is None or threadable.isInIOThread()
+
+
+class SectionStats(object):
+    """
+    The synchronous sections of one operation that ran since the previous tick of the monitor
+    """
+    __slots__ = ('count', 'seconds', 'size')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0
+        self.size = 0
+
+    def __repr__(self):
+        return 'SectionStats(count={count}, seconds={seconds:.6f}, size={size})'.format(
+            count=self.count, seconds=self.seconds, size=self.size)
+
+
+class _Section(object):
+    """
+    Context manager that measures a synchronous section, the size can be set once it's known
+    """
+    __slots__ = ('_monitor', '_operation', '_started', 'size')
+
+    def __init__(self, monitor, operation, size):
+        self._monitor = monitor
+        self._operation = operation
+        self.size = size
+
+    def __enter__(self):
+        self._started = self._monitor.seconds()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._monitor.record(self._operation, self.size, self._monitor.seconds() - self._started)
+
+
+class _NoSection(object):
+    """
+    The section of when no monitor is running, it measures nothing
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    @property
+    def size(self):
+        return None
+
+    @size.setter
+    def size(self, size):
+        pass
+
+
+_NO_SECTION = _NoSection()
+
+
+def section(operation, size=None):
+    """
+    Measure a synchronous section of twistes work that runs on the reactor thread, e.g.:
+        with section(MonitoredSections.JSON_ENCODE) as timed:
+            body = json.dumps(body)
+            timed.size = len(body)
+    Nothing is measured unless a :class:`ReactorLagMonitor` is running, or when called outside of the
+    reactor thread (e.g. work offloaded to the thread pool).
+    :param operation: the name of the work (see :class:`~twistes.consts.MonitoredSections`)
+    :param size: the payload size (bytes, items...) the work handles, can be set later on the section
+    """
+    if _active_monitor is None or not _in_reactor_thread():
+        return _NO_SECTION
+    return _Section(_active_monitor, operation, size)
+
+
+def monitoring():
+    """
+    :return: whether a :class:`ReactorLagMonitor` is running
+    """
+    return _active_monitor is not None
+
+
+def timed_iteration(iterable, operation, size=len):
+    """
+    Measure each step of a lazy iterable (e.g. a generator that serializes chunks) as a section.
+    :param size: callable that returns the payload size of a yielded item
+    :return: the iterable itself when no monitor is running
+    """
+    if _active_monitor is None or not _in_reactor_thread():
+        return iterable
+    return _timed_iteration(_active_monitor, iter(iterable), operation, size)
+
+
+def _timed_iteration(monitor, iterator, operation, size):
+    while True:
+        # the iteration may be moved to the thread pool (e.g. offloaded bulk serialization)
+        if not _in_reactor_thread():
+            try:
+                yield next(iterator)
+            except StopIteration:
+                return
+            continue
+
+        started = monitor.seconds()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        monitor.record(operation, size(item), monitor.seconds() - started)
+        yield item
+
+
+class ReactorLagMonitor(object):
+    """
+    Watchdog of the reactor thread: a timer measures how late it's called (the reactor lag), and the
+    synchronous sections of twistes (json encoding and decoding, bulk chunking and result processing,
+    aggregation flattening) are timed, so a stall can be attributed to the twistes work that caused it.
+
+    ``on_lag(lag, sections)`` is called when a tick is late by at least ``lag_threshold`` seconds, with
+    a dict of operation to the :class:`SectionStats` of the sections that ran since the previous tick
+    (twistes work isn't necessarily the cause when they don't add up to the lag).
+    ``on_slow_section(operation, size, seconds)`` is called for each section of at least ``section_threshold``.
+    Usage:
+        monitor = ReactorLagMonitor(on_lag=lambda lag, sections: log.warn(...))
+        monitor.start()
+    Only one monitor runs at a time.
+    """
+
+    def __init__(self, interval=0.05, lag_threshold=0.05, section_threshold=0.01, on_lag=None,
+                 on_slow_section=None, clock=None):
+        """
+        :param interval: the time in seconds between ticks
+        :param lag_threshold: the min lag in seconds that is reported
+        :param section_threshold: the min duration in seconds of a section that is reported on its own
+        :param on_lag: callable called with the lag and the sections that ran since the previous tick
+        :param on_slow_section: callable called with the operation, size and duration of each slow section
+        :param clock: the time provider (IReactorTime), defaults to the reactor
+        """
+        self._interval = interval
+        self._lag_threshold = lag_threshold
+        self._section_threshold = section_threshold
+        self._on_lag = on_lag
+        self._on_slow_section = on_slow_section
+        self._clock = clock or reactor
+        self.seconds = self._clock.seconds
+        self._sections = {}
+        self._last_tick = None
+        self._loop = LoopingCall(self._tick)
+        self._loop.clock = self._clock
+        self.max_lag = 0
+
+    def start(self):
+        """
+        Start measuring, and make this monitor the one the sections are recorded to
+        """
+        global _active_monitor
+        if _active_monitor is not None and _active_monitor is not self:
+            raise RuntimeError('another reactor lag monitor is running')
+
+        _active_monitor = self
+        self._sections = {}
+        self._last_tick = self.seconds()
+        self._loop.start(self._interval, now=False)
+
+    def stop(self):
+        global _active_monitor
+        if _active_monitor is self:
+            _active_monitor = None
+        if self._loop.running:
+            self._loop.stop()
+
+    @property
+    def running(self):
+        return self._loop.running
+
+    def record(self, operation, size, seconds):
+        """
+        Record a synchronous section.
+        :param operation: the name of the work
+        :param size: the payload size of the work, None if unknown
+        :param seconds: the time it took
+        """
+        stats = self._sections.get(operation)
+        if stats is None:
+            stats = self._sections[operation] = SectionStats()
+        stats.count += 1
+        stats.seconds += seconds
+        stats.size += size or 0
+
+        if self._on_slow_section is not None and seconds >= self._section_threshold:
+            self._on_slow_section(operation, size, seconds)
+
+    def _tick(self):
+        now = self.seconds()
+        lag = max(now - self._last_tick - self._interval, 0)
+        self._last_tick = now
+        sections, self._sections = self._sections, {}
+
+        self.max_lag = max(self.max_lag, lag)
+        if self._on_lag is not None and lag >= self._lag_threshold:
+            self._on_lag(lag, sections)
@@ -1,6 +1,6 @@
 from twistes.compatability import quote, urlencode, string_types, urlparse
 
-from twistes.consts import NULL_VALUES, HostParsing
+from twistes.consts import NULL_VALUES, HostParsing, EsConst
 
 
 class EsParser(object):
@@ -124,13 +124,32 @@ class EsParser(object):
         url = hostname + path
 
         if params:
-            url = url + '?' + urlencode(params)
+            items = params.items() if isinstance(params, dict) else params
+            # a filter_path can be given as a list (e.g. ['hits.hits._id', 'hits.total']), it's sent comma separated
+            url = url + '?' + urlencode([(key, ','.join(value) if key == EsConst.FILTER_PATH
+                                          and isinstance(value, (list, tuple)) else value)
+                                         for key, value in items])
 
         if not url.startswith(('http:', 'https:')):
             url = "http://" + url
 
         return url.encode('utf-8')
 
+    @staticmethod
+    def extend_filter_path(filter_path, required_paths):
+        """
+        Add the paths the client relies on to a ``filter_path``.
+        :param filter_path: the filter path (comma separated or a list), empty when the response isn't filtered
+        :param required_paths: the paths to add
+        :return: the extended filter path, or the given one when it's empty (the full response is returned)
+        """
+        if filter_path in NULL_VALUES:
+            return filter_path
+
+        paths = filter_path.split(',') if isinstance(filter_path, string_types) else list(filter_path)
+        paths.extend(path for path in required_paths if path not in paths)
+        return ','.join(paths)
+
     @staticmethod
     def is_not_empty_params(*kwargs):
         for param in kwargs:
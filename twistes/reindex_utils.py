@@ -0,0 +1,191 @@
+from copy import deepcopy
+
+from twisted.internet.defer import inlineCallbacks, returnValue, DeferredSemaphore, DeferredList
+from twisted.python.failure import Failure
+
+from twistes.consts import EsBulk, EsDocProperties
+
+
+class ReindexStats(object):
+    """
+    Progress of a reindex run
+    """
+
+    def __init__(self):
+        self.read = 0
+        self.skipped = 0
+        self.success = 0
+        self.failed = 0
+        self.bulks = 0
+
+    def __repr__(self):
+        return '<ReindexStats read={read} skipped={skipped} success={success} failed={failed}>'.format(
+            read=self.read, skipped=self.skipped, success=self.success, failed=self.failed)
+
+
+class ReindexUtility(object):
+    """
+    Copy documents between indices (or clusters) by piping scan pages into bulk requests.
+
+    The source is read by one or more scroll slices in parallel, and each page is sent
+    as a bulk to the target while the next page is read, with a bounded number of in flight
+    bulks, so reads and writes overlap.
+    The first failure (of a bulk or a read) stops all the slices, and the scroll contexts of the
+    slices are cleared once they end.
+    """
+
+    def __init__(self, es):
+        self.client = es
+
+    @inlineCallbacks
+    def reindex(self, source_index, target_index, query=None, doc_type=None, target_client=None,
+                target_doc_type=None, slices=1, max_concurrent_bulks=2, transform=None,
+                progress_callback=None, scroll='5m', size=500, scan_kwargs=None, bulk_kwargs=None):
+        """
+        Reindex all the documents that match the query from the source index to the target index
+        :param source_index: the index to read from
+        :param target_index: the index to write to
+        :param query: body for the :meth:`~twistes.client.Elasticsearch.search` api, defaults to all documents
+        :param doc_type: the doc type to read
+        :param target_client: the Elasticsearch client of the target cluster, defaults to this client
+        :param target_doc_type: the doc type to write, defaults to the doc type of each hit
+        :param slices: the number of scroll slices to read in parallel (sliced scroll)
+        :param max_concurrent_bulks: the max number of bulk requests in flight (across all slices)
+        :param transform: callable that gets a hit and the bulk action built from it and
+            returns the action to send (may modify it), or None to skip the document
+        :param progress_callback: callable called with the :class:`ReindexStats` after each bulk
+        :param scroll: how long a consistent view of the index should be maintained for scrolled search
+        :param size: the number of hits in each scroll page (per slice)
+        :param scan_kwargs: additional arguments for :meth:`~twistes.client.Elasticsearch.scan`
+        :param bulk_kwargs: additional arguments for :meth:`~twistes.bulk_utils.BulkUtility.bulk`
+        :return: the :class:`ReindexStats` of the run
+        """
+        target_client = target_client or self.client
+        bulk_semaphore = DeferredSemaphore(max_concurrent_bulks)
+        stats = ReindexStats()
+        # shared by the slices, set on the first failure so they stop reading and sending
+        failures = []
+
+        slice_runs = []
+        for slice_id in range(slices):
+            slice_query = deepcopy(query) if query else {}
+            if slices > 1:
+                slice_query['slice'] = {'id': slice_id, 'max': slices}
+
+            slice_runs.append(self._reindex_slice(source_index, doc_type, slice_query, target_client,
+                                                  target_index, target_doc_type, bulk_semaphore, stats, failures,
+                                                  transform, progress_callback, scroll, size,
+                                                  scan_kwargs or {}, bulk_kwargs or {}))
+
+        yield self._gather(slice_runs)
+        returnValue(stats)
+
+    def _reindex_slice(self, source_index, doc_type, query, target_client, target_index, target_doc_type,
+                       bulk_semaphore, stats, failures, transform, progress_callback, scroll, size, scan_kwargs,
+                       bulk_kwargs):
+        d = self.client.scan(source_index, doc_type, query=query, scroll=scroll, size=size, **scan_kwargs)
+        d.addCallback(lambda scroller: self._pipe_slice(scroller, target_client, target_index, target_doc_type,
+                                                        bulk_semaphore, stats, failures, transform,
+                                                        progress_callback, bulk_kwargs)
+                      .addBoth(self._clear_scroll, scroller))
+        d.addErrback(self._stop, failures)
+        return d
+
+    @inlineCallbacks
+    def _pipe_slice(self, scroller, target_client, target_index, target_doc_type, bulk_semaphore, stats, failures,
+                    transform, progress_callback, bulk_kwargs):
+        bulks = []
+        try:
+            for page in scroller:
+                hits = yield page
+                if failures:
+                    break
+
+                stats.read += len(hits)
+                actions = self._hits_to_actions(hits, target_index, target_doc_type, transform)
+                stats.skipped += len(hits) - len(actions)
+                if not actions:
+                    continue
+
+                # wait for a free bulk slot before reading on, so reads can't run away from writes
+                yield bulk_semaphore.acquire()
+                if failures:
+                    bulk_semaphore.release()
+                    break
+
+                d = target_client.bulk_utils.bulk(actions, stats_only=True, **bulk_kwargs)
+                d.addBoth(self._release, bulk_semaphore)
+                d.addCallbacks(self._update_stats, self._stop, callbackArgs=(stats, progress_callback),
+                               errbackArgs=(failures,))
+                bulks.append(d)
+        except Exception:
+            # stop the other slices now, but end this one only once its own bulks ended
+            failure = Failure()
+            failures.append(failure)
+            yield DeferredList(bulks, consumeErrors=True)
+            failure.raiseException()
+
+        yield self._gather(bulks)
+
+    @staticmethod
+    def _clear_scroll(result, scroller):
+        # the scroll context is freed whether the slice ended or failed, a failure to free it is ignored
+        d = scroller.clear()
+        d.addErrback(lambda _: None)
+        d.addCallback(lambda _: result)
+        return d
+
+    @staticmethod
+    def _gather(deferreds):
+        """
+        Wait for all the deferreds to end, failing with the error of the first one that failed
+        """
+        d = DeferredList(deferreds, consumeErrors=True)
+        d.addCallback(ReindexUtility._first_failure)
+        return d
+
+    @staticmethod
+    def _first_failure(results):
+        for ok, result in results:
+            if not ok:
+                return result
+        return [result for _, result in results]
+
+    @staticmethod
+    def _hits_to_actions(hits, target_index, target_doc_type, transform):
+        actions = []
+        for hit in hits:
+            action = {EsBulk.OP_TYPE: EsBulk.INDEX,
+                      EsDocProperties.INDEX: target_index,
+                      EsDocProperties.TYPE: target_doc_type or hit.get(EsDocProperties.TYPE),
+                      EsDocProperties.ID: hit[EsDocProperties.ID],
+                      EsDocProperties.SOURCE: hit.get(EsDocProperties.SOURCE, {})}
+            if EsDocProperties.ROUTING in hit:
+                action[EsDocProperties.ROUTING] = hit[EsDocProperties.ROUTING]
+
+            if transform is not None:
+                action = transform(hit, action)
+            if action is not None:
+                actions.append(action)
+
+        return actions
+
+    @staticmethod
+    def _release(result, semaphore):
+        semaphore.release()
+        return result
+
+    @staticmethod
+    def _stop(failure, failures):
+        failures.append(failure)
+        return failure
+
+    @staticmethod
+    def _update_stats(result, stats, progress_callback):
+        success, failed = result
+        stats.success += success
+        stats.failed += failed
+        stats.bulks += 1
+        if progress_callback is not None:
+            progress_callback(stats)
+        return result
@@ -0,0 +1,152 @@
+import json
+
+from twistes.consts import EsConst, EsDocProperties, EsAggregation, MonitoredSections
+from twistes.lag_monitor import section
+
+
+class SearchResponse(object):
+    """
+    Lightweight search response that keeps the raw response body.
+
+    The body is decoded only on the first access to its content, and the hits are wrapped
+    in :class:`Hit` objects only when they are accessed, so callers that forward the response
+    or read just a few values don't pay for building the full response.
+    The dict access (``response['hits']``, ``response.get(...)``, ``in``) of the decoded body is
+    supported as well, so the response can be passed to :class:`~twistes.utilities.EsUtils`.
+    """
+    __slots__ = ('raw', 'raw_size', '_body', '_hits')
+
+    def __init__(self, raw):
+        """
+        :param raw: the raw (json) response body, it's dropped (set to None) once the body is decoded,
+            its length is kept as ``raw_size`` (None for a response built from a decoded body)
+        """
+        self.raw = raw
+        self.raw_size = len(raw) if raw is not None else None
+        self._body = None
+        self._hits = None
+
+    @classmethod
+    def from_body(cls, body):
+        """
+        :param body: an already decoded response body (e.g. a response of an msearch)
+        """
+        response = cls(None)
+        response._body = body
+        return response
+
+    @property
+    def body(self):
+        """ The decoded response body """
+        if self._body is None:
+            raw = self.raw.decode('utf-8') if isinstance(self.raw, bytes) else self.raw
+            with section(MonitoredSections.JSON_DECODE, len(raw)):
+                self._body = json.loads(raw)
+            # don't keep the response twice in memory
+            self.raw = None
+        return self._body
+
+    @property
+    def hits(self):
+        """ The hits of the response as :class:`Hit` objects """
+        if self._hits is None:
+            hits = self.body.get(EsConst.HITS, {}).get(EsConst.HITS, ())
+            self._hits = [Hit(hit) for hit in hits]
+        return self._hits
+
+    @property
+    def total(self):
+        return self.body.get(EsConst.HITS, {}).get(EsConst.TOTAL, 0)
+
+    @property
+    def took(self):
+        return self.body.get('took')
+
+    @property
+    def timed_out(self):
+        return self.body.get('timed_out', False)
+
+    @property
+    def scroll_id(self):
+        return self.body.get(EsDocProperties.SCROLL_ID)
+
+    @property
+    def aggregations(self):
+        return self.body.get(EsAggregation.AGGREGATIONS, {})
+
+    def __getitem__(self, key):
+        return self.body[key]
+
+    def __contains__(self, key):
+        return key in self.body
+
+    def get(self, key, default=None):
+        return self.body.get(key, default)
+
+    def __len__(self):
+        return len(self.hits)
+
+    def __bool__(self):
+        # a response is truthy like the dict response, even when its page has no hits
+        return True
+
+    __nonzero__ = __bool__
+
+
+class Hit(object):
+    """
+    A single search hit, a thin view over the decoded hit.
+    """
+    __slots__ = ('_hit',)
+
+    def __init__(self, hit):
+        self._hit = hit
+
+    @property
+    def id(self):
+        return self._hit.get(EsDocProperties.ID)
+
+    @property
+    def index(self):
+        return self._hit.get(EsDocProperties.INDEX)
+
+    @property
+    def doc_type(self):
+        return self._hit.get(EsDocProperties.TYPE)
+
+    @property
+    def score(self):
+        return self._hit.get('_score')
+
+    @property
+    def source(self):
+        return self._hit.get(EsDocProperties.SOURCE, {})
+
+    @property
+    def fields(self):
+        return self._hit.get(EsConst.FIELDS, {})
+
+    def get_field(self, path, default=None):
+        """
+        Get a value from the hit source
+        :param path: the dotted path of the field (e.g. 'user.name')
+        :param default: the value to return when the field is missing
+        """
+        value = self.source
+        for part in path.split('.'):
+            if not isinstance(value, dict) or part not in value:
+                return default
+            value = value[part]
+        return value
+
+    def __getitem__(self, key):
+        return self._hit[key]
+
+    def __contains__(self, key):
+        return key in self._hit
+
+    def get(self, key, default=None):
+        return self._hit.get(key, default)
+
+    def __repr__(self):
+        return '<Hit {index}/{id}>'.format(index=self.index, id=self.id)
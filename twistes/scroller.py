@@ -1,6 +1,8 @@
+from copy import deepcopy
+
 from twisted.internet.defer import succeed, inlineCallbacks, returnValue
 
-from twistes.consts import EsDocProperties
+from twistes.consts import EsDocProperties, EsClientParams, EsAggregation, EsQuery, EsConst
 from twistes.utilities import EsUtils
 
 
@@ -18,12 +20,21 @@ class Scroller(object):
                 ...
     """
 
-    def __init__(self, es, results, scroll, size):
+    REQUIRED_FILTER_PATH = (EsDocProperties.SCROLL_ID, '_shards.total', '_shards.failed', 'hits.total')
+
+    def __init__(self, es, results, scroll, size, request_timeout=None, filter_path=None):
+        """
+        :param filter_path: the filter path of the scroll requests, it should include the REQUIRED_FILTER_PATH
+        """
         self._first_results = results
         self._scroll_id = results.get(EsDocProperties.SCROLL_ID, None)
+        # the id of the search context on the server, kept after the last page so it can be cleared
+        self._context_id = self._scroll_id
         self._scroll = scroll
         self._size = size
         self._es = es
+        self._request_timeout = request_timeout
+        self._filter_path = filter_path
 
     def __iter__(self):
         return self
@@ -43,9 +54,25 @@ class Scroller(object):
     def __next__(self):
         return self.next()
 
+    def clear(self):
+        """
+        Free the search context of the scroll on the server instead of waiting for the scroll timeout,
+        the scroller is exhausted afterwards.
+        :return: deferred that fires once the context was cleared
+        """
+        context_id, self._context_id = self._context_id, None
+        self._scroll_id = self._first_results = None
+        if not context_id:
+            return succeed(None)
+        return self._es.clear_scroll(scroll_id=str(context_id))
+
     @inlineCallbacks
     def _scroll_next_results(self):
-        results = yield self._es.scroll(str(self._scroll_id), scroll=self._scroll)
+        params = {EsClientParams.REQUEST_TIMEOUT: self._request_timeout} if self._request_timeout else {}
+        if self._filter_path:
+            params[EsConst.FILTER_PATH] = self._filter_path
+        results = yield self._es.scroll(str(self._scroll_id), scroll=self._scroll, **params)
+        self._context_id = results.get(EsDocProperties.SCROLL_ID, self._context_id)
         hits = EsUtils.extract_hits(results)
 
         # No more results
@@ -55,3 +82,98 @@ class Scroller(object):
             self._scroll_id = results.get(EsDocProperties.SCROLL_ID, None)
 
         returnValue(hits)
+
+
+class _FailedPrefetch(object):
+    """
+    The failure of a prefetched page, kept as a result until the page is asked for
+    """
+    __slots__ = ('failure',)
+
+    def __init__(self, failure):
+        self.failure = failure
+
+
+class CompositeAggregationScroller(object):
+    """
+    Page through all the buckets of a composite aggregation by following its ``after_key``.
+
+    Usage: like the Scroller, iterate over it and yield each item to get the next page of buckets.
+    Example:
+        scroller = es.composite_scan('by_user', index='logs', body={
+            'aggs': {'by_user': {'composite': {'size': 1000, 'sources': [...]}}}
+        })
+        for page in scroller:
+            buckets = yield page
+            for bucket in buckets:
+                ...
+    Each page has to be yielded before asking for the next one.
+    """
+    DEFAULT_SIZE = 10
+
+    def __init__(self, es, agg_name, index=None, doc_type=None, body=None, prefetch=False, **search_params):
+        """
+        :param es: the Elasticsearch client
+        :param agg_name: the name of the composite aggregation in the body
+        :param body: the search body that holds the composite aggregation
+        :param prefetch: request the next page as soon as a page arrives, while the caller handles it
+        :param search_params: additional params passed to each search
+        """
+        self._es = es
+        self._agg_name = agg_name
+        self._index = index
+        self._doc_type = doc_type
+        self._body = deepcopy(body) if body else {}
+        # the hits aren't needed, only the buckets
+        self._body.setdefault(EsQuery.SIZE, 0)
+        aggs = self._body.get(EsAggregation.AGGS) or self._body.get(EsAggregation.AGGREGATIONS) or {}
+        if EsAggregation.COMPOSITE not in aggs.get(agg_name, {}):
+            raise ValueError("the body has no composite aggregation named {name}".format(name=agg_name))
+        self._composite = aggs[agg_name][EsAggregation.COMPOSITE]
+        self._size = self._composite.get(EsQuery.SIZE, self.DEFAULT_SIZE)
+        self._prefetch = prefetch
+        self._search_params = search_params
+        self._prefetched = None
+        self._done = False
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        """Fetch the next page of buckets."""
+        if self._done:
+            raise StopIteration()
+
+        d, self._prefetched = self._prefetched or self._search(), None
+        d.addCallback(self._handle_page)
+        return d
+
+    def __next__(self):
+        return self.next()
+
+    def _search(self):
+        # the body may be serialized after the next page already moved the after key (e.g. batched searches)
+        return self._es.search(index=self._index, doc_type=self._doc_type,
+                               body=deepcopy(self._body), **self._search_params)
+
+    def _handle_page(self, results):
+        if isinstance(results, _FailedPrefetch):
+            return results.failure
+
+        agg = results.get(EsAggregation.AGGREGATIONS, {}).get(self._agg_name, {})
+        buckets = agg.get(EsAggregation.BUCKETS, [])
+        after_key = agg.get(EsAggregation.AFTER_KEY)
+        if after_key is None and buckets:
+            # versions before after_key was added continue after the last bucket
+            after_key = buckets[-1][EsAggregation.KEY]
+
+        if len(buckets) < self._size or after_key is None:
+            self._done = True
+        else:
+            self._composite[EsAggregation.AFTER] = after_key
+            if self._prefetch:
+                self._prefetched = self._search()
+                # observe the failure now, the caller may stop before asking for the page
+                self._prefetched.addErrback(_FailedPrefetch)
+
+        return buckets
@@ -0,0 +1,183 @@
+import json
+import mmap
+import os
+import struct
+from collections import deque
+
+from twistes.exceptions import ElasticsearchException
+
+# the header of a segment is the offset of its first unconsumed record
+SEGMENT_HEADER = struct.Struct('<Q')
+# each record is prefixed by its length, a zero length marks the end of the written records
+RECORD_HEADER = struct.Struct('<I')
+
+
+class SpillQueueFull(ElasticsearchException):
+    """
+    Raised when spilling a chunk would exceed the disk usage cap of the spill queue
+    """
+
+
+class _Segment(object):
+    """
+    A preallocated memory mapped segment file of the spill queue.
+    """
+
+    def __init__(self, path, size=None):
+        """
+        :param path: the segment file path
+        :param size: the size of a new segment file, an existing segment is opened when not given
+        """
+        self.path = path
+        with open(path, 'w+b' if size else 'r+b') as segment_file:
+            if size:
+                segment_file.truncate(size)
+            self._mmap = mmap.mmap(segment_file.fileno(), 0)
+
+        self.read_offset = SEGMENT_HEADER.unpack_from(self._mmap, 0)[0] or SEGMENT_HEADER.size
+        self.write_offset = self.read_offset
+        self.pending = 0
+        while True:
+            length = self._record_length(self.write_offset)
+            if not length:
+                break
+            self.write_offset += RECORD_HEADER.size + length
+            self.pending += 1
+
+    @property
+    def size(self):
+        return len(self._mmap)
+
+    def _record_length(self, offset):
+        if offset + RECORD_HEADER.size > len(self._mmap):
+            return 0
+        return RECORD_HEADER.unpack_from(self._mmap, offset)[0]
+
+    def append(self, payload, sync):
+        """
+        :return: False if the record doesn't fit in the segment
+        """
+        end = self.write_offset + RECORD_HEADER.size + len(payload)
+        if end > len(self._mmap):
+            return False
+
+        self._mmap[self.write_offset + RECORD_HEADER.size:end] = payload
+        RECORD_HEADER.pack_into(self._mmap, self.write_offset, len(payload))
+        self.write_offset = end
+        self.pending += 1
+        if sync:
+            self._mmap.flush()
+        return True
+
+    def peek(self):
+        start = self.read_offset + RECORD_HEADER.size
+        return self._mmap[start:start + self._record_length(self.read_offset)]
+
+    def commit(self, sync):
+        self.read_offset += RECORD_HEADER.size + self._record_length(self.read_offset)
+        self.pending -= 1
+        SEGMENT_HEADER.pack_into(self._mmap, 0, self.read_offset)
+        if sync:
+            self._mmap.flush()
+
+    def close(self):
+        self._mmap.close()
+
+    def remove(self):
+        self.close()
+        os.remove(self.path)
+
+
+class SpillQueue(object):
+    """
+    Durable FIFO of serialized bulk chunks, kept in memory mapped segment files.
+
+    The :class:`~twistes.bulk_utils.BulkUtility` spills the chunks it fails to send
+    (on connection errors) and replays them in order once the cluster is reachable again,
+    so ingestion keeps going through outages without holding the chunks in memory.
+    The consumed position is stored in the segments, so pending chunks survive a restart.
+    Note: a chunk that was sent but not yet committed when the process died is replayed again,
+    use explicit document ids to make the replay idempotent.
+    """
+    SEGMENT_NAME = 'segment-{number:012d}.spill'
+    SEGMENT_SUFFIX = '.spill'
+
+    def __init__(self, directory, segment_size=64 * 1024 * 1024, max_bytes=1024 * 1024 * 1024, sync=True):
+        """
+        :param directory: the directory of the segment files, created if missing
+        :param segment_size: the size of each (preallocated) segment file
+        :param max_bytes: the cap of the total size of the segment files
+        :param sync: flush the segment to disk after each change
+        """
+        self._directory = directory
+        self._segment_size = segment_size
+        self._max_bytes = max_bytes
+        self._sync = sync
+        self._segments = deque()
+        self._next_number = 0
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(self.SEGMENT_SUFFIX):
+                self._segments.append(_Segment(os.path.join(directory, name)))
+                self._next_number = int(name[len('segment-'):-len(self.SEGMENT_SUFFIX)]) + 1
+
+        self._remove_consumed_segments()
+
+    def append(self, bulk_actions, params=None):
+        """
+        Spill a chunk.
+        :param bulk_actions: the serialized bulk lines of the chunk
+        :param params: the query params of the bulk request
+        :raise SpillQueueFull: if there is no room left for the chunk
+        """
+        payload = '\n'.join([json.dumps(params or {})] + list(bulk_actions)).encode('utf-8')
+        if self._segments and self._segments[-1].append(payload, self._sync):
+            return
+
+        size = max(self._segment_size, SEGMENT_HEADER.size + RECORD_HEADER.size + len(payload))
+        if self.disk_usage + size > self._max_bytes:
+            raise SpillQueueFull("spill queue is full, {size} bytes used".format(size=self.disk_usage))
+
+        segment = _Segment(os.path.join(self._directory, self.SEGMENT_NAME.format(number=self._next_number)), size)
+        self._next_number += 1
+        self._segments.append(segment)
+        segment.append(payload, self._sync)
+        self._remove_consumed_segments()
+
+    def peek(self):
+        """
+        :return: the oldest chunk as a tuple of (bulk lines, params), or None when the queue is empty
+        """
+        if not self:
+            return None
+
+        lines = self._segments[0].peek().decode('utf-8').split('\n')
+        return lines[1:], json.loads(lines[0])
+
+    def commit(self):
+        """
+        Remove the oldest chunk, once it was sent.
+        """
+        self._segments[0].commit(self._sync)
+        self._remove_consumed_segments()
+
+    def _remove_consumed_segments(self):
+        # the last segment is kept for the next appends
+        while len(self._segments) > 1 and not self._segments[0].pending:
+            self._segments.popleft().remove()
+
+    def close(self):
+        for segment in self._segments:
+            segment.close()
+        self._segments.clear()
+
+    @property
+    def disk_usage(self):
+        """ The total size in bytes of the segment files """
+        return sum(segment.size for segment in self._segments)
+
+    def __len__(self):
+        return sum(segment.pending for segment in self._segments)
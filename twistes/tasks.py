@@ -0,0 +1,98 @@
+from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
+
+from twistes.exceptions import ElasticsearchException, BulkIndexError
+
+
+class TaskHandle(object):
+    """
+    Handle of a server side task (delete by query, update by query, reindex)
+    that was submitted without waiting for its completion.
+
+    Usage:
+        task = yield es.delete_by_query('logs', body=query, requests_per_second=500, slices=5)
+        yield task.rethrottle(1000)
+        response = yield task.wait(progress_callback=log_status)
+    """
+    COMPLETED = 'completed'
+    TASK = 'task'
+    STATUS = 'status'
+    RESPONSE = 'response'
+    ERROR = 'error'
+    FAILURES = 'failures'
+
+    def __init__(self, es, task_id, action, index=None):
+        """
+        :param es: the Elasticsearch client
+        :param task_id: the id of the task ('<node id>:<task number>')
+        :param action: the api that created the task (e.g. '_delete_by_query'), used for rethrottling
+        :param index: the index the task modifies, its cached responses are invalidated once it completes
+        """
+        self._es = es
+        self.task_id = task_id
+        self.action = action
+        self.index = index
+
+    def status(self):
+        """
+        :return: deferred that fires with the current task info (see the tasks api)
+        """
+        return self._es.get_task(self.task_id)
+
+    def rethrottle(self, requests_per_second):
+        """
+        Change the throttling of the running task.
+        :param requests_per_second: the new requests per second, -1 to disable throttling
+        """
+        return self._es.rethrottle(self.task_id, requests_per_second, action=self.action)
+
+    def cancel(self):
+        """
+        Cancel the running task.
+        """
+        return self._es.cancel_task(self.task_id)
+
+    def wait(self, poll_interval=1.0, progress_callback=None, clock=None, raise_on_failures=True):
+        """
+        Poll the task until it completes.
+        :param poll_interval: the time in seconds between polls
+        :param progress_callback: callable called with the task status after each poll
+        :param clock: the time provider (IReactorTime), defaults to the reactor
+        :param raise_on_failures: fail with a ``BulkIndexError`` of the response ``failures`` when some
+            documents failed (e.g. version conflicts or rejections), otherwise they are left in the response
+        :return: deferred that fires with the task response once it completes,
+            or fails with an ElasticsearchException if the task failed
+        """
+        completed = []
+
+        def poll():
+            return self.status().addCallback(check)
+
+        def check(task_info):
+            if progress_callback is not None:
+                progress_callback(task_info.get(self.TASK, {}).get(self.STATUS))
+
+            if task_info.get(self.COMPLETED):
+                completed.append(task_info)
+                loop.stop()
+
+        def done(_):
+            self._es.invalidate_cache(self.index)
+            task_info = completed[0]
+            if self.ERROR in task_info:
+                msg_fmt = "task {task_id} failed; message: {msg}"
+                raise ElasticsearchException(msg_fmt.format(task_id=self.task_id, msg=str(task_info[self.ERROR])))
+
+            response = task_info.get(self.RESPONSE)
+            failures = (response or {}).get(self.FAILURES)
+            if failures and raise_on_failures:
+                msg_fmt = "task {task_id} completed with {num} failure(s)"
+                raise BulkIndexError(msg_fmt.format(task_id=self.task_id, num=len(failures)), failures)
+            return response
+
+        loop = LoopingCall(poll)
+        loop.clock = clock or reactor
+        return loop.start(poll_interval, now=True).addCallback(done)
+
+    def __repr__(self):
+        return '<TaskHandle {action} {task_id}>'.format(action=self.action, task_id=self.task_id)
@@ -0,0 +1,159 @@
+import json
+from base64 import b64encode
+
+from twisted.internet import reactor
+from twisted.internet.defer import succeed
+from twisted.web.client import Agent, HTTPConnectionPool, readBody
+from twisted.web.http_headers import Headers
+from twisted.web.iweb import IBodyProducer
+from zope.interface import implementer
+
+from twistes.compatability import string_types
+from twistes.consts import TREQ_POOL_DEFAULT_PARAMS
+
+
+@implementer(IBodyProducer)
+class BytesProducer(object):
+    """
+    Body producer of an in memory body, written to the connection in a single write
+    """
+
+    def __init__(self, body):
+        self._body = body
+        self.length = len(body)
+
+    def startProducing(self, consumer):
+        consumer.write(self._body)
+        return succeed(None)
+
+    def pauseProducing(self):
+        pass
+
+    def resumeProducing(self):
+        pass
+
+    def stopProducing(self):
+        pass
+
+
+class AgentResponse(object):
+    """
+    The response of the :class:`AgentTransport`, with the part of the treq response interface the client uses
+    """
+
+    def __init__(self, response):
+        self._response = response
+        self.code = response.code
+        self.headers = response.headers
+        self._content = None
+
+    def content(self):
+        """
+        :return: deferred that fires with the response body, the body is read once and kept
+        """
+        if self._content is not None:
+            return succeed(self._content)
+
+        d = readBody(self._response)
+        d.addCallback(self._cache_content)
+        return d
+
+    def _cache_content(self, content):
+        self._content = content
+        return content
+
+    def json(self):
+        """
+        :return: deferred that fires with the decoded json body
+        """
+        d = self.content()
+        d.addCallback(lambda content: json.loads(content.decode('utf-8')))
+        return d
+
+
+class AgentTransport(object):
+    """
+    Lean http client built directly on the twisted.web Agent, an alternative to treq.
+
+    It implements the ``request`` interface the client expects from its ``async_http_client``,
+    with the request headers (authorization included) computed once and reused, and the body sent
+    as a single write. Usage:
+        es = Elasticsearch(hosts, async_http_client=AgentTransport())
+    """
+    DEFAULT_HEADERS = {b'Content-Type': [b'application/json'], b'Accept': [b'application/json']}
+
+    def __init__(self, pool=None, headers=None, connect_timeout=None, clock=None, **pool_params):
+        """
+        :param pool: the HTTPConnectionPool, a persistent pool is created when not given
+        :param headers: additional headers of every request (dict of header name to value)
+        :param connect_timeout: the connection timeout in seconds
+        :param clock: the reactor, defaults to the global reactor
+        :param pool_params: the created pool params, the missing ones are taken from TREQ_POOL_DEFAULT_PARAMS
+        """
+        self._clock = clock or reactor
+        if pool is None:
+            pool = HTTPConnectionPool(self._clock, pool_params.pop('persistent', True))
+            for key, default_value in TREQ_POOL_DEFAULT_PARAMS.items():
+                setattr(pool, key, pool_params.pop(key, default_value))
+        self.pool = pool
+
+        agent_params = {'connectTimeout': connect_timeout} if connect_timeout else {}
+        self._agent = Agent(self._clock, pool=pool, **agent_params)
+
+        self._raw_headers = dict(self.DEFAULT_HEADERS)
+        for name, value in (headers or {}).items():
+            self._raw_headers[self._to_bytes(name)] = [self._to_bytes(value)]
+        self._headers_by_auth = {}
+
+    @staticmethod
+    def _to_bytes(value):
+        return value.encode('utf-8') if not isinstance(value, bytes) else value
+
+    def _headers(self, auth):
+        """
+        :return: the request headers for the auth, computed once per auth
+        """
+        headers = self._headers_by_auth.get(auth)
+        if headers is None:
+            raw_headers = dict(self._raw_headers)
+            if auth:
+                credentials = b64encode(self._to_bytes('{user}:{password}'.format(user=auth[0], password=auth[1])))
+                raw_headers[b'Authorization'] = [b'Basic ' + credentials]
+            headers = self._headers_by_auth[auth] = Headers(raw_headers)
+        return headers
+
+    def request(self, method, url, data=None, timeout=None, auth=None, **kwargs):
+        """
+        Send a request.
+        :param method: the http method
+        :param url: the full url
+        :param data: the request body (bytes or text)
+        :param timeout: the time in seconds to wait for the response headers before cancelling the request
+        :param auth: tuple of the basic auth user and password
+        :return: deferred that fires with an :class:`AgentResponse`
+        """
+        if isinstance(method, string_types) and not isinstance(method, bytes):
+            method = method.encode('ascii')
+        if data is not None:
+            data = BytesProducer(self._to_bytes(data))
+
+        d = self._agent.request(method, self._to_bytes(url), self._headers(auth), data)
+
+        if timeout:
+            delayed_call = self._clock.callLater(timeout, d.cancel)
+
+            def got_result(result):
+                if delayed_call.active():
+                    delayed_call.cancel()
+                return result
+
+            d.addBoth(got_result)
+
+        d.addCallback(AgentResponse)
+        return d
+
+    def close(self):
+        """
+        Close the pooled connections.
+        """
+        return self.pool.closeCachedConnections()
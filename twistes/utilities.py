@@ -1,4 +1,5 @@
-from twistes.consts import EsConst, EsAggregation
+from twistes.consts import EsConst, EsAggregation, MonitoredSections
+from twistes.lag_monitor import section
 from twistes.exceptions import ScanError
 
 
@@ -35,6 +36,100 @@ class EsUtils(object):
         else:
             return []
 
+    @staticmethod
+    def flatten_aggregation_results(results, agg_name):
+        """
+        Flatten a (nested) bucket aggregation into columns in one pass, with a row per leaf bucket.
+        Every bucket aggregation level (terms, date_histogram, histogram, ...) adds the
+        ``<agg>.key`` and ``<agg>.doc_count`` columns (and ``<agg>.key_as_string`` when given),
+        single value metrics add a ``<agg>`` column and multi value metrics (e.g. stats) add
+        a ``<agg>.<value>`` column per value. A parent level values are repeated in its leaf rows.
+        Single bucket aggregations (filter, nested, ...) add a ``<agg>.doc_count`` column and their
+        sub aggregations are flattened into the same row.
+        :param results: the search response
+        :param agg_name: the name of the top level bucket aggregation
+        :return: dict of column name to a list of values, all of the same length
+            (None where a bucket has no value), ready to be turned into numpy arrays
+        :raise ValueError: if a bucket has more than one nested bucket aggregation, their rows can't be combined
+        """
+        columns = {}
+        if not EsUtils.has_aggregation_results(results, agg_name):
+            return columns
+
+        rows = [0]
+
+        def emit(row):
+            for name, value in row.items():
+                column = columns.get(name)
+                if column is None:
+                    column = columns[name] = [None] * rows[0]
+                column.append(value)
+            rows[0] += 1
+            for column in columns.values():
+                if len(column) < rows[0]:
+                    column.append(None)
+
+        def collect(bucket, row):
+            """
+            Add the values of the bucket sub aggregations to the row.
+            :return: the (name, agg) of the nested bucket aggregation, None if there is none
+            """
+            child = None
+            for sub_name, sub_agg in bucket.items():
+                if not isinstance(sub_agg, dict):
+                    continue
+                if EsAggregation.BUCKETS in sub_agg:
+                    nested = sub_name, sub_agg
+                elif EsAggregation.DOC_COUNT in sub_agg:
+                    # a single bucket aggregation, its sub aggregations belong to the same row
+                    row[sub_name + '.' + EsAggregation.DOC_COUNT] = sub_agg[EsAggregation.DOC_COUNT]
+                    nested = collect(sub_agg, row)
+                else:
+                    EsUtils._flatten_metric(sub_name, sub_agg, row)
+                    continue
+
+                if nested is None:
+                    continue
+                if child is not None:
+                    raise ValueError("can't flatten sibling bucket aggregations {first} and {second}".format(
+                        first=child[0], second=nested[0]))
+                child = nested
+            return child
+
+        def walk(name, agg, parent_row):
+            buckets = agg[EsAggregation.BUCKETS]
+            # keyed aggregations (e.g. filters) return the buckets by key
+            items = buckets.items() if isinstance(buckets, dict) else ((None, b) for b in buckets)
+            for key, bucket in items:
+                row = dict(parent_row)
+                row[name + '.' + EsAggregation.KEY] = bucket.get(EsAggregation.KEY, key)
+                row[name + '.' + EsAggregation.DOC_COUNT] = bucket.get(EsAggregation.DOC_COUNT)
+                if EsAggregation.KEY_AS_STRING in bucket:
+                    row[name + '.' + EsAggregation.KEY_AS_STRING] = bucket[EsAggregation.KEY_AS_STRING]
+
+                child = collect(bucket, row)
+                if child:
+                    walk(child[0], child[1], row)
+                else:
+                    emit(row)
+
+        with section(MonitoredSections.FLATTEN_AGGREGATIONS) as timed:
+            walk(agg_name, results[EsAggregation.AGGREGATIONS][agg_name], {})
+            timed.size = rows[0]
+        return columns
+
+    @staticmethod
+    def _flatten_metric(name, agg, row):
+        if EsAggregation.VALUE in agg:
+            row[name] = agg[EsAggregation.VALUE]
+            return
+
+        for key, value in agg.items():
+            if isinstance(value, dict):
+                EsUtils._flatten_metric(name + '.' + key, value, row)
+            elif not isinstance(value, list):
+                row[name + '.' + key] = value
+
     @staticmethod
     def is_get_query_with_results(results):
         """